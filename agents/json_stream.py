@@ -0,0 +1,40 @@
+"""
+json_stream — helpers for reading JSON replies streamed by an LLM.
+
+Shared by the router and the read agent, which both stream a JSON object
+and stop reading as soon as it is complete. Kept free of LLM, database and
+agent imports so either agent can use it without pulling in the other.
+"""
+
+
+def first_json_object(chunks) -> str:
+    """
+    Join streamed chunks up to the brace that closes the first JSON object.
+
+    Stops consuming the stream there, so trailing tokens (closing fences,
+    commentary) are never waited for. Braces inside strings are ignored.
+    """
+    buffer = []
+    depth = 0
+    in_string = escaped = False
+    for chunk in chunks:
+        text = chunk.content if hasattr(chunk, "content") else chunk
+        for i, ch in enumerate(text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}" and depth:
+                depth -= 1
+                if not depth:
+                    buffer.append(text[:i + 1])
+                    return "".join(buffer)
+        buffer.append(text)
+    return "".join(buffer)
@@ -9,15 +9,122 @@ Responsibilities:
 - NEVER execute writes
 - Return human-readable explanations
 """
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from typing import Dict, Any, Literal
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from pydantic import BaseModel, Field
-from database_config import USE_POSTGRES, fetch_all, fetch_one
-import unicodedata
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from database_config import USE_POSTGRES, fetch_all, fetch_one, get_data_version
 
+from .json_stream import first_json_object
 from .state import AgentState
 
+logger = logging.getLogger(__name__)
+
+# Classifications are memoized per agent instance. Console traffic is highly
+# repetitive ("cuántas pulseras tengo?", "cuánto vendí?"), so a hit skips the
+# LLM round-trip entirely.
+CLASSIFICATION_CACHE_SIZE = 512
+
+# Formatted answers, keyed by the classification plus the database change
+# stamp. A write moves the stamp forward, so stale entries are never hit and
+# simply age out of the LRU.
+RESULT_CACHE_SIZE = 256
+
+
+class _LockedLRU:
+    """Bounded LRU mapping shared by request threads; every access holds the lock."""
+
+    def __init__(self, maxsize: int):
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value (marking it recently used), or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        """Store value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+
+_RESULT_CACHE = _LockedLRU(RESULT_CACHE_SIZE)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Keyword router for obvious questions. Patterns run over normalize_text()
+# output (no accents, lowercase). A question that matches exactly one query
+# type is classified here; multi-match and no-match fall through to the LLM.
+_INTENT_PATTERNS = [
+    ("STOCK_QUERY", re.compile(r"\b(stock|inventario|quedan?)\b")),
+    ("REVENUE_QUERY", re.compile(r"\b(ingresos?|revenue|facturad[oa]|facturacion|vendido)\b")),
+    ("PROFIT_QUERY", re.compile(r"\b(ganancias?|profit|utilidad(es)?|beneficios?|ganado)\b")),
+    ("SALES_QUERY", re.compile(r"\b(ventas|sales|transacciones|historial)\b")),
+    ("EXPENSE_QUERY", re.compile(r"\b(gastos?|expenses?|gastado|egresos?)\b")),
+    ("PRODUCT_INFO", re.compile(r"\b(precios?|prices?|sku|productos|catalogo)\b")),
+]
+# Appended to answers computed right after a write (MIXED intent).
+POST_WRITE_NOTE = "\n\n_Datos actualizados después de la operación reciente._"
+
+# Write requests that were misrouted here. "venta" is left out on purpose:
+# "historial de venta" is a read question.
+_WRITE_HINT_RE = re.compile(
+    r"\b(registr(ar|ame|a)|crear?|agregar|vender|descontar\s+stock|cargar\s+producto)\b"
+)
+
+# Expense look-back per time reference, checked in order by substring.
+_PERIOD_DAYS = {"semana": 7, "week": 7, "mes": 30, "month": 30, "hoy": 0, "today": 0}
+
+_QUANTITY_QUESTION_RE = re.compile(r"\b(cuant[oa]s?|cual(es)?|how (much|many))\b")
+_ALL_PERIOD_RE = re.compile(r"\b(todos|todas|all|total(es)?)\b")
+_WORD_RE = re.compile(r"[a-z]+")
+
+# Accented letters seen in Spanish/Portuguese input, folded in one C-level
+# pass (applied after lower(), so only lowercase forms are listed).
+_ACCENT_TABLE = str.maketrans(
+    "áàâäãéèêëíìîïóòôöõúùûüñç",
+    "aaaaaeeeeiiiiooooouuuunc",
+)
+
+# Accent-insensitive product name expression (same folding as the resolver).
+_NAME_NORMALIZED_SQL = (
+    "REPLACE(REPLACE(REPLACE(REPLACE(LOWER(name), 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o')"
+)
+
+_NAME_LIKE_SQL = f"{_NAME_NORMALIZED_SQL} LIKE %s"
+
+# Filler words dropped from product references before matching names.
+_STOCK_STOPWORDS = frozenset({
+    "de", "granos", "cafe", "con", "la", "el", "coffee", "bean", "beans",
+})
+_NAME_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Words a stock question can carry without naming a product. A stock
+# question with any other word ("pulseras negras") needs the LLM to extract
+# product_names, so the keyword router leaves it alone.
+_GENERIC_STOCK_WORDS = frozenset({
+    "stock", "inventario", "queda", "quedan", "cuanto", "cuanta", "cuantos",
+    "cuantas", "tengo", "hay", "me", "mi", "mis", "de", "del", "el", "la",
+    "los", "las", "cada", "producto", "productos", "todo", "todos", "total",
+    "que", "como", "esta", "actual", "mostrame", "muestrame", "dame",
+    "decime", "ver", "y", "en", "how", "much", "what", "is", "my", "the",
+    "of", "each", "all", "current", "show",
+})
+
 
 # Entity extraction model
 class ExtractedEntities(BaseModel):
@@ -40,18 +147,154 @@ class QueryClassification(BaseModel):
     reasoning: str = Field(description="Brief explanation of classification")
 
 
+_CLASSIFICATION_ADAPTER = TypeAdapter(QueryClassification)
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_classification(message) -> Dict[str, Any]:
+    """
+    Parse the classifier's reply into a dict.
+
+    Validated straight from the JSON text by pydantic's compiled validator.
+    Replies that do not fit the schema (e.g. "type" instead of "query_type")
+    are returned as plain JSON so freeze_classification can still read them.
+    """
+    text = message.content if hasattr(message, "content") else message
+    text = _JSON_FENCE_RE.sub("", text.strip())
+    try:
+        return _CLASSIFICATION_ADAPTER.validate_json(text).model_dump()
+    except ValidationError:
+        return json.loads(text)
+
+
 def normalize_text(text: str) -> str:
-    """Normalize text by removing accents."""
-    # Remove accents
-    text = ''.join(
-        c for c in unicodedata.normalize('NFD', text)
-        if unicodedata.category(c) != 'Mn'
+    """Normalize text by lowercasing and removing accents."""
+    return text.lower().translate(_ACCENT_TABLE)
+
+
+def classification_cache_key(user_input: str) -> str:
+    """
+    Build the classifier cache key for a user question.
+
+    Accents and case are dropped and whitespace is collapsed, so "Cuántas
+    pulseras" and "cuantas  pulseras" share one entry. Digits are kept: they
+    change the time period ("últimos 7 días") and product names ("talle 2").
+    The key is only used for the lookup; the LLM sees the original question.
+    """
+    return _WHITESPACE_RE.sub(" ", normalize_text(user_input)).strip()
+
+
+def freeze_classification(classification: Dict[str, Any]) -> tuple:
+    """
+    Reduce a classifier response to a hashable (query_type, time_period,
+    product_names) tuple suitable for caching.
+    """
+    # Handle multiple possible keys (LLM sometimes uses different names)
+    query_type = (classification.get("query_type") or
+                  classification.get("type") or
+                  classification.get("classification"))
+    entities = classification.get("entities")
+    if not isinstance(entities, dict):
+        entities = {}
+
+    time_period = entities.get("time_period") or ""
+    product_names = tuple(str(name) for name in entities.get("product_names") or ())
+    return (query_type, str(time_period), product_names)
+
+
+def thaw_classification(frozen: tuple) -> tuple[str, Dict[str, Any]]:
+    """Expand a cached classification into a fresh (query_type, entities) pair."""
+    query_type, time_period, product_names = frozen
+    return query_type, {
+        "product_names": list(product_names),
+        "time_period": time_period,
+    }
+
+
+def _current_message_text(user_input: str) -> str:
+    """Normalized current message, without the conversation context."""
+    _, _, current_message = user_input.rpartition("Mensaje actual:")
+    return normalize_text(current_message)
+
+
+def _matched_intents(text: str) -> list[str]:
+    """Query types whose keyword pattern appears in normalized text."""
+    return [query_type for query_type, pattern in _INTENT_PATTERNS if pattern.search(text)]
+
+
+def misrouted_read_reply(user_input: str) -> str | None:
+    """
+    Canned reply for input the read agent cannot answer (empty, too short,
+    or a write request), so it is not sent to the LLM classifier.
+    """
+    text = _current_message_text(user_input).strip()
+    if len(text) < 3:
+        return "No recibí ninguna pregunta. ¿Qué querés consultar?"
+    if _WRITE_HINT_RE.search(text):
+        return (
+            "Eso parece una operación (registrar, vender, agregar stock...), "
+            "no una consulta. Decímela como una acción, por ejemplo: "
+            "\"vendí 2 pulseras negras\" o \"agregar 10 pulseras al stock\"."
+        )
+    return None
+
+
+def names_read_intent(user_input: str) -> bool:
+    """
+    Whether the current message asks something specific: an analytical
+    topic, or a quantity question ("cuántas pulseras negras tengo?").
+    """
+    text = _current_message_text(user_input)
+    return bool(_QUANTITY_QUESTION_RE.search(text) or _matched_intents(text))
+
+
+def keyword_classification(user_input: str) -> tuple | None:
+    """
+    Classify obvious questions with precompiled keyword patterns.
+
+    Only the current message is inspected (conversation context is ignored).
+
+    Returns:
+        Frozen classification tuple (see freeze_classification), or None when
+        the question is ambiguous and must go to the LLM classifier.
+    """
+    text = _current_message_text(user_input)
+
+    matches = _matched_intents(text)
+    if len(matches) != 1:
+        return None
+
+    query_type = matches[0]
+    if query_type == "STOCK_QUERY" and not _GENERIC_STOCK_WORDS.issuperset(_WORD_RE.findall(text)):
+        return None
+
+    time_period = "todos" if _ALL_PERIOD_RE.search(text) else ""
+    return (query_type, time_period, ())
+
+
+def result_cache_key(query_type: str, entities: Dict[str, Any]) -> tuple | None:
+    """
+    Build the formatted-result cache key, or None when the backend cannot
+    report a data version (caching disabled).
+
+    Today's date is part of the key because time-period filters are
+    relative to it.
+    """
+    data_version = get_data_version()
+    if data_version is None:
+        return None
+    return (
+        query_type,
+        tuple(sorted(entities.get("product_names") or ())),
+        str(entities.get("time_period") or ""),
+        date.today(),
+        data_version,
     )
-    return text.lower()
 
 
-CLASSIFIER_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", """You are a query classifier for a business analytics system.
+# Static system text, sent as a literal message so every classification starts
+# with the same byte-identical prefix (required for provider prefix caching).
+CLASSIFIER_SYSTEM_PROMPT = """You are a query classifier for a business analytics system.
 
 Classify the user's question into one of these types:
 
@@ -141,52 +384,48 @@ Before responding, think step-by-step:
 
 Include your reasoning in the 'reasoning' field to explain your decision.
 
-Output valid JSON only."""),
+Output valid JSON only."""
+
+CLASSIFIER_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessage(content=CLASSIFIER_SYSTEM_PROMPT),
     ("user", "{input}")
 ])
 
 
-def generate_stock_query(entities: dict) -> str:
+def generate_stock_query(entities: dict) -> tuple[str, tuple]:
     """
     Generate SQL for stock queries.
 
+    User words are bound as parameters, so the statement text only depends
+    on how many words were given and the driver can reuse its prepared plan.
+
     Args:
         entities: Extracted entities from classification
 
     Returns:
-        SQL query string
+        (SQL query string, bound parameters)
     """
     product_names = entities.get("product_names", [])
 
     if product_names:
         # Filter by specific products
-        # Split product names into words and search for each word
+        # Every word adds the same accent-insensitive LIKE, matched on the
+        # singular form: '%pulsera%' already covers 'pulseras'.
         all_conditions = []
+        params = []
 
         for name in product_names:
-            # Split into individual words
-            words = name.lower().split()
-
-            # For each word, create conditions (handle plural/singular + accents)
-            word_conditions = []
-            for word in words:
-                # Skip common words
-                if word in ["de", "granos", "cafe", "con", "la", "el", "coffee", "bean", "beans"]:
-                    continue
-
-                # Normalize and try both singular and plural forms
-                word_normalized = normalize_text(word)
-                word_singular = word_normalized.rstrip('s') if word_normalized.endswith('s') else word_normalized
-
-                # Use SQL accent-insensitive matching (same as resolver)
-                word_conditions.append(
-                    f"(REPLACE(REPLACE(REPLACE(REPLACE(LOWER(name), 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o') LIKE '%{word_normalized}%' OR "
-                    f"REPLACE(REPLACE(REPLACE(REPLACE(LOWER(name), 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o') LIKE '%{word_singular}%')"
+            singulars = [
+                word[:-1] if word.endswith("s") else word
+                for word in _NAME_WORD_RE.findall(normalize_text(name))
+                if word not in _STOCK_STOPWORDS
+            ]
+            # All words of one product must match
+            if singulars:
+                all_conditions.append(
+                    "(" + " AND ".join([_NAME_LIKE_SQL] * len(singulars)) + ")"
                 )
-
-            # Join word conditions with AND (all words must match)
-            if word_conditions:
-                all_conditions.append(f"({' AND '.join(word_conditions)})")
+                params.extend(f"%{word}%" for word in singulars)
 
         if all_conditions:
             where_clause = " OR ".join(all_conditions)
@@ -195,88 +434,114 @@ def generate_stock_query(entities: dict) -> str:
             FROM stock_current
             WHERE {where_clause}
             ORDER BY name
-            """
+            """, tuple(params)
 
     # All stock (no filter or no valid conditions)
     return """
     SELECT name, stock_qty
     FROM stock_current
     ORDER BY name
-    """
+    """, ()
 
 
-def generate_revenue_query(entities: dict) -> str:
+def generate_revenue_query(entities: dict) -> tuple[str, tuple]:
     """Generate SQL for revenue queries."""
     return """
     SELECT
         total_revenue_cents / 100.0 as revenue_usd
     FROM revenue_paid
-    """
+    """, ()
 
 
-def generate_profit_query(entities: dict) -> str:
+def generate_profit_query(entities: dict) -> tuple[str, tuple]:
     """Generate SQL for profit queries."""
     return """
     SELECT profit_usd
     FROM profit_summary
+    """, ()
+
+
+def generate_summary_query(entities: dict) -> tuple[str, tuple]:
     """
+    Generate SQL for the post-write business snapshot.
 
+    Stock, revenue and profit come back in one round-trip as
+    (kind, label, value) rows; format_summary_result pivots them.
+    """
+    return """
+    SELECT 'stock' AS kind, name AS label, stock_qty AS value FROM stock_current
+    UNION ALL
+    SELECT 'revenue', CAST(NULL AS TEXT), total_revenue_cents / 100.0 FROM revenue_paid
+    UNION ALL
+    SELECT 'profit', CAST(NULL AS TEXT), profit_usd FROM profit_summary
+    """, ()
+
+
+def generate_sales_query(entities: dict) -> tuple[str, tuple]:
+    """
+    Generate SQL for sales history queries.
+
+    The 10 most recent sales are picked first (idx_sales_created_at), and
+    item names are aggregated only for those, instead of joining and
+    grouping the whole sales history before applying the LIMIT.
+    """
+    item_aggregation = (
+        "STRING_AGG(p.name || ' (' || CAST(si.quantity AS TEXT) || ')', ', ')"
+        if USE_POSTGRES
+        else "GROUP_CONCAT(p.name || ' (' || si.quantity || ')', ', ')"
+    )
 
-def generate_sales_query(entities: dict) -> str:
-    """Generate SQL for sales history queries."""
-    item_aggregation = (
-        "STRING_AGG(p.name || ' (' || CAST(si.quantity AS TEXT) || ')', ', ')"
-        if USE_POSTGRES
-        else "GROUP_CONCAT(p.name || ' (' || si.quantity || ')', ', ')"
-    )
-
-    return """
-    SELECT
-        s.id,
-        s.sale_number,
-        s.total_amount_cents / 100.0 as total_usd,
-        s.status,
-        s.created_at,
-        {item_aggregation} as items
-    FROM sales s
-    LEFT JOIN sale_items si ON s.id = si.sale_id
-    LEFT JOIN products p ON si.product_id = p.id
-    GROUP BY s.id
-    ORDER BY s.created_at DESC
-    LIMIT 10
-    """.format(item_aggregation=item_aggregation)
-
-
-def generate_expense_query(entities: dict) -> str:
-    """Generate SQL for expense queries."""
-    from datetime import datetime, timedelta
-
-    time_period = entities.get("time_period", [])
-
-    # Build WHERE clause based on time period
+    return """
+    WITH recent AS (
+        SELECT id, sale_number, total_amount_cents, status, created_at
+        FROM sales
+        ORDER BY created_at DESC
+        LIMIT 10
+    )
+    SELECT
+        r.id,
+        r.sale_number,
+        r.total_amount_cents / 100.0 as total_usd,
+        r.status,
+        r.created_at,
+        (
+            SELECT {item_aggregation}
+            FROM sale_items si
+            JOIN products p ON si.product_id = p.id
+            WHERE si.sale_id = r.id
+        ) as items
+    FROM recent r
+    ORDER BY r.created_at DESC
+    """.format(item_aggregation=item_aggregation), ()
+
+
+def generate_expense_query(entities: dict) -> tuple[str, tuple]:
+    """
+    Generate SQL for expense queries.
+
+    The date is bound as a parameter, so there are only three statement
+    texts (unfiltered, today, since a start date) regardless of the day or
+    period asked.
+    """
+    time_ref = str(entities.get("time_period") or "").lower()
+
+    # IMPORTANT: If user explicitly asks for "all" or "todos", don't filter by time
+    days = None
+    if not ("todos" in time_ref or "all" in time_ref or "total" in time_ref):
+        days = next(
+            (n for word, n in _PERIOD_DAYS.items() if word in time_ref),
+            None,
+        )
+
+    params = ()
     where_clause = ""
-    if time_period:
-        # Parse time period references
-        time_ref = str(time_period).lower() if time_period else ""
-
-        # IMPORTANT: If user explicitly asks for "all" or "todos", don't filter by time
-        if "todos" in time_ref or "all" in time_ref or "total" in time_ref:
-            # No WHERE clause - show all expenses
-            where_clause = ""
-        else:
-            today = datetime.now().date()
-
-            if "semana" in time_ref or "week" in time_ref:
-                # Last 7 days
-                start_date = (today - timedelta(days=7)).isoformat()
-                where_clause = f"WHERE expense_date >= '{start_date}'"
-            elif "mes" in time_ref or "month" in time_ref:
-                # Last 30 days
-                start_date = (today - timedelta(days=30)).isoformat()
-                where_clause = f"WHERE expense_date >= '{start_date}'"
-            elif "hoy" in time_ref or "today" in time_ref:
-                # Today
-                where_clause = f"WHERE expense_date = '{today.isoformat()}'"
+    if days == 0:
+        # Today only: future-dated expenses are not "de hoy"
+        where_clause = "WHERE expense_date = %s"
+        params = (date.today().isoformat(),)
+    elif days is not None:
+        where_clause = "WHERE expense_date >= %s"
+        params = ((date.today() - timedelta(days=days)).isoformat(),)
 
     return f"""
     SELECT
@@ -289,10 +554,10 @@ def generate_expense_query(entities: dict) -> str:
     {where_clause}
     ORDER BY expense_date DESC, created_at DESC
     LIMIT 20
-    """
+    """, params
 
 
-def generate_product_info_query(entities: dict) -> str:
+def generate_product_info_query(entities: dict) -> tuple[str, tuple]:
     """Generate SQL for product information queries."""
     return """
     SELECT
@@ -301,22 +566,18 @@ def generate_product_info_query(entities: dict) -> str:
         unit_price_cents / 100.0 as price_usd,
         unit_cost_cents / 100.0 as cost_usd
     FROM products
-    WHERE is_active = TRUE
+    WHERE is_active = TRUE
     ORDER BY name
-    """
+    """, ()
 
 
-def format_stock_result(rows) -> str:
-    """Format stock query results for user."""
-    if not rows:
-        return "No hay productos en el inventario."
-
-    lines = ["*📦 Stock disponible:*\n"]
-    for row in rows:
-        name = row["name"]
-        qty = row["stock_qty"]
-        lines.append(f"• {name}: *{qty}* unidades")
+def format_stock_result(rows) -> str:
+    """Format stock query results for user."""
+    if not rows:
+        return "No hay productos en el inventario."
 
+    lines = ["*📦 Stock disponible:*\n"]
+    lines.extend(f"• {row['name']}: *{row['stock_qty']}* unidades" for row in rows)
     return "\n".join(lines)
 
 
@@ -341,6 +602,43 @@ def format_profit_result(rows) -> str:
         return f"*📉 Pérdida total:* ${abs(profit):,.2f}"
 
 
+def format_summary_result(rows) -> str:
+    """Format the stock/revenue/profit snapshot shown after a write."""
+    by_kind = {"stock": [], "revenue": [], "profit": []}
+    for row in rows or ():
+        by_kind[row["kind"]].append(row)
+
+    stock_rows = [{"name": row["label"], "stock_qty": row["value"]} for row in by_kind["stock"]]
+    # Aggregate views yield NULL on an empty ledger
+    revenue_rows = [{"revenue_usd": row["value"] or 0} for row in by_kind["revenue"]]
+    profit_rows = [{"profit_usd": row["value"] or 0} for row in by_kind["profit"]]
+
+    return "\n\n".join([
+        format_stock_result(stock_rows),
+        format_revenue_result(revenue_rows),
+        format_profit_result(profit_rows),
+    ])
+
+
+def format_short_date(value, with_time: bool = False) -> str:
+    """
+    Render a stored date as 'DD/MM' (or 'DD/MM HH:MM').
+
+    SQLite hands back ISO strings, which are sliced directly; Postgres hands
+    back date/datetime objects. Anything else is shown truncated.
+    """
+    if isinstance(value, datetime):
+        return value.strftime("%d/%m %H:%M" if with_time else "%d/%m")
+    if isinstance(value, date):
+        return value.strftime("%d/%m")
+    text = str(value)
+    if len(text) < 10 or text[4] != "-" or text[7] != "-":
+        return text[:16] if with_time else text[:10]
+    if with_time and len(text) >= 16:
+        return f"{text[8:10]}/{text[5:7]} {text[11:16]}"
+    return f"{text[8:10]}/{text[5:7]}"
+
+
 def format_sales_result(rows) -> str:
     """Format sales history results."""
     if not rows:
@@ -357,12 +655,7 @@ def format_sales_result(rows) -> str:
         items = row["items"] or "Productos varios"
 
         # Format date nicely (remove seconds and milliseconds)
-        try:
-            from datetime import datetime
-            date_obj = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-            date_display = date_obj.strftime("%d/%m %H:%M")
-        except:
-            date_display = date_str[:16]  # Fallback to truncated string
+        date_display = format_short_date(date_str, with_time=True)
 
         # Translate status
         status_es = "✅" if status == "PAID" else "⏳"
@@ -373,13 +666,13 @@ def format_sales_result(rows) -> str:
     return "\n".join(lines)
 
 
-def format_expense_result(rows) -> str:
-    """Format expense query results."""
-    if not rows:
-        # Check if this might be a filtering issue vs actually no expenses
-        total_expenses = fetch_one("SELECT COUNT(*) as count FROM expenses")
-        if total_expenses and total_expenses['count'] > 0:
-            return (
+def format_expense_result(rows) -> str:
+    """Format expense query results."""
+    if not rows:
+        # Check if this might be a filtering issue vs actually no expenses
+        total_expenses = fetch_one("SELECT COUNT(*) as count FROM expenses")
+        if total_expenses and total_expenses['count'] > 0:
+            return (
                 f"No encontré gastos en el período consultado, "
                 f"pero hay {total_expenses['count']} gastos en total.\n\n"
                 "¿Querés ver todos los gastos? Decime 'mostrame todos los gastos'"
@@ -391,31 +684,13 @@ def format_expense_result(rows) -> str:
 
     for row in rows:
         # sqlite3.Row uses dict-like access
-        date = row["expense_date"] if row["expense_date"] else row["created_at"]
-        category = row["category"]
+        expense_date = row["expense_date"] or row["created_at"]
         description = row["description"]
         amount = row["amount_usd"]
         total += amount
 
         # Format date nicely (show only day/month)
-        try:
-            from datetime import datetime
-            if isinstance(date, str):
-                date_obj = datetime.fromisoformat(date.replace("Z", "+00:00"))
-                date_display = date_obj.strftime("%d/%m")
-            else:
-                date_display = str(date)[:5]  # Just DD/MM
-        except:
-            date_display = str(date)[:10]  # Fallback
-
-        # Translate category
-        category_es = {
-            "GENERAL": "General",
-            "MATERIALS": "Materiales",
-            "SHIPPING": "Envío",
-            "MARKETING": "Marketing",
-            "OTHER": "Otro"
-        }.get(category, category)
+        date_display = format_short_date(expense_date)
 
         lines.append(f"• _{date_display}_: {description} - *${amount:.2f}*")
 
@@ -429,14 +704,23 @@ def format_product_info_result(rows) -> str:
         return "No hay productos registrados."
 
     lines = ["*📋 Productos:*\n"]
-    for row in rows:
-        name = row["name"]
-        price = row["price_usd"]
-        lines.append(f"• {name} - *${price:.2f}*")
-
+    lines.extend(f"• {row['name']} - *${row['price_usd']:.2f}*" for row in rows)
     return "\n".join(lines)
 
 
+# (SQL generator, result formatter) per query type. GENERAL_QUERY has no
+# entry and gets the clarification reply.
+_QUERY_HANDLERS = {
+    "STOCK_QUERY": (generate_stock_query, format_stock_result),
+    "REVENUE_QUERY": (generate_revenue_query, format_revenue_result),
+    "PROFIT_QUERY": (generate_profit_query, format_profit_result),
+    "SALES_QUERY": (generate_sales_query, format_sales_result),
+    "EXPENSE_QUERY": (generate_expense_query, format_expense_result),
+    "PRODUCT_INFO": (generate_product_info_query, format_product_info_result),
+    "SUMMARY_QUERY": (generate_summary_query, format_summary_result),
+}
+
+
 def create_read_agent(llm):
     """
     Create the custom read-only analytics agent.
@@ -447,8 +731,24 @@ def create_read_agent(llm):
     Returns:
         Agent function that takes AgentState and returns analytical results
     """
-    parser = JsonOutputParser(pydantic_object=QueryClassification)
-    classifier_chain = CLASSIFIER_PROMPT | llm | parser
+    classifier_chain = CLASSIFIER_PROMPT | llm
+
+    classification_cache = _LockedLRU(CLASSIFICATION_CACHE_SIZE)
+
+    def _classify_cached(user_input: str) -> tuple:
+        """Classify a question, hitting the LLM only on a cache miss."""
+        cache_key = classification_cache_key(user_input)
+        frozen = classification_cache.get(cache_key)
+        if frozen is not None:
+            return frozen
+
+        # Stream the reply and stop reading once the JSON object is complete
+        chunks = classifier_chain.stream({"input": user_input})
+        classification = parse_classification(first_json_object(chunks))
+        frozen = freeze_classification(classification)
+
+        classification_cache.put(cache_key, frozen)
+        return frozen
 
     def execute_read(state: AgentState) -> Dict[str, Any]:
         """
@@ -460,29 +760,35 @@ def create_read_agent(llm):
         Returns:
             Updated state with sql_result
         """
+        # Classify the text as given, even after a write (MIXED intent), so
+        # the question keeps hitting the classification cache. The "after the
+        # operation" context is added to the answer instead.
         user_input = state["user_input"]
 
-        # If coming from a MIXED intent and already have operation_result,
-        # modify the query to reflect "after the operation"
-        if state.get("operation_result"):
-            user_input = f"{user_input} (after the recent operation)"
+        # Misrouted writes and empty input never reach the classifier. After a
+        # write (MIXED) the message legitimately contains the write words.
+        if not state.get("operation_result"):
+            reply = misrouted_read_reply(user_input)
+            if reply:
+                return {
+                    "sql_result": reply,
+                    "messages": [{
+                        "role": "assistant",
+                        "content": "[Read Agent] Not an analytical question"
+                    }]
+                }
 
         try:
-            # 1. Classify the query type
-            classification = classifier_chain.invoke({"input": user_input})
-
-            # Handle multiple possible keys (LLM sometimes uses different names)
-            query_type = (classification.get("query_type") or
-                         classification.get("type") or
-                         classification.get("classification"))
-            entities_obj = classification.get("entities", {})
-
-            # Convert entities to dict for easier access
-            if isinstance(entities_obj, dict):
-                entities = entities_obj
-            else:
-                # If it's a Pydantic model, convert to dict
-                entities = entities_obj if isinstance(entities_obj, dict) else {}
+            # 1. Classify the query type: keyword router first, then the
+            # LLM classifier (cached on the normalized question)
+            frozen = keyword_classification(user_input)
+            if frozen is None and state.get("operation_result") and not names_read_intent(user_input):
+                # Right after a write with no specific question: answer with
+                # the stock/revenue/profit snapshot instead of asking the LLM
+                frozen = ("SUMMARY_QUERY", "", ())
+            if frozen is None:
+                frozen = _classify_cached(user_input)
+            query_type, entities = thaw_classification(frozen)
 
             # Fallback: if entities is empty, try to extract time_period from user_input manually
             if not entities or not entities.get("time_period"):
@@ -495,17 +801,10 @@ def create_read_agent(llm):
                     entities["time_period"] = "hoy"
 
             # 2. Generate appropriate SQL based on query type
-            sql_generators = {
-                "STOCK_QUERY": generate_stock_query,
-                "REVENUE_QUERY": generate_revenue_query,
-                "PROFIT_QUERY": generate_profit_query,
-                "SALES_QUERY": generate_sales_query,
-                "EXPENSE_QUERY": generate_expense_query,
-                "PRODUCT_INFO": generate_product_info_query,
-            }
-
-            if query_type in sql_generators:
-                sql_query = sql_generators[query_type](entities)
+            handlers = _QUERY_HANDLERS.get(query_type)
+            if handlers:
+                generate_sql, format_rows = handlers
+                sql_query, params = generate_sql(entities)
             else:
                 # GENERAL_QUERY - provide friendly guidance
                 return {
@@ -526,26 +825,28 @@ Por favor intenta de nuevo con una pregunta más clara.""",
                     }]
                 }
 
-            # 3. Execute SQL
-            rows = fetch_all(sql_query)
-
-            # DEBUG: Log query and results for debugging
-            print(f"[DEBUG] Query Type: {query_type}")
-            print(f"[DEBUG] Entities: {entities}")
-            print(f"[DEBUG] SQL: {sql_query[:200]}...")
-            print(f"[DEBUG] Rows returned: {len(rows) if rows else 0}")
-
-            # 4. Format results based on query type
-            formatters = {
-                "STOCK_QUERY": format_stock_result,
-                "REVENUE_QUERY": format_revenue_result,
-                "PROFIT_QUERY": format_profit_result,
-                "SALES_QUERY": format_sales_result,
-                "EXPENSE_QUERY": format_expense_result,
-                "PRODUCT_INFO": format_product_info_result,
-            }
+            # 3. Reuse the formatted answer if the data has not changed
+            cache_key = result_cache_key(query_type, entities)
+            formatted_result = _RESULT_CACHE.get(cache_key) if cache_key else None
+
+            if formatted_result is None:
+                # 4. Execute SQL
+                rows = fetch_all(sql_query, params)
+
+                # DEBUG: Log query and results for debugging
+                print(f"[DEBUG] Query Type: {query_type}")
+                print(f"[DEBUG] Entities: {entities}")
+                print(f"[DEBUG] SQL: {sql_query[:200]}...")
+                print(f"[DEBUG] Rows returned: {len(rows) if rows else 0}")
+
+                # 5. Format results based on query type
+                formatted_result = format_rows(rows)
+
+                if cache_key:
+                    _RESULT_CACHE.put(cache_key, formatted_result)
 
-            formatted_result = formatters[query_type](rows)
+            if state.get("operation_result"):
+                formatted_result = f"{formatted_result}{POST_WRITE_NOTE}"
 
             return {
                 "sql_result": formatted_result,
@@ -557,8 +858,7 @@ Por favor intenta de nuevo con una pregunta más clara.""",
 
         except Exception as e:
             error_msg = f"Read agent error: {str(e)}"
-            import traceback
-            traceback.print_exc()
+            logger.exception("Read agent failed")
 
             # Provide friendly error message to user
             friendly_error = """Disculpa, tuve un problema procesando tu pregunta.
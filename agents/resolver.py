@@ -9,13 +9,56 @@ Responsibilities:
 - NO writes
 - NO final decisions
 """
+import functools
+import heapq
+import logging
 import re
-from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
-from database_config import fetch_one, fetch_all
+import unicodedata
+from collections import Counter
+from typing import Dict, Any, Optional, Tuple
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
+from database_config import fetch_one, fetch_all, get_data_version
 
 from .state import AgentState
 
+logger = logging.getLogger(__name__)
+
+# Patterns for extract_from_context, compiled once. Order is priority: the
+# first pattern that matches wins.
+_NAME_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'llamo\s+([^.\n]+)',
+    r'registrar\s+(?:un nuevo tipo de\s+)?([^.\n,]+)',
+    r'crear\s+([^.\n,]+)',
+    r'producto\s+([^.\n,]+)',
+    r'son\s+(?:unas?\s+)?([^.\n,]+)',
+))
+
+_PRICE_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'^\s*(\d+(?:\.\d+)?)\s*(?:dolar|dollar|usd|pesos)',  # Just "10 dolares"
+    r'\$\s*(\d+(?:\.\d+)?)',  # $10
+    r'precio.*?\$?\s*(\d+(?:\.\d+)?)',
+    r'vend.*?\$?\s*(\d+(?:\.\d+)?)',
+    r'sal.*?\$?\s*(\d+(?:\.\d+)?)',
+    r'cuesta.*?\$?\s*(\d+(?:\.\d+)?)',
+))
+
+# Filler words dropped from an extracted name. Whole words only, so "las"
+# is not cut out of "clasica".
+_NAME_CLEANUP_RE = re.compile(r'\b(?:nuevo tipo de|unas?|unos?|las?|los?)\b', re.IGNORECASE)
+
+# One pass over the text for any of the patterns' trigger words. A single
+# alternation cannot replace the lists above (it returns the leftmost match,
+# not the highest-priority one), but it can rule out a miss in one scan.
+_NAME_TRIGGER_RE = re.compile(r'(?:llamo|registrar|crear|producto|son)\s', re.IGNORECASE)
+_PRICE_TRIGGER_RE = re.compile(r'\$|dolar|dollar|usd|pesos|precio|vend|sal|cuesta', re.IGNORECASE)
+
+# A create name that reads like a list ("medias, pantaletas y soquetes").
+_LIST_NAME_RE = re.compile(r",|\s+y\s+")
+
 
 def extract_from_context(user_input: str, field_name: str) -> Any:
     """
@@ -28,64 +71,67 @@ def extract_from_context(user_input: str, field_name: str) -> Any:
     Returns:
         Extracted value or None
     """
-    import re
-
-    # Extract both context and current message
-    if "Mensaje actual:" in user_input:
-        parts = user_input.split("Mensaje actual:")
-        context_section = parts[0]
-        current_message = parts[1] if len(parts) > 1 else ""
-    else:
-        context_section = ""
-        current_message = user_input
-
-    # Search in BOTH context and current message
-    search_text = user_input  # Search in everything
+    # Split off the current message; the context is everything before it
+    context_section, marker, current_message = user_input.partition("Mensaje actual:")
+    if not marker:
+        context_section, current_message = "", user_input
 
-    # Look for product names
+    # The current message is the most likely location, so it is searched
+    # first; pattern order decides within each section.
     if field_name == "name":
-        # Common patterns for product names
-        patterns = [
-            r'llamo\s+([^.\n]+)',
-            r'registrar\s+(?:un nuevo tipo de\s+)?([^.\n,]+)',
-            r'crear\s+([^.\n,]+)',
-            r'producto\s+([^.\n,]+)',
-            r'son\s+(?:unas?\s+)?([^.\n,]+)',
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, search_text, re.IGNORECASE)
-            if match:
-                name = match.group(1).strip()
-                # Clean up common words
-                name = name.replace("nuevo tipo de", "").replace("unas", "").replace("las", "").replace("unos", "").strip()
-                if name and len(name) > 3:
-                    return name
-
-    # Look for prices - search in BOTH context and current message
+        if not _NAME_TRIGGER_RE.search(user_input):
+            return None
+        for section in (current_message, context_section):
+            for pattern in _NAME_PATTERNS:
+                match = pattern.search(section)
+                if match:
+                    # Clean up common words
+                    name = " ".join(_NAME_CLEANUP_RE.sub("", match.group(1)).split())
+                    if name and len(name) > 3:
+                        return name
+
     elif field_name == "unit_price":
-        # First try current message (most likely location)
-        patterns = [
-            r'^\s*(\d+(?:\.\d+)?)\s*(?:dolar|dollar|usd|pesos)',  # Just "10 dolares"
-            r'\$\s*(\d+(?:\.\d+)?)',  # $10
-            r'precio.*?\$?\s*(\d+(?:\.\d+)?)',
-            r'vend.*?\$?\s*(\d+(?:\.\d+)?)',
-            r'sal.*?\$?\s*(\d+(?:\.\d+)?)',
-            r'cuesta.*?\$?\s*(\d+(?:\.\d+)?)',
-        ]
+        if not _PRICE_TRIGGER_RE.search(user_input):
+            return None
+        for section in (current_message, context_section):
+            for pattern in _PRICE_PATTERNS:
+                match = pattern.search(section)
+                if match:
+                    return float(match.group(1))
 
-        # Try current message first
-        for pattern in patterns:
-            match = re.search(pattern, current_message, re.IGNORECASE)
-            if match:
-                return float(match.group(1))
+    return None
 
-        # If not found in current message, try context
-        for pattern in patterns:
-            match = re.search(pattern, context_section, re.IGNORECASE)
-            if match:
-                return float(match.group(1))
 
-    return None
+def to_cents(amount) -> int:
+    """
+    Convert a USD amount to integer cents, rounding half up.
+
+    Goes through the decimal string so 19.99 becomes 1999, not the 1998 that
+    int(19.99 * 100) gives.
+    """
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+# USD amount fields and the cents field each one resolves to
+CENTS_FIELDS = (
+    ("unit_price", "unit_price_cents"),
+    ("amount", "amount_cents"),
+)
+
+
+def add_cents_fields(entities: Dict[str, Any]) -> None:
+    """
+    Fill in the cents field for every USD amount that doesn't have one yet.
+
+    Amounts that aren't numbers are left unconverted, so the cents field
+    stays missing and validation asks for it.
+    """
+    for usd_field, cents_field in CENTS_FIELDS:
+        if usd_field in entities and cents_field not in entities:
+            try:
+                entities[cents_field] = to_cents(entities[usd_field])
+            except InvalidOperation:
+                pass
 
 
 def create_resolver_agent(llm=None):
@@ -117,32 +163,48 @@ def create_resolver_agent(llm=None):
         entities = state.get("normalized_entities", {})
         operation_type = state.get("operation_type")
         user_input = state.get("user_input", "")
+        # One reference date for every relative date in this request
+        today = datetime.now().date()
 
         try:
             resolved = {}
             variant_hints = detect_variant_hints(user_input)
 
+            # Every product lookup in this request resolves against one
+            # catalog snapshot, loaded once (and only if something needs it)
+            needs_lookup = (
+                "product_ref" in entities
+                or "sku" in entities
+                or any("product_id" not in item for item in entities.get("items") or [])
+            )
+            catalog = load_product_catalog() if needs_lookup else None
+
             # Resolve product references
             if "items" in entities:
                 resolved_items = []
                 for item in entities["items"]:
-                    item_with_hint = apply_variant_hint(item, variant_hints)
-
-                    # Use hybrid resolution if LLM is available
-                    if llm:
-                        resolved_item = resolve_product_reference_hybrid(item_with_hint, llm)
+                    # Already resolved upstream (e.g. re-entry after a
+                    # clarification): hints and lookups cannot change it
+                    if "product_id" in item:
+                        resolved_item = item
                     else:
-                        resolved_item = resolve_product_reference(item_with_hint)
+                        item_with_hint = apply_variant_hint(item, variant_hints)
 
-                    resolved_item = enforce_variant_alignment(
-                        item_with_hint, resolved_item, variant_hints
-                    )
+                        # Use hybrid resolution if LLM is available
+                        if llm:
+                            resolved_item = resolve_product_reference_hybrid(item_with_hint, llm, catalog)
+                        else:
+                            resolved_item = resolve_product_reference(item_with_hint, catalog)
+
+                        resolved_item = enforce_variant_alignment(
+                            item_with_hint, resolved_item, variant_hints, catalog
+                        )
 
                     # Convert unit_price (USD) to unit_price_cents if present
                     if "unit_price" in resolved_item:
                         price_usd = resolved_item["unit_price"]
                         if isinstance(price_usd, (int, float)):
-                            resolved_item["unit_price_cents"] = int(price_usd * 100)
+                            resolved_item["unit_price_cents"] = to_cents(price_usd)
                             # Remove the USD version
                             del resolved_item["unit_price"]
 
@@ -158,9 +220,9 @@ def create_resolver_agent(llm=None):
 
                 # Use hybrid resolution if LLM is available
                 if llm:
-                    resolved_item = resolve_product_reference_hybrid(temp_item, llm)
+                    resolved_item = resolve_product_reference_hybrid(temp_item, llm, catalog)
                 else:
-                    resolved_item = resolve_product_reference(temp_item)
+                    resolved_item = resolve_product_reference(temp_item, catalog)
 
                 # Extract product_id from resolved item
                 if "product_id" in resolved_item:
@@ -172,28 +234,15 @@ def create_resolver_agent(llm=None):
 
             # Resolve date references
             if "date" in entities:
-                resolved["date"] = resolve_date(entities["date"])
-
-            # Resolve amount (convert to cents if needed)
-            if "amount" in entities:
-                amount = entities["amount"]
-                if isinstance(amount, (int, float)):
-                    resolved["amount_cents"] = int(amount * 100)
-                else:
-                    resolved["amount_cents"] = entities.get("amount_cents")
+                resolved["date"] = resolve_date(entities["date"], today)
 
             # Copy other entities as-is
             for key, value in entities.items():
                 if key not in resolved:
                     resolved[key] = value
 
-            # Convert unit_price to unit_price_cents if needed (BEFORE validation)
-            if "unit_price" in resolved and "unit_price_cents" not in resolved:
-                resolved["unit_price_cents"] = int(resolved["unit_price"] * 100)
-
-            # Convert amount to amount_cents if needed
-            if "amount" in resolved and "amount_cents" not in resolved:
-                resolved["amount_cents"] = int(resolved["amount"] * 100)
+            # Convert USD amounts to cents (BEFORE validation)
+            add_cents_fields(resolved)
 
             # If ADD_STOCK references a product that doesn't exist AND we already
             # have a quantity, surface this as a proposal to create the product
@@ -257,6 +306,7 @@ def create_resolver_agent(llm=None):
 
             # Validate required fields based on operation type
             missing_fields = validate_required_fields(operation_type, resolved)
+            apply_product_defaults(operation_type, resolved)
 
             # Try to extract missing fields from conversation context
             if missing_fields and user_input:
@@ -267,8 +317,7 @@ def create_resolver_agent(llm=None):
                         missing_fields.remove(field)
 
                 # Convert any newly found prices to cents
-                if "unit_price" in resolved and "unit_price_cents" not in resolved:
-                    resolved["unit_price_cents"] = int(resolved["unit_price"] * 100)
+                add_cents_fields(resolved)
 
             return {
                 "normalized_entities": resolved,
@@ -292,10 +341,26 @@ def create_resolver_agent(llm=None):
     return resolve_entities
 
 
+# Product words repeat heavily across requests (and across the variations of
+# one request), so normalized forms are memoized.
+NORMALIZE_CACHE_SIZE = 4096
+
+# Accented letters seen in Spanish/Portuguese input, folded in one C-level
+# pass (applied after lower(), so only lowercase forms are listed).
+_ACCENT_TABLE = str.maketrans(
+    "áàâäãéèêëíìîïóòôöõúùûüñç",
+    "aaaaaeeeeiiiiooooouuuunc",
+)
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize_text(text: str) -> str:
     """Normalize text for comparison (remove accents, lowercase)."""
-    import unicodedata
-    # Remove accents
+    folded = text.lower().translate(_ACCENT_TABLE)
+    if folded.isascii():
+        return folded
+
+    # Rarer marks: strip any combining character after decomposition
     text = ''.join(
         c for c in unicodedata.normalize('NFD', text)
         if unicodedata.category(c) != 'Mn'
@@ -326,7 +391,29 @@ def generate_word_variations(word: str) -> list[str]:
     return variations
 
 
-def translate_product_terms(text: str) -> list[str]:
+# Product term translations (both directions)
+PRODUCT_TERM_TRANSLATIONS = {
+    "black": "negra",
+    "negra": "black",
+    "gold": "dorada",
+    "dorada": "gold",
+    "classic": "clasica",
+    "clasica": "classic",
+    "clásica": "classic",
+    "bracelet": "pulsera",
+    "pulsera": "bracelet",
+    "keychain": "llavero",
+    "llavero": "keychain",
+}
+
+
+# Product references repeat across requests and across the resolver steps of
+# one request (resolution, variant alignment retries, hybrid scoring).
+TRANSLATION_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=TRANSLATION_CACHE_SIZE)
+def translate_product_terms(text: str) -> tuple[str, ...]:
     """
     Generate variations of product names with translations.
 
@@ -334,47 +421,27 @@ def translate_product_terms(text: str) -> list[str]:
         text: Original product reference
 
     Returns:
-        List of variations to try
+        Variations to try, original first, without duplicates (a tuple,
+        since results are shared through the cache)
     """
-    variations = []
-    seen = set()
-
-    def add_variation(variation: str):
-        if variation not in seen:
-            seen.add(variation)
-            variations.append(variation)
-
-    add_variation(text)
-
-    # Translation mappings (both directions)
-    translations = {
-        "black": "negra",
-        "negra": "black",
-        "gold": "dorada",
-        "dorada": "gold",
-        "classic": "clasica",
-        "clasica": "classic",
-        "clásica": "classic",
-        "bracelet": "pulsera",
-        "pulsera": "bracelet",
-        "keychain": "llavero",
-        "llavero": "keychain",
-    }
+    # dict as an insertion-ordered set
+    variations = {text: None}
+    text_lower = text.lower()
 
     # Generate variations with translations
-    words = text.lower().split()
+    words = text_lower.split()
     for i, word in enumerate(words):
-        if word in translations:
+        if word in PRODUCT_TERM_TRANSLATIONS:
             new_words = words.copy()
-            new_words[i] = translations[word]
-            add_variation(" ".join(new_words))
+            new_words[i] = PRODUCT_TERM_TRANSLATIONS[word]
+            variations[" ".join(new_words)] = None
 
     # Also try just translating individual words without context
-    for original, translation in translations.items():
-        if original in text.lower():
-            add_variation(text.lower().replace(original, translation))
+    for original, translation in PRODUCT_TERM_TRANSLATIONS.items():
+        if original in text_lower:
+            variations[text_lower.replace(original, translation)] = None
 
-    return variations
+    return tuple(variations)
 
 
 VARIANT_HINT_TOKENS = {
@@ -383,15 +450,24 @@ VARIANT_HINT_TOKENS = {
     "clasica": ["clasic"],
 }
 
+_TOKEN_TO_VARIANT = {
+    token: variant
+    for variant, tokens in VARIANT_HINT_TOKENS.items()
+    for token in tokens
+}
+# Lookahead so overlapping tokens are all reported in a single scan
+_HINT_TOKEN_RE = re.compile(
+    "(?=(" + "|".join(map(re.escape, _TOKEN_TO_VARIANT)) + "))"
+)
+_ANY_VARIANT_RE = re.compile(
+    "|".join(map(re.escape, [*VARIANT_HINT_TOKENS, *_TOKEN_TO_VARIANT]))
+)
+
 
 def detect_variant_hints(text: str) -> set[str]:
     """Detect variant hints (dorada/negra/clasica) from the user text."""
     normalized = normalize_text(text)
-    hints = set()
-    for variant, tokens in VARIANT_HINT_TOKENS.items():
-        if any(token in normalized for token in tokens):
-            hints.add(variant)
-    return hints
+    return {_TOKEN_TO_VARIANT[token] for token in _HINT_TOKEN_RE.findall(normalized)}
 
 
 def apply_variant_hint(item: Dict[str, Any], variant_hints: set[str]) -> Dict[str, Any]:
@@ -412,17 +488,14 @@ def apply_variant_hint(item: Dict[str, Any], variant_hints: set[str]) -> Dict[st
     ref_normalized = normalize_text(product_ref)
 
     # Check if product_ref already has ANY variant
-    has_any_variant = any(
-        variant in ref_normalized or any(token in ref_normalized for token in tokens)
-        for variant, tokens in VARIANT_HINT_TOKENS.items()
-    )
+    has_any_variant = _ANY_VARIANT_RE.search(ref_normalized) is not None
 
     # If it already has a variant, don't add another one
     if has_any_variant:
         return item
 
     # If no variant found, apply the first matching hint
-    for variant, tokens in VARIANT_HINT_TOKENS.items():
+    for variant in VARIANT_HINT_TOKENS:
         if variant in variant_hints:
             new_ref = f"{product_ref} {variant}".strip()
             return {**item, "product_ref": new_ref}
@@ -434,6 +507,7 @@ def enforce_variant_alignment(
     original_item: Dict[str, Any],
     resolved_item: Dict[str, Any],
     variant_hints: set[str],
+    catalog: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     """
     If a variant is hinted in the text but the resolved product disagrees,
@@ -448,11 +522,17 @@ def enforce_variant_alignment(
     ):
         return resolved_item
 
+    if catalog is None:
+        catalog = load_product_catalog()
+
     base_ref = original_item.get("product_ref") or original_item.get("sku") or ""
-    for variant in variant_hints:
+    for variant in VARIANT_HINT_TOKENS:
+        # A retry can only succeed if some product is named after the variant
+        if variant not in variant_hints or not products_containing(catalog, variant):
+            continue
         retry_ref = f"{base_ref} {variant}".strip()
         retry_item = {**original_item, "product_ref": retry_ref}
-        retry_result = resolve_product_reference(retry_item)
+        retry_result = resolve_product_reference(retry_item, catalog)
         retry_name_norm = normalize_text(retry_result.get("resolved_name", ""))
         if "product_id" in retry_result and variant in retry_name_norm:
             return retry_result
@@ -460,140 +540,258 @@ def enforce_variant_alignment(
     return resolved_item
 
 
-def resolve_product_reference(item: Dict[str, Any]) -> Dict[str, Any]:
+# Product catalog, reloaded whenever the database change stamp moves. The
+# table is small and read on every resolution, so matching runs in memory.
+# Held as one (version, catalog) tuple so readers on other threads (other
+# tenants) never pair one tenant's version with another tenant's catalog.
+_CATALOG_CACHE: Optional[Tuple[Any, Dict[str, Any]]] = None
+
+# Words that never identify a product on their own
+PRODUCT_STOPWORDS = frozenset({"de", "granos", "cafe", "con", "la", "el", "coffee", "bean", "beans"})
+
+# Stopwords plus the generic product type: these don't count towards the
+# "all meaningful words matched" rule
+PRODUCT_GENERIC_WORDS = PRODUCT_STOPWORDS | {"pulsera", "pulseras", "bracelet"}
+
+# Upper bound on memoized posting lists per catalog (one per distinct word)
+CATALOG_POSTINGS_SIZE = 4096
+
+# Upper bound on memoized match results per catalog (one per product reference)
+CATALOG_MATCHES_SIZE = 1024
+
+
+def load_product_catalog() -> Dict[str, Any]:
     """
-    Resolve product reference to product_id.
+    Return the product catalog, cached per database version.
+
+    Returns:
+        Dict with "products" (all rows, by id, with a normalized "name_norm"),
+        "active" (active products only), "available_names" (active product
+        names for user-facing messages), "by_id", "by_sku", "postings"
+        (see products_containing) and the per-reference "matches" and
+        "scores" memos (see memoize_in_catalog)
+    """
+    global _CATALOG_CACHE
+    version = get_data_version()
+    cached = _CATALOG_CACHE
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+
+    rows = fetch_all("SELECT id, sku, name, is_active FROM products ORDER BY id")
+    products = [
+        {
+            "id": row["id"],
+            "sku": row["sku"],
+            "name": row["name"],
+            "name_norm": normalize_text(row["name"]),
+            "is_active": bool(row["is_active"]),
+        }
+        for row in rows
+    ]
+    active = [product for product in products if product["is_active"]]
+    catalog = {
+        "products": products,
+        "active": active,
+        "available_names": ", ".join(sorted(product["name"] for product in active)),
+        "by_id": {product["id"]: product for product in products},
+        "by_sku": {product["sku"]: product for product in products},
+        "postings": {},
+        "matches": {},
+        "scores": {},
+    }
+
+    # Backend reported no version: load per call rather than risk staleness
+    if version is not None:
+        _CATALOG_CACHE = (version, catalog)
+    return catalog
+
+
+def products_containing(catalog: Dict[str, Any], fragment: str) -> frozenset:
+    """
+    Return the ids of catalog products whose normalized name contains fragment.
+
+    Matching is by substring ("negr" finds "Negra"), so this is a posting
+    list per query fragment rather than per name token. Lists are built on
+    first use and kept with the catalog, which is replaced on any write.
+    """
+    postings = catalog["postings"]
+    product_ids = postings.get(fragment)
+    if product_ids is None:
+        if len(postings) >= CATALOG_POSTINGS_SIZE:
+            postings.clear()
+        product_ids = frozenset(
+            product["id"] for product in catalog["products"]
+            if fragment in product["name_norm"]
+        )
+        postings[fragment] = product_ids
+    return product_ids
+
+
+def memoize_in_catalog(catalog: Dict[str, Any], memo: str, key: str, compute) -> Any:
+    """
+    Return compute(key, catalog), memoized in catalog[memo].
+
+    Users repeat the same product reference within a session (retries,
+    disambiguation follow-ups). Results live with the catalog, which is
+    replaced on any write, so they are never stale. compute must return an
+    immutable value, since it is shared between callers.
+    """
+    results = catalog[memo]
+    if key in results:
+        return results[key]
+    if len(results) >= CATALOG_MATCHES_SIZE:
+        results.clear()
+    value = results[key] = compute(key, catalog)
+    return value
+
+
+def match_word_combinations(
+    variations: tuple[str, ...],
+    catalog: Dict[str, Any],
+) -> tuple[Optional[Dict[str, Any]], Optional[int]]:
+    """
+    Find the first product whose name contains every word of a combination.
+
+    Each multi-word variation stands for the singular/plural combinations of
+    its meaningful words. The earliest combination wins (as written before
+    variants), then the lowest product id.
 
     Args:
-        item: Item dict with product_ref or sku
+        variations: Variations from translate_product_terms, in priority order
+        catalog: Catalog from load_product_catalog
 
     Returns:
-        Item dict with product_id resolved
+        (matching product, index of the variation it matched) or (None, None)
     """
-    # If already has product_id, return as-is
-    if "product_id" in item:
-        return item
+    for index, variation in enumerate(variations):
+        words = variation.lower().split()
+        if len(words) <= 1:
+            continue
+
+        # Get variations for each word, skipping common words
+        word_variations_list = [
+            generate_word_variations(word)
+            for word in words
+            if word not in PRODUCT_STOPWORDS
+        ]
 
-    # Get product reference
-    product_ref = item.get("product_ref") or item.get("sku")
-    if not product_ref:
-        return item
+        if not word_variations_list:
+            continue
 
-    # Query database for matching product
+        # Posting list for every form of every word, looked up once
+        form_ids = [
+            [products_containing(catalog, normalize_text(form)) for form in forms]
+            for forms in word_variations_list
+        ]
+        matching_ids = frozenset.intersection(*(
+            frozenset().union(*ids_per_form) for ids_per_form in form_ids
+        ))
+        if not matching_ids:
+            continue
+
+        # Combinations rank by form, word by word (the word as written before
+        # its singular/plural variant), so the best combination a product
+        # matches is made of the first form it matches for each word. Rank
+        # candidates by that instead of enumerating every combination.
+        def combination_rank(product_id):
+            first_forms = tuple(
+                next(position for position, ids in enumerate(ids_per_form) if product_id in ids)
+                for ids_per_form in form_ids
+            )
+            return first_forms, product_id
+
+        return catalog["by_id"][min(matching_ids, key=combination_rank)], index
+
+    return None, None
+
+
+def _match_product_id(product_ref: str, catalog: Dict[str, Any]) -> Optional[int]:
+    """Return the id of the product product_ref unambiguously names, if any."""
     # Try exact SKU match first
-    row = fetch_one(
-        "SELECT id, sku, name FROM products WHERE sku = %s",
-        (product_ref,)
-    )
+    row = catalog["by_sku"].get(product_ref)
 
     # If not found, try partial name match with translations
     if not row:
         # Get all variations (with translations)
         variations = translate_product_terms(product_ref)
+        combo_row, combo_index = match_word_combinations(variations, catalog)
+
+        for index, variation in enumerate(variations):
+            # Multi-word variations first try all words together (AND logic)
+            if index == combo_index:
+                row = combo_row
+                break
 
-        for variation in variations:
-            # Split search term into words for better matching
             words = variation.lower().split()
 
-            # Try matching with all words (AND logic) - using normalized text
-            if len(words) > 1:
-                # Build query with multiple LIKE conditions (accent-insensitive)
-                # We normalize both the search term and the database field
-                # Try all combinations of word variations (singular/plural)
-
-                # Get variations for each word
-                word_variations_list = []
-                for word in words:
-                    # Skip common words
-                    if word in ["de", "granos", "cafe", "con", "la", "el", "coffee", "bean", "beans"]:
-                        continue
-                    word_variations_list.append(generate_word_variations(word))
-
-                # Try different combinations
-                import itertools
-                for word_combo in itertools.product(*word_variations_list):
-                    conditions = []
-                    params = []
-
-                    for word in word_combo:
-                        conditions.append("REPLACE(REPLACE(REPLACE(REPLACE(LOWER(name), 'á', 'a'), 'é', 'e'), 'í', 'i'), 'ó', 'o') LIKE %s")
-                        params.append(f"%{normalize_text(word)}%")
-
-                    if conditions:
-                        query = f"""
-                            SELECT id, sku, name FROM products
-                            WHERE {' AND '.join(conditions)}
-                            LIMIT 1
-                            """
-                        # Debug
-                        # print(f"DEBUG Query: {query}")
-                        # print(f"DEBUG Params: {params}")
-
-                        row = fetch_one(query, tuple(params))
-                        if row:
-                            break
-
-                    if row:
-                        break
-
-            # If still not found, try individual words BUT rank by match count
-            if not row:
-                # print(f"DEBUG: Multi-word search failed, trying individual words with ranking")
-
-                # Get all products
-                all_products = fetch_all("SELECT id, sku, name FROM products WHERE is_active = TRUE")
-
-                # Score each product by how many words match
-                best_match = None
-                best_score = 0
-                total_meaningful_words = 0
-
-                # Count how many meaningful words the user provided
-                for word in words:
-                    if word not in ["de", "granos", "cafe", "con", "la", "el", "coffee", "bean", "beans", "pulsera", "pulseras", "bracelet"]:
-                        total_meaningful_words += 1
-
-                for product in all_products:
-                    product_name_norm = normalize_text(product["name"])
-                    score = 0
-
-                    # Count how many input words appear in this product name.
-                    # Skip list MUST match the meaningful_words skip list below
-                    # (pulsera/pulseras/bracelet are generic — they should not
-                    # contribute to score either, otherwise unknown specific
-                    # words like "celeste" still let "pulsera celeste" match
-                    # any bracelet by virtue of the generic word alone).
-                    for word in words:
-                        if word in ["de", "granos", "cafe", "con", "la", "el", "coffee", "bean", "beans", "pulsera", "pulseras", "bracelet"]:
-                            continue
-
-                        # Check word variations (singular/plural)
-                        word_variations = generate_word_variations(word)
-                        for word_var in word_variations:
-                            if normalize_text(word_var) in product_name_norm:
-                                score += 1
-                                break  # Don't double-count the same word
-
-                    # Update best match if this product scores higher
-                    if score > best_score:
-                        best_score = score
-                        best_match = product
-
-                # CRITICAL SAFETY CHECK: Only accept match if we matched ALL meaningful words
-                # If user said specific descriptors (like "arcoiris"), we MUST match them
-                # Don't accept matches based only on generic words like "pulsera"
-                if best_match and best_score > 0:
-                    # Require that ALL meaningful words were matched
-                    if total_meaningful_words > 0 and best_score >= total_meaningful_words:
-                        row = best_match
-                        # print(f"DEBUG: Best match with score {best_score}/{total_meaningful_words}: {row['name']}")
-                    # If user only said generic words (total_meaningful_words == 0), DON'T guess
-                    # This forces users to be specific when there are multiple products
-                    # Otherwise: Don't match - user needs to be more specific
+            # Otherwise look for a product that matches every meaningful word
+            # on its own. Generic words (pulsera/pulseras/bracelet) don't
+            # count: otherwise unknown specific words like "celeste" would
+            # still let "pulsera celeste" match any bracelet by virtue of the
+            # generic word alone.
+            meaningful_words = [
+                word for word in words
+                if word not in PRODUCT_GENERIC_WORDS
+            ]
+
+            # CRITICAL SAFETY CHECK: Only accept a match if it matched ALL
+            # meaningful words. If the user only said generic words, DON'T
+            # guess - this forces users to be specific when there are
+            # multiple products.
+            if meaningful_words:
+                matching_ids = None
+                for word in meaningful_words:
+                    # Check word variations (singular/plural)
+                    word_ids = frozenset().union(*(
+                        products_containing(catalog, normalize_text(word_var))
+                        for word_var in generate_word_variations(word)
+                    ))
+                    matching_ids = word_ids if matching_ids is None else matching_ids & word_ids
+
+                row = next(
+                    (
+                        catalog["by_id"][product_id]
+                        for product_id in sorted(matching_ids)
+                        if catalog["by_id"][product_id]["is_active"]
+                    ),
+                    None,
+                )
 
             if row:
                 break
 
+    return row["id"] if row else None
+
+
+def resolve_product_reference(
+    item: Dict[str, Any],
+    catalog: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Resolve product reference to product_id.
+
+    Args:
+        item: Item dict with product_ref or sku
+        catalog: Catalog from load_product_catalog; loaded if not given
+
+    Returns:
+        Item dict with product_id resolved
+    """
+    # If already has product_id, return as-is
+    if "product_id" in item:
+        return item
+
+    # Get product reference
+    product_ref = item.get("product_ref") or item.get("sku")
+    if not product_ref:
+        return item
+
+    if catalog is None:
+        catalog = load_product_catalog()
+
+    product_id = memoize_in_catalog(catalog, "matches", product_ref, _match_product_id)
+    row = catalog["by_id"][product_id] if product_id is not None else None
+
     if row:
         return {
             **item,
@@ -603,9 +801,7 @@ def resolve_product_reference(item: Dict[str, Any]) -> Dict[str, Any]:
         }
 
     # If still not found, return original with error flag
-    # Get all active products to show in error message
-    all_products = fetch_all("SELECT sku, name FROM products WHERE is_active = TRUE ORDER BY name")
-    available_list = ", ".join([f"{p['name']}" for p in all_products])
+    available_list = catalog["available_names"]
 
     # Check if user input was too generic (no specific variant/color mentioned)
     normalized_ref = normalize_text(product_ref)
@@ -623,7 +819,11 @@ def resolve_product_reference(item: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
-def resolve_product_reference_hybrid(item: Dict[str, Any], llm) -> Dict[str, Any]:
+def resolve_product_reference_hybrid(
+    item: Dict[str, Any],
+    llm,
+    catalog: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
     """
     Hybrid product resolution using deterministic matching + LLM fallback.
 
@@ -635,6 +835,7 @@ def resolve_product_reference_hybrid(item: Dict[str, Any], llm) -> Dict[str, Any
     Args:
         item: Item dict with product_ref or sku
         llm: Language model instance (Haiku)
+        catalog: Catalog from load_product_catalog, for the deterministic fallback
 
     Returns:
         Item dict with product_id resolved
@@ -648,18 +849,24 @@ def resolve_product_reference_hybrid(item: Dict[str, Any], llm) -> Dict[str, Any
     if not product_ref:
         return item
 
+    if catalog is None:
+        catalog = load_product_catalog()
+
     # Get all candidates with scores
-    candidates = fuzzy_match_with_scores(product_ref)
+    candidates = fuzzy_match_with_scores(product_ref, catalog)
 
     # Decision logic based on confidence
     if len(candidates) == 0:
         # No matches found → fallback to original error handling
-        print(f"[Hybrid Resolver] No candidates found for '{product_ref}'")
-        return resolve_product_reference(item)  # Use original function for error message
+        logger.debug("[Hybrid Resolver] No candidates found for '%s'", product_ref)
+        return resolve_product_reference(item, catalog)  # Use original function for error message
 
     elif len(candidates) == 1 and candidates[0]["score"] >= 0.9:
         # Single high-confidence match → deterministic (FAST, FREE)
-        print(f"[Hybrid Resolver] High confidence match: {candidates[0]['name']} ({candidates[0]['score']:.0%})")
+        logger.debug(
+            "[Hybrid Resolver] High confidence match: %s (%.0f%%)",
+            candidates[0]["name"], candidates[0]["score"] * 100,
+        )
         return {
             **item,
             "product_id": candidates[0]["id"],
@@ -669,128 +876,122 @@ def resolve_product_reference_hybrid(item: Dict[str, Any], llm) -> Dict[str, Any
 
     elif len(candidates) == 1 and candidates[0]["score"] < 0.9:
         # Single low-confidence match → use LLM to verify
-        print(f"[Hybrid Resolver] Low confidence ({candidates[0]['score']:.0%}), asking LLM to verify")
+        logger.debug(
+            "[Hybrid Resolver] Low confidence (%.0f%%), asking LLM to verify",
+            candidates[0]["score"] * 100,
+        )
         result = llm_disambiguate_product(product_ref, candidates, llm)
         return {**item, **result}
 
     else:
         # Multiple candidates → use LLM to disambiguate
-        top_scores = [c["score"] for c in candidates[:3]]
-        print(f"[Hybrid Resolver] Multiple candidates (top scores: {top_scores}), asking LLM")
+        if logger.isEnabledFor(logging.DEBUG):
+            top_scores = [c["score"] for c in candidates[:3]]
+            logger.debug("[Hybrid Resolver] Multiple candidates (top scores: %s), asking LLM", top_scores)
         result = llm_disambiguate_product(product_ref, candidates, llm)
         return {**item, **result}
 
 
-def fuzzy_match_with_scores(product_ref: str) -> list:
+# Candidates kept per fuzzy match; also how many the LLM gets to choose from
+FUZZY_MAX_CANDIDATES = 5
+
+
+def fuzzy_match_with_scores(
+    product_ref: str,
+    catalog: Optional[Dict[str, Any]] = None,
+) -> list:
     """
-    Find all matching products with confidence scores.
+    Find the best matching products with confidence scores.
 
     Args:
         product_ref: Product reference to match
+        catalog: Catalog from load_product_catalog; loaded if not given
 
     Returns:
-        List of dicts with keys: id, sku, name, score (0-1)
+        List of dicts with keys: id, sku, name, score (0-1), best score
+        first, at most FUZZY_MAX_CANDIDATES long
     """
+    if catalog is None:
+        catalog = load_product_catalog()
+
+    scores = memoize_in_catalog(catalog, "scores", product_ref, _score_products)
+
+    return [
+        {
+            "id": product_id,
+            "sku": catalog["by_id"][product_id]["sku"],
+            "name": catalog["by_id"][product_id]["name"],
+            "score": score,
+        }
+        for product_id, score in scores
+    ]
+
+
+def _score_products(product_ref: str, catalog: Dict[str, Any]) -> tuple:
+    """Return (product_id, score) pairs for product_ref, best score first."""
     # Try exact SKU match first
-    row = fetch_one(
-        "SELECT id, sku, name FROM products WHERE sku = %s",
-        (product_ref,)
-    )
+    row = catalog["by_sku"].get(product_ref)
 
     if row:
-        return [{
-            "id": row["id"],
-            "sku": row["sku"],
-            "name": row["name"],
-            "score": 1.0  # Exact SKU match = 100% confidence
-        }]
-
-    # Get all active products for fuzzy matching
-    all_products = fetch_all("SELECT id, sku, name FROM products WHERE is_active = TRUE")
+        return ((row["id"], 1.0),)  # Exact SKU match = 100% confidence
 
     # Get variations with translations
     variations = translate_product_terms(product_ref)
 
-    candidates = []
+    # Best score per product id, in order of first match
+    best_scores: Dict[int, float] = {}
 
     for variation in variations:
-        words = variation.lower().split()
-        total_meaningful_words = sum(
-            1 for word in words
-            if word not in ["de", "granos", "cafe", "con", "la", "el", "coffee", "bean", "beans", "pulsera", "pulseras", "bracelet"]
-        )
-
-        for product in all_products:
-            product_name_norm = normalize_text(product["name"])
-            score = 0
-
-            # Count matching words
-            for word in words:
-                if word in ["de", "granos", "cafe", "con", "la", "el", "coffee", "bean", "beans"]:
-                    continue
-
-                word_variations = generate_word_variations(word)
-                for word_var in word_variations:
-                    if normalize_text(word_var) in product_name_norm:
-                        score += 1
-                        break
-
-            # Calculate confidence score
-            if total_meaningful_words > 0:
-                confidence = score / total_meaningful_words
-
-                if confidence > 0:
-                    # Check if already in candidates
-                    existing = next((c for c in candidates if c["id"] == product["id"]), None)
-                    if existing:
-                        # Update if better score
-                        if confidence > existing["score"]:
-                            existing["score"] = confidence
-                    else:
-                        candidates.append({
-                            "id": product["id"],
-                            "sku": product["sku"],
-                            "name": product["name"],
-                            "score": confidence
-                        })
-
-    # Sort by score descending
-    candidates.sort(key=lambda x: x["score"], reverse=True)
-
-    return candidates
-
-
-def llm_disambiguate_product(product_ref: str, candidates: list, llm) -> Dict[str, Any]:
-    """
-    Use LLM to disambiguate between multiple product candidates.
+        # One pass over the words: count the meaningful ones and collect the
+        # normalized singular/plural forms of every non-stopword
+        total_meaningful_words = 0
+        word_forms = []
+        for word in variation.lower().split():
+            if word in PRODUCT_STOPWORDS:
+                continue
+            if word not in PRODUCT_GENERIC_WORDS:
+                total_meaningful_words += 1
+            word_forms.append(
+                [normalize_text(word_var) for word_var in generate_word_variations(word)]
+            )
+        if total_meaningful_words == 0:
+            continue
+
+        # Count matching words per product from the posting lists: each word
+        # counts once, whichever of its forms matched
+        scores = Counter()
+        for forms in word_forms:
+            scores.update(frozenset().union(*(
+                products_containing(catalog, form) for form in forms
+            )))
+
+        for product_id in sorted(scores):
+            if not catalog["by_id"][product_id]["is_active"]:
+                continue
+
+            # Calculate confidence score, keeping the best one per product
+            confidence = scores[product_id] / total_meaningful_words
+            if confidence > best_scores.get(product_id, -1.0):
+                best_scores[product_id] = confidence
+
+    # Top candidates by score descending (ties keep first-match order)
+    return tuple(heapq.nlargest(
+        FUZZY_MAX_CANDIDATES, best_scores.items(), key=lambda pair: pair[1]
+    ))
+
+
+class ProductChoice(BaseModel):
+    """Structured answer for llm_disambiguate_product."""
+
+    product_id: Optional[int] = Field(
+        default=None,
+        description="ID of the chosen product, or null if no candidate clearly matches the user's request"
+    )
+    reasoning: str = Field(description="Why this product was chosen, or why no candidate matches")
 
-    Args:
-        product_ref: User's product reference
-        candidates: List of candidate products with scores
-        llm: Language model instance (Haiku)
 
-    Returns:
-        Dict with resolved product_id, sku, name
-    """
-    from langchain_core.prompts import ChatPromptTemplate
-    from langchain_core.output_parsers import JsonOutputParser
-    from pydantic import BaseModel, Field
-
-    class ProductChoice(BaseModel):
-        product_id: Optional[int] = Field(
-            default=None,
-            description="ID of the chosen product, or null if no candidate clearly matches the user's request"
-        )
-        reasoning: str = Field(description="Why this product was chosen, or why no candidate matches")
-
-    # Build candidates list for prompt
-    candidates_str = "\n".join([
-        f"- ID {c['id']}: {c['name']} (SKU: {c['sku']}, confidence: {c['score']:.0%})"
-        for c in candidates[:5]  # Top 5 only
-    ])
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a product disambiguation assistant.
+DISAMBIGUATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a product disambiguation assistant.
 
 The user asked for: "{product_ref}"
 
@@ -811,11 +1012,31 @@ If no candidate clearly matches, set product_id to null and explain why in reaso
 Do NOT pick a candidate just because it is the only one available — being the only fuzzy match is not the same as being a real match.
 
 Return JSON with product_id (an integer ID, or null) and reasoning."""),
-        ("user", "Which product did the user mean?")
+    ("user", "Which product did the user mean?")
+])
+
+DISAMBIGUATION_PARSER = JsonOutputParser(pydantic_object=ProductChoice)
+
+
+def llm_disambiguate_product(product_ref: str, candidates: list, llm) -> Dict[str, Any]:
+    """
+    Use LLM to disambiguate between multiple product candidates.
+
+    Args:
+        product_ref: User's product reference
+        candidates: List of candidate products with scores
+        llm: Language model instance (Haiku)
+
+    Returns:
+        Dict with resolved product_id, sku, name
+    """
+    # Build candidates list for prompt
+    candidates_str = "\n".join([
+        f"- ID {c['id']}: {c['name']} (SKU: {c['sku']}, confidence: {c['score']:.0%})"
+        for c in candidates[:FUZZY_MAX_CANDIDATES]
     ])
 
-    parser = JsonOutputParser(pydantic_object=ProductChoice)
-    chain = prompt | llm | parser
+    chain = DISAMBIGUATION_PROMPT | llm | DISAMBIGUATION_PARSER
 
     try:
         result = chain.invoke({
@@ -828,7 +1049,10 @@ Return JSON with product_id (an integer ID, or null) and reasoning."""),
 
         # LLM rejected all candidates — no real match
         if chosen_id is None:
-            print(f"[LLM Disambiguate] Rejected all candidates for '{product_ref}' - Reasoning: {reasoning}")
+            logger.debug(
+                "[LLM Disambiguate] Rejected all candidates for '%s' - Reasoning: %s",
+                product_ref, reasoning,
+            )
             return {
                 "resolution_error": f"No matching product for '{product_ref}': {reasoning}",
                 "llm_used": True
@@ -838,7 +1062,7 @@ Return JSON with product_id (an integer ID, or null) and reasoning."""),
         chosen = next((c for c in candidates if c["id"] == chosen_id), None)
 
         if chosen:
-            print(f"[LLM Disambiguate] Chose '{chosen['name']}' - Reasoning: {reasoning}")
+            logger.debug("[LLM Disambiguate] Chose '%s' - Reasoning: %s", chosen["name"], reasoning)
             return {
                 "product_id": chosen["id"],
                 "resolved_sku": chosen["sku"],
@@ -847,7 +1071,7 @@ Return JSON with product_id (an integer ID, or null) and reasoning."""),
             }
 
     except Exception as e:
-        print(f"[LLM Disambiguate] Failed: {e}")
+        logger.warning("[LLM Disambiguate] Failed: %s", e)
 
     # Fallback: return highest scoring candidate
     if candidates:
@@ -861,12 +1085,25 @@ Return JSON with product_id (an integer ID, or null) and reasoning."""),
     return {"resolution_error": f"No se pudo resolver '{product_ref}'"}
 
 
-def resolve_date(date_ref: str) -> str:
+# Relative date references -> days before today
+RELATIVE_DATE_OFFSETS = {
+    "hoy": 0,
+    "today": 0,
+    "ayer": 1,
+    "yesterday": 1,
+    "anteayer": 2,
+    "day before yesterday": 2,
+}
+
+
+def resolve_date(date_ref: str, today: Optional[date] = None) -> str:
     """
     Resolve date reference to ISO date string.
 
     Args:
         date_ref: Date reference ("ayer", "yesterday", "2024-01-15", etc.)
+        today: Reference date for relative dates; defaults to the current
+            date. Pass it to resolve every date of one request consistently.
 
     Returns:
         ISO date string (YYYY-MM-DD)
@@ -874,14 +1111,11 @@ def resolve_date(date_ref: str) -> str:
     date_ref_lower = date_ref.lower().strip()
 
     # Handle relative dates
-    today = datetime.now().date()
-
-    if date_ref_lower in ["hoy", "today"]:
-        return today.isoformat()
-    elif date_ref_lower in ["ayer", "yesterday"]:
-        return (today - timedelta(days=1)).isoformat()
-    elif date_ref_lower in ["anteayer", "day before yesterday"]:
-        return (today - timedelta(days=2)).isoformat()
+    offset = RELATIVE_DATE_OFFSETS.get(date_ref_lower)
+    if offset is not None:
+        if today is None:
+            today = datetime.now().date()
+        return (today - timedelta(days=offset)).isoformat()
 
     # Try to parse as ISO date
     try:
@@ -894,7 +1128,57 @@ def resolve_date(date_ref: str) -> str:
     return date_ref
 
 
-def generate_sku_from_name(name: str) -> str:
+# Product type codes for generated SKUs (ONLY types, not colors!)
+SKU_TYPE_CODES = {
+    "pulsera": "PULS",
+    "pulseras": "PULS",
+    "bracelet": "PULS",
+    "bracelets": "PULS",
+    "llavero": "LLAV",
+    "llaveros": "LLAV",
+    "keychain": "LLAV",
+    "keychains": "LLAV",
+}
+
+# Common filler words to skip (don't add value to SKU)
+SKU_SKIP_WORDS = frozenset({
+    "de", "del", "la", "las", "el", "los",  # Articles
+    "granos", "cafe", "coffee", "bean", "beans",  # Generic coffee words
+    "con", "y", "e", "and",  # Connectors
+})
+
+# Both tables in one, so each word is classified with a single lookup:
+# type code, "" for a skip word, missing for a descriptor
+_SKU_WORD_CODES = {**dict.fromkeys(SKU_SKIP_WORDS, ""), **SKU_TYPE_CODES}
+
+_SKU_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class _IndexedSkuProbe:
+    """SKU membership answered by one indexed lookup per probe."""
+
+    def __contains__(self, sku: str) -> bool:
+        return fetch_one("SELECT sku FROM products WHERE sku = %s", (sku,)) is not None
+
+
+def existing_sku_index():
+    """
+    Return a container answering `sku in index` for every product SKU.
+
+    The cached catalog's SKU index when the backend reports a data version;
+    otherwise the catalog would be re-read per call, so each probe is a
+    single indexed query instead.
+    """
+    if get_data_version() is None:
+        return _IndexedSkuProbe()
+    return load_product_catalog()["by_sku"]
+
+
+def generate_sku_from_name(
+    name: str,
+    reserved: Optional[set] = None,
+    existing_skus=None,
+) -> str:
     """
     Generate SKU automatically from ANY product name without hardcoded mappings.
 
@@ -913,75 +1197,156 @@ def generate_sku_from_name(name: str) -> str:
 
     Args:
         name: Product name (any descriptive name)
+        reserved: SKUs already handed out for products not created yet (a
+            batch being prepared). The generated SKU avoids them and is added.
+        existing_skus: existing_sku_index() result to probe; batches load it
+            once and pass it for every item. Loaded per call when omitted.
 
     Returns:
         Generated SKU (unique, descriptive, max 30 chars)
     """
-    # Normalize and extract key words
-    normalized = normalize_text(name)
-    words = normalized.split()
-
-    # Mapping of product types (ONLY types, not colors!)
-    type_mapping = {
-        "pulsera": "PULS",
-        "pulseras": "PULS",
-        "bracelet": "PULS",
-        "bracelets": "PULS",
-        "llavero": "LLAV",
-        "llaveros": "LLAV",
-        "keychain": "LLAV",
-        "keychains": "LLAV",
-    }
-
-    # Common filler words to skip (don't add value to SKU)
-    skip_words = {
-        "de", "del", "la", "las", "el", "los",  # Articles
-        "granos", "cafe", "coffee", "bean", "beans",  # Generic coffee words
-        "con", "y", "e", "and",  # Connectors
-    }
+    # Normalize and extract key words. Punctuation separates words and never
+    # reaches the SKU ("Pulseras (XL)" -> BC-PULS-XL).
+    words = _SKU_WORD_RE.findall(normalize_text(name))
 
-    # Extract type and descriptive words
+    # Extract type and descriptive words in one pass. Only the first two
+    # descriptors are used, so stop once those and the type are known.
     product_type = None
     descriptors = []
 
     for word in words:
-        if word in type_mapping and not product_type:
-            product_type = type_mapping[word]
-        elif word not in skip_words and len(word) > 1:  # Skip single letters
-            # Keep as descriptor (color, size, name, etc.)
-            descriptors.append(word.upper())
+        code = _SKU_WORD_CODES.get(word)
+        if code and not product_type:
+            product_type = code
+        elif code != "" and len(word) > 1 and len(descriptors) < 2:
+            # Keep as descriptor (color, size, name, etc.); filler words and
+            # single letters are skipped. Limit each descriptor to 10 chars
+            # to avoid huge SKUs.
+            descriptors.append(word[:10].upper())
+        if product_type and len(descriptors) >= 2:
+            break
 
     # Build SKU
     if not product_type:
         product_type = "PROD"  # Generic product
 
-    if descriptors:
-        # Use first 2 descriptors to keep SKU readable
-        # Limit each descriptor to 10 chars to avoid huge SKUs
-        desc_parts = [d[:10] for d in descriptors[:2]]
-        desc_part = "-".join(desc_parts)
-        base_sku = f"BC-{product_type}-{desc_part}"
-    else:
-        base_sku = f"BC-{product_type}-STD"
+    base_sku = f"BC-{product_type}-{'-'.join(descriptors) or 'STD'}"
 
-    # Check if SKU already exists and make it unique if needed
-    existing = fetch_one("SELECT sku FROM products WHERE sku = %s", (base_sku,))
+    # Check if SKU already exists and make it unique if needed. The index
+    # holds every SKU, active or not (see existing_sku_index).
+    if existing_skus is None:
+        existing_skus = existing_sku_index()
+    if reserved is None:
+        reserved = set()
 
-    if existing:
+    sku = base_sku
+    if sku in existing_skus or sku in reserved:
         # SKU exists, append a number to make it unique
-        print(f"[SKU Generation] SKU '{base_sku}' already exists, generating unique SKU...")
+        logger.debug("[SKU Generation] SKU '%s' already exists, generating unique SKU...", base_sku)
         counter = 2
         while True:
-            new_sku = f"{base_sku}-{counter}"
-            existing = fetch_one("SELECT sku FROM products WHERE sku = %s", (new_sku,))
-            if not existing:
-                print(f"[SKU Generation] Generated unique SKU: {new_sku}")
-                return new_sku
+            sku = f"{base_sku}-{counter}"
+            if sku not in existing_skus and sku not in reserved:
+                logger.debug("[SKU Generation] Generated unique SKU: %s", sku)
+                break
             counter += 1
     else:
-        print(f"[SKU Generation] Generated SKU: {base_sku} (from name: '{name}')")
+        logger.debug("[SKU Generation] Generated SKU: %s (from name: '%s')", base_sku, name)
+
+    reserved.add(sku)
+    return sku
+
+
+def validate_sale_fields(entities: Dict[str, Any]) -> list[str]:
+    """REGISTER_SALE needs items, each with a resolved product and a quantity."""
+    items = entities.get("items")
+    if not items:
+        return ["items"]
+
+    # Check each item has required fields, reported in item order
+    missing = []
+    for i, item in enumerate(items):
+        if "product_id" not in item and "resolution_error" in item:
+            missing.append(f"items[{i}].product_id (not found)")
+        if "quantity" not in item:
+            missing.append(f"items[{i}].quantity")
+    return missing
 
-    return base_sku
+
+def validate_product_fields(entities: Dict[str, Any]) -> list[str]:
+    """REGISTER_PRODUCT needs a name, per item or at top level."""
+    # Two shapes accepted:
+    #   - Single: top-level name (+ optional unit_price_cents/sku).
+    #   - Batch: items: [{name, unit_price_cents?, sku?}].
+    # Per Atlas review of PR-4, the batch shape does NOT carry quantity
+    # per item. Mixing quantity with a multi-product create is genuinely
+    # ambiguous (price vs stock); the router prompt is responsible for
+    # classifying those mixed cases as AMBIGUOUS upstream.
+    items = entities.get("items")
+    if items:
+        return [
+            f"items[{index}].name"
+            for index, item in enumerate(items)
+            if "name" not in item or not item["name"]
+        ]
+
+    # PR-A fix #2: post-greeting captura demonstrated that tenants
+    # responding "vendo medias, pantaletas y soquetes" obey the
+    # empty-catalog greeting copy literally and provide names only.
+    # PR-1 made unit_price_cents nullable in the schema; the direct
+    # REGISTER_PRODUCT path must mirror the items[] branch (already
+    # name-only) and accept None for unit_price_cents. The bot then
+    # creates the product with price pending and asks for it later.
+    missing = [] if "name" in entities else ["name"]
+
+    # PR-A fix #1: guard against silent comma-name corruption. A
+    # single-product create whose `name` looks like a list
+    # ("medias, pantaletas y soquetes") would otherwise persist a
+    # single product with that pathological name when the user
+    # provides a price. Reescalate to a clarifier signal so the
+    # next turn surfaces the choice instead of locking in the
+    # corruption. PR-B's decomposer is the structural fix; this
+    # guard is the bridge until that lands.
+    if _LIST_NAME_RE.search(entities.get("name") or ""):
+        entities["_comma_name_detected"] = True
+        # Use a sentinel marker in missing_fields so route_after_resolver
+        # still routes to final_answer naturally and the final_answer
+        # node translates the marker into a user-facing clarifier.
+        missing.append("ambiguous_comma_name_split")
+
+    return missing
+
+
+def validate_stock_fields(entities: Dict[str, Any]) -> list[str]:
+    """ADD_STOCK needs product_id + quantity, or an items array."""
+    # ADD_STOCK can work with either:
+    # 1. Single product: product_id + quantity
+    # 2. Multiple products: items array (like REGISTER_SALE)
+    if entities.get("items") or ("product_id" in entities and "quantity" in entities):
+        return []
+
+    # Report only the fields actually missing. The prior version of
+    # this branch appended both product_id and quantity even when
+    # quantity was already in entities, surfacing
+    # "Me falta la cantidad" to a user who had supplied it.
+    return [field for field in ("product_id", "quantity") if field not in entities]
+
+
+# Operations whose rules go beyond a flat list of required fields
+FIELD_VALIDATORS = {
+    "REGISTER_SALE": validate_sale_fields,
+    "REGISTER_PRODUCT": validate_product_fields,
+    "ADD_STOCK": validate_stock_fields,
+}
+
+# Required top-level fields for the remaining operations, as
+# (entity key, name reported in missing_fields)
+REQUIRED_FIELDS = {
+    "REGISTER_EXPENSE": (("amount_cents", "amount"), ("description", "description")),
+    # product_id is resolved from product_ref
+    "DEACTIVATE_PRODUCT": (("product_id", "product_id"),),
+    "UPDATE_PRODUCT_PRICE": (("product_id", "product_id"), ("unit_price_cents", "unit_price_cents")),
+}
 
 
 def validate_required_fields(operation_type: str, entities: Dict[str, Any]) -> list[str]:
@@ -995,116 +1360,48 @@ def validate_required_fields(operation_type: str, entities: Dict[str, Any]) -> l
     Returns:
         List of missing required fields
     """
-    missing = []
+    validator = FIELD_VALIDATORS.get(operation_type)
+    if validator:
+        return validator(entities)
+    return [
+        reported for field, reported in REQUIRED_FIELDS.get(operation_type, ())
+        if field not in entities
+    ]
 
-    if operation_type == "REGISTER_SALE":
-        if "items" not in entities or not entities["items"]:
-            missing.append("items")
-        else:
-            # Check each item has required fields
-            for i, item in enumerate(entities["items"]):
-                if "product_id" not in item and "resolution_error" in item:
-                    missing.append(f"items[{i}].product_id (not found)")
-                if "quantity" not in item:
-                    missing.append(f"items[{i}].quantity")
-
-    elif operation_type == "REGISTER_EXPENSE":
-        if "amount_cents" not in entities:
-            missing.append("amount")
-        if "description" not in entities:
-            missing.append("description")
-
-    elif operation_type == "REGISTER_PRODUCT":
-        # Two shapes accepted:
-        #   - Single: top-level name (+ optional unit_price_cents/sku).
-        #   - Batch: items: [{name, unit_price_cents?, sku?}].
-        # Per Atlas review of PR-4, the batch shape does NOT carry quantity
-        # per item. Mixing quantity with a multi-product create is genuinely
-        # ambiguous (price vs stock); the router prompt is responsible for
-        # classifying those mixed cases as AMBIGUOUS upstream.
-        items = entities.get("items")
-        if items:
-            for index, item in enumerate(items):
-                if "name" not in item or not item["name"]:
-                    missing.append(f"items[{index}].name")
-                if "sku" not in item:
-                    item["sku"] = generate_sku_from_name(item["name"]) if item.get("name") else None
-                if "unit_cost_cents" not in item:
-                    item["unit_cost_cents"] = 0
-        else:
-            # PR-A fix #2: post-greeting captura demonstrated that tenants
-            # responding "vendo medias, pantaletas y soquetes" obey the
-            # empty-catalog greeting copy literally and provide names only.
-            # PR-1 made unit_price_cents nullable in the schema; the direct
-            # REGISTER_PRODUCT path must mirror the items[] branch (already
-            # name-only) and accept None for unit_price_cents. The bot then
-            # creates the product with price pending and asks for it later.
-            required = ["name"]
-            for field in required:
-                if field not in entities:
-                    missing.append(field)
-
-            # PR-A fix #1: guard against silent comma-name corruption. A
-            # single-product create whose `name` looks like a list
-            # ("medias, pantaletas y soquetes") would otherwise persist a
-            # single product with that pathological name when the user
-            # provides a price. Reescalate to a clarifier signal so the
-            # next turn surfaces the choice instead of locking in the
-            # corruption. PR-B's decomposer is the structural fix; this
-            # guard is the bridge until that lands.
-            name_value = entities.get("name") or ""
-            if re.search(r",|\s+y\s+", name_value):
-                entities["_comma_name_detected"] = True
-                # Use a sentinel marker in missing_fields so route_after_resolver
-                # still routes to final_answer naturally and the final_answer
-                # node translates the marker into a user-facing clarifier.
-                missing.append("ambiguous_comma_name_split")
-                # Skip SKU autogeneration: we do not want a SKU for a
-                # pathological name and we do not want to pollute the DB
-                # cache.
-                if "unit_cost_cents" not in entities:
-                    entities["unit_cost_cents"] = 0
-                return missing
-
-            # Auto-generate SKU if not provided
-            if "sku" not in entities and "name" in entities:
-                entities["sku"] = generate_sku_from_name(entities["name"])
-
-            # Default unit_cost_cents to 0 if not provided
-            if "unit_cost_cents" not in entities:
-                entities["unit_cost_cents"] = 0
-
-    elif operation_type == "ADD_STOCK":
-        # ADD_STOCK can work with either:
-        # 1. Single product: product_id + quantity
-        # 2. Multiple products: items array (like REGISTER_SALE)
-        has_single = "product_id" in entities and "quantity" in entities
-        has_items = "items" in entities and len(entities.get("items", [])) > 0
-
-        if not has_single and not has_items:
-            # Report only the fields actually missing. The prior version of
-            # this branch appended both product_id and quantity even when
-            # quantity was already in entities, surfacing
-            # "Me falta la cantidad" to a user who had supplied it.
-            if not has_items:
-                if "product_id" not in entities:
-                    missing.append("product_id")
-                if "quantity" not in entities:
-                    missing.append("quantity")
-
-    elif operation_type == "DEACTIVATE_PRODUCT":
-        # Need product_id (should be resolved from product_ref)
-        if "product_id" not in entities:
-            missing.append("product_id")
-
-    elif operation_type == "UPDATE_PRODUCT_PRICE":
-        # Need product_id (resolved from product_ref) and unit_price_cents
-        if "product_id" not in entities:
-            missing.append("product_id")
-        if "unit_price_cents" not in entities:
-            missing.append("unit_price_cents")
 
-    return missing
+def apply_product_defaults(operation_type: str, entities: Dict[str, Any]) -> None:
+    """
+    Fill REGISTER_PRODUCT defaults in place: a generated SKU and a zero
+    unit cost, per item or at top level.
+    """
+    if operation_type != "REGISTER_PRODUCT":
+        return
+
+    items = entities.get("items")
+    if items:
+        # Items are created together, so their SKUs must differ from each
+        # other as well as from the catalog
+        reserved = {item["sku"] for item in items if item.get("sku")}
+        existing_skus = existing_sku_index()
+        for item in items:
+            if "sku" not in item:
+                item["sku"] = (
+                    generate_sku_from_name(item["name"], reserved, existing_skus)
+                    if item.get("name") else None
+                )
+            if "unit_cost_cents" not in item:
+                item["unit_cost_cents"] = 0
+        return
+
+    # Auto-generate SKU if not provided. Skipped for a name that reads like
+    # a list: we do not want a SKU for a pathological name and we do not
+    # want to pollute the DB cache.
+    if "sku" not in entities and "name" in entities and not _LIST_NAME_RE.search(entities["name"] or ""):
+        entities["sku"] = generate_sku_from_name(entities["name"])
+
+    # Default unit_cost_cents to 0 if not provided
+    if "unit_cost_cents" not in entities:
+        entities["unit_cost_cents"] = 0
 
 
 def route_after_resolver(state: AgentState) -> str:
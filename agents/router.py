@@ -9,13 +9,53 @@ Responsibilities:
 - NO SQL execution
 - NO database writes
 """
+import copy
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from typing import Dict, Any, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
 
+from .json_stream import first_json_object
 from .state import AgentState
 
+logger = logging.getLogger(__name__)
+
+# Below this confidence the router asks the user to clarify
+MIN_CONFIDENCE = 0.6
+
+# Classifications are memoized per agent instance, keyed on the input text.
+# Greetings, follow-ups and retries repeat verbatim, so a hit skips the LLM
+# round-trip entirely.
+ROUTER_CACHE_SIZE = 1024
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Messages made only of greetings, thanks or farewells are classified here,
+# without the LLM. Anything else in the message falls through to the model.
+_GREETING_PHRASE = (
+    r"(?:hola|hey|hi(?:\s+there)?|hello|buenas|buen(?:os)?\s+d[ií]as?"
+    r"|buenas\s+(?:tardes|noches)|qu[eé]\s+tal|c[oó]mo\s+(?:andas|and[aá]s|est[aá]s|va)"
+    r"|(?:muchas\s+)?gracias|thank\s+you|thanks|chau|ad[ií]os|bye|hasta\s+luego|nos\s+vemos)"
+)
+_GREETING_RE = re.compile(
+    rf"[\s¡¿]*{_GREETING_PHRASE}(?:[\s,!.?¡¿]+{_GREETING_PHRASE})*[\s!.?]*",
+    re.IGNORECASE,
+)
+
+GREETING_CLASSIFICATION = {
+    "intent": "GREETING",
+    "operation_type": "UNKNOWN",
+    "confidence": 1.0,
+    "missing_fields": [],
+    "normalized_entities": {},
+    "reasoning": "Message is only a greeting, thanks or farewell",
+}
+
 
 class IntentClassification(BaseModel):
     """Structured output for intent classification."""
@@ -37,16 +77,15 @@ class IntentClassification(BaseModel):
 ROUTER_PROMPT = ChatPromptTemplate.from_messages([
     ("system", """You are an Intent Router for a business management system (Beans&Co).
 
-Your ONLY job is to classify user intent. You DO NOT execute queries or operations.
+Your ONLY job is to classify user intent and extract entities from natural
+language. You DO NOT execute queries or operations, and you DO NOT resolve
+product IDs (that's the resolver's job).
 
 IMPORTANT CONVERSATION CONTEXT:
 - The user input may include "Contexto de conversación reciente:" followed by previous messages
 - You MUST extract entities from BOTH the conversation context AND the current message
 - If the context mentions a product name and the current message mentions a price, combine both
-- Example:
-  Context: "Usuario: registrar Pulseras Premium"
-  Current: "salen 10 dólares"
-  → Extract: {{"name": "Pulseras Premium", "unit_price": 10}}
+  (see CONVERSATION CONTEXT EXAMPLES below)
 
 INTENT CATEGORIES:
 
@@ -123,7 +162,6 @@ INTENT CATEGORIES:
      * "gracias!"
      * "chau"
      * "hi there"
-   - IMPORTANT: Respond naturally and friendly, keep it brief
 
 5. AMBIGUOUS
    - Missing critical information OR genuinely ambiguous between two intents.
@@ -365,16 +403,12 @@ IMPORTANT FOR CONFIRMATION/DECLINE:
 - A bare "si" or "no" without that prior context should NOT be classified as
   these intents. Fall back to AMBIGUOUS or GREETING as appropriate.
 - For REGISTER_PRODUCT_WITH_STOCK, extract `name` and `initial_stock` from the
-  prior turn's proposal (the candidate name and the quantity it mentions).
-
-IMPORTANT:
-- DO NOT execute SQL
-- DO NOT write to database
-- DO NOT resolve product IDs (that's the resolver's job)
-- ONLY classify and extract entities from natural language"""),
+  prior turn's proposal (the candidate name and the quantity it mentions)."""),
     ("user", "{input}")
 ])
 
+ROUTER_PARSER = JsonOutputParser(pydantic_object=IntentClassification)
+
 
 def classification_to_state(result: Dict[str, Any]) -> Dict[str, Any]:
     """Map a parsed router classification to the next AgentState delta.
@@ -383,7 +417,7 @@ def classification_to_state(result: Dict[str, Any]) -> Dict[str, Any]:
     without touching the LLM. Returns the same dict shape `route_intent`
     yields to the graph.
     """
-    if result["confidence"] < 0.6:
+    if result["confidence"] < MIN_CONFIDENCE:
         clarification = (
             "Tengo dudas sobre lo que necesitas. "
             "Puedes decirme si quieres consultar datos (stock, ventas, precios) "
@@ -432,6 +466,23 @@ def classification_to_state(result: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+def router_cache_key(user_input: str) -> str:
+    """
+    Build the classification cache key for a router input.
+
+    Only whitespace is collapsed: case, accents, digits and punctuation stay,
+    because the extracted entities (names, quantities, prices) are copied
+    from the text.
+    """
+    return _WHITESPACE_RE.sub(" ", user_input).strip()
+
+
+def is_greeting(user_input: str) -> bool:
+    """True when the current message is nothing but small talk."""
+    _, _, current_message = user_input.rpartition("Mensaje actual:")
+    return _GREETING_RE.fullmatch(current_message) is not None
+
+
 def create_router_agent(llm):
     """
     Create the router agent that classifies user intent.
@@ -440,10 +491,53 @@ def create_router_agent(llm):
         llm: Language model instance
 
     Returns:
-        Agent function that takes AgentState and returns classification
+        Agent function that takes AgentState and returns classification.
+        Its cache_clear() drops the memoized classifications.
     """
-    parser = JsonOutputParser(pydantic_object=IntentClassification)
-    chain = ROUTER_PROMPT | llm | parser
+    chain = ROUTER_PROMPT | llm
+    cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    # Classifications being computed, so concurrent requests (graph runs in
+    # worker threads) with the same input share one LLM call
+    inflight: Dict[str, Future] = {}
+    lock = threading.Lock()
+
+    def classify(user_input: str) -> Dict[str, Any]:
+        """Classify user_input, hitting the LLM only on a cache miss."""
+        key = router_cache_key(user_input)
+        with lock:
+            result = cache.get(key)
+            if result is not None:
+                cache.move_to_end(key)
+            else:
+                pending = inflight.get(key)
+                leader = pending is None
+                if leader:
+                    pending = inflight[key] = Future()
+
+        if result is None and not leader:
+            # Another request is classifying the same input: wait for it
+            result = pending.result()
+        elif result is None:
+            try:
+                # Stream the reply and parse as soon as the JSON object closes
+                chunks = chain.stream({"input": user_input})
+                result = ROUTER_PARSER.parse(first_json_object(chunks))
+            except Exception as e:
+                with lock:
+                    inflight.pop(key, None)
+                pending.set_exception(e)
+                raise
+            with lock:
+                inflight.pop(key, None)
+                # Low-confidence answers are not pinned: a retry may do better
+                if result.get("confidence", 0) >= MIN_CONFIDENCE:
+                    cache[key] = result
+                    if len(cache) > ROUTER_CACHE_SIZE:
+                        cache.popitem(last=False)
+            pending.set_result(result)
+
+        # Callers get their own copy of the entities
+        return copy.deepcopy(result)
 
     def route_intent(state: AgentState) -> Dict[str, Any]:
         """
@@ -457,18 +551,15 @@ def create_router_agent(llm):
         """
         user_input = state["user_input"]
 
+        if is_greeting(user_input):
+            return classification_to_state(copy.deepcopy(GREETING_CLASSIFICATION))
+
         try:
-            result = chain.invoke({"input": user_input})
+            result = classify(user_input)
             return classification_to_state(result)
 
         except Exception as e:
-            # Debug: print the actual error
-            import traceback
-            print(f"\n!!! ROUTER ERROR !!!")
-            print(f"Error: {str(e)}")
-            print(f"Traceback:")
-            traceback.print_exc()
-            print(f"!!! END ERROR !!!\n")
+            logger.exception("Router failed")
 
             return {
                 "intent": "AMBIGUOUS",
@@ -478,6 +569,7 @@ def create_router_agent(llm):
                 "normalized_entities": {}
             }
 
+    route_intent.cache_clear = cache.clear
     return route_intent
 
 
@@ -37,14 +37,14 @@ Navigation contract (T-007):
     Read-only intents do not navigate.
 """
 import re
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Tuple
 from database_config import (
     register_sale,
     register_product,
     register_product_with_stock,
     register_products_batch,
     update_product_price,
-    add_stock,
+    add_stock_bulk,
     register_expense,
     deactivate_product,
     cancel_sale,
@@ -53,10 +53,11 @@ from database_config import (
     get_last_sale,
     get_last_expense,
     get_last_stock_movement,
-    get_last_operation,
+    cancel_last_operation,
     fetch_one,
 )
 
+from .resolver import existing_sku_index, generate_sku_from_name
 from .state import AgentState
 
 
@@ -76,6 +77,22 @@ _OPERATION_NAVIGATION: Dict[str, str] = {
     "DEACTIVATE_PRODUCT": "Productos",
 }
 
+# Technical field names -> user-friendly Spanish, for missing-field prompts.
+_FIELD_TRANSLATIONS: Dict[str, str] = {
+    "unit_price": "el precio de venta",
+    "unit_price_cents": "el precio de venta",
+    "unit_cost": "el costo de producción",
+    "unit_cost_cents": "el costo de producción",
+    "name": "el nombre del producto",
+    "amount": "el monto",
+    "amount_cents": "el monto",
+    "description": "la descripción",
+    "product_ref": "el producto",
+    "product_id": "el producto",
+    "quantity": "la cantidad",
+    "items": "los productos",
+}
+
 
 def _navigation_for(operation_type: str | None, last_op_type: str | None = None) -> Dict[str, str] | None:
     """Map an operation_type to a navigation cue, or None if no tab change.
@@ -93,6 +110,460 @@ def _navigation_for(operation_type: str | None, last_op_type: str | None = None)
     return {"tab": tab} if tab else None
 
 
+def _format_financial_footer(result: Dict[str, Any], hide_zero: bool = False) -> str:
+    """Build the trailing revenue / accumulated profit block of a summary.
+
+    Each figure is shown only when the operation result carries it, and with
+    hide_zero (the sale confirmation) only when it is non-zero too; returns
+    "" when no figure is shown.
+    """
+    def shown(value) -> bool:
+        return bool(value) if hide_zero else value is not None
+
+    lines = []
+    revenue = result.get("revenue_usd")
+    if shown(revenue):
+        lines.append(f"_Ventas totales: ${revenue:.2f}_")
+    profit = result.get("profit_usd")
+    if shown(profit):
+        if profit >= 0:
+            lines.append(f"_Ganancia acumulada: ${profit:.2f}_")
+        else:
+            lines.append(f"_Pérdida acumulada: ${abs(profit):.2f}_")
+    return "\n\n" + "\n".join(lines) if lines else ""
+
+
+class _OperationBlocked(Exception):
+    """Raised by a handler that needs more input from the user before it can run.
+
+    Unlike a failure, `message` is shown to the user as-is, without the
+    "Operación fallida" prefix; `log` goes to the agent message trail.
+    """
+
+    def __init__(self, message: str, log: str):
+        super().__init__(message)
+        self.message = message
+        self.log = log
+
+
+def _handle_register_sale(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Register a sale for the resolved items."""
+    # Prepare sale data
+    items = entities.get("items", [])
+    status = entities.get("status", "PAID")
+
+    if not items:
+        raise ValueError("No se especificaron artículos para la venta")
+
+    # CRITICAL SAFETY CHECK: Verify NO items have resolution errors
+    for item in items:
+        if "resolution_error" in item:
+            raise ValueError(item["resolution_error"])
+
+    # Block sale if any item refers to a product with NULL price.
+    # If the user provided an inline override (item["unit_price_cents"]),
+    # the sale proceeds with that override and the catalog price stays
+    # untouched.
+    for item in items:
+        if item.get("unit_price_cents") is not None:
+            continue
+        product_id = item.get("product_id")
+        if product_id is None:
+            continue
+        row = fetch_one(
+            "SELECT name, unit_price_cents FROM products WHERE id = %s",
+            (product_id,),
+        )
+        if row is not None and row["unit_price_cents"] is None:
+            product_name = row["name"]
+            block_msg = (
+                f"Necesito el precio de venta de *{product_name}* antes "
+                f"de cobrar. A cuanto la vendes?"
+            )
+            raise _OperationBlocked(
+                block_msg,
+                f"REGISTER_SALE blocked: product {product_id} has NULL price",
+            )
+
+    sale_data = {
+        "items": items,
+        "status": status
+    }
+
+    result = register_sale(sale_data)
+
+    # Build friendly message
+    items_text = []
+    for item in items:
+        product_name = item.get("resolved_name", "Producto")
+        qty = item.get("quantity", 0)
+        items_text.append(f"{qty} {product_name}")
+
+    operation_summary = f"*✅ Venta registrada!*\n\n"
+    operation_summary += "• " + "\n• ".join(items_text)
+    operation_summary += f"\n• Total: *${result['total_usd']:.2f}*"
+    operation_summary += _format_financial_footer(result, hide_zero=True)
+
+    return result, operation_summary
+
+
+def _handle_register_expense(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Register an expense."""
+    # Prepare expense data
+    amount_cents = entities.get("amount_cents")
+    description = entities.get("description", "Gasto")
+    category = entities.get("category", "GENERAL")
+    expense_date = entities.get("date")
+
+    if amount_cents is None:
+        raise ValueError("Se requiere el monto para el gasto")
+
+    expense_data = {
+        "amount_cents": amount_cents,
+        "description": description,
+        "category": category,
+    }
+    if expense_date:
+        expense_data["expense_date"] = expense_date
+
+    result = register_expense(expense_data)
+
+    operation_summary = f"*💸 Gasto registrado!*\n\n"
+    operation_summary += f"• {description}\n"
+    operation_summary += f"• Monto: *${result['amount_usd']:.2f}*"
+    operation_summary += _format_financial_footer(result)
+
+    return result, operation_summary
+
+
+def _handle_register_product(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Create one product, or a batch of products atomically."""
+    # Two shapes accepted:
+    #   - Single: top-level name/sku/unit_price_cents (legacy).
+    #   - Batch: items: [{name, sku, unit_price_cents?, unit_cost_cents?}].
+    # Per Atlas review of PR-4, the batch path is atomic: all
+    # rows land or none do.
+    items = entities.get("items")
+    if items:
+        products_data = []
+        reserved_skus = {raw["sku"] for raw in items if raw.get("sku")}
+        existing_skus = existing_sku_index()
+        for raw in items:
+            item_name = raw.get("name")
+            if not item_name:
+                raise ValueError(
+                    "Cada producto necesita un nombre"
+                )
+            item_sku = raw.get("sku")
+            if not item_sku:
+                item_sku = generate_sku_from_name(item_name, reserved_skus, existing_skus)
+            products_data.append({
+                "sku": item_sku,
+                "name": item_name,
+                "description": raw.get("description"),
+                "unit_price_cents": raw.get("unit_price_cents"),
+                "unit_cost_cents": raw.get("unit_cost_cents", 0),
+            })
+
+        result = register_products_batch(products_data)
+
+        operation_summary = f"*✨ {len(products_data)} productos creados!*\n\n"
+        for product, row in zip(products_data, result):
+            price_cents = product.get("unit_price_cents")
+            if price_cents is not None:
+                price_str = f"${price_cents/100:.2f}"
+            else:
+                price_str = "_precio pendiente_"
+            operation_summary += (
+                f"• *{product['name']}* — {price_str} "
+                f"(_código {row['sku']}_)\n"
+            )
+        operation_summary = operation_summary.rstrip()
+    else:
+        # Legacy single-product path. Validation already done by Resolver.
+        # PR-A fix #2: unit_price_cents may be None when the user
+        # responded to the empty-catalog greeting with names-only.
+        # The schema is nullable (PR-1) and the resolver no longer
+        # forces the field; render "precio pendiente" in the
+        # summary instead of crashing on the f-string division.
+        sku = entities.get("sku")
+        name = entities.get("name")
+        unit_price_cents = entities.get("unit_price_cents")
+        unit_cost_cents = entities.get("unit_cost_cents", 0)
+        description = entities.get("description")
+
+        product_data = {
+            "sku": sku,
+            "name": name,
+            "description": description,
+            "unit_price_cents": unit_price_cents,
+            "unit_cost_cents": unit_cost_cents
+        }
+
+        result = register_product(product_data)
+
+        if unit_price_cents is not None:
+            price_line = f"• Precio: *${unit_price_cents/100:.2f}*"
+        else:
+            price_line = "• Precio: _precio pendiente_"
+
+        operation_summary = f"*✨ Producto creado!*\n\n"
+        operation_summary += f"• {name}\n"
+        operation_summary += f"• Código: _{sku}_\n"
+        operation_summary += price_line
+
+    return result, operation_summary
+
+
+def _handle_update_product_price(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Set or change the sale price of an existing product."""
+    # Set or change the sale price of an existing product.
+    # Resolver has already turned product_ref -> product_id and
+    # unit_price -> unit_price_cents.
+    product_id = entities.get("product_id")
+    unit_price_cents = entities.get("unit_price_cents")
+
+    if product_id is None or unit_price_cents is None:
+        raise ValueError(
+            "Faltan datos para actualizar el precio del producto"
+        )
+
+    row = update_product_price(product_id, int(unit_price_cents))
+    result = row
+
+    product_name = (
+        row.get("name") if row else entities.get("resolved_name", "el producto")
+    )
+    price_usd = unit_price_cents / 100.0
+    operation_summary = (
+        f"Listo. *{product_name}* ahora se vende a *${price_usd:.2f}*."
+    )
+
+    return result, operation_summary
+
+
+def _handle_register_product_with_stock(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Create a product (price pending) together with its initial stock."""
+    # Atomic op: create product (price pending) + register initial stock entry.
+    # Triggered by user confirming a PROPOSE_PRODUCT_CREATION turn.
+    name = entities.get("name")
+    initial_stock = entities.get("initial_stock")
+
+    if not name or initial_stock is None:
+        raise ValueError(
+            "Faltan datos para crear producto y registrar stock"
+        )
+
+    sku = entities.get("sku") or generate_sku_from_name(name)
+
+    result = register_product_with_stock({
+        "sku": sku,
+        "name": name,
+        "description": entities.get("description"),
+        "unit_price_cents": None,  # precio pendiente
+        "unit_cost_cents": entities.get("unit_cost_cents", 0),
+        "initial_stock": initial_stock,
+        "stock_reason": entities.get("stock_reason", "Entrada inicial"),
+    })
+
+    current_stock = result.get("current_stock", initial_stock)
+    operation_summary = (
+        f"Listo. Cree *{name}* y registre {initial_stock} unidades de entrada "
+        f"(stock actual: {current_stock}).\n\n"
+        f"Querés cargar el precio de venta ahora o lo dejamos para la primera venta?"
+    )
+
+    return result, operation_summary
+
+
+def _handle_add_stock(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Add stock for one product or several items."""
+    # ADD_STOCK can handle either single product or multiple items
+    reason = entities.get("reason", "Entrada de stock")
+    movement_type = entities.get("movement_type", "IN")
+
+    items = entities.get("items", [])
+
+    # If no items array, treat as single product
+    if not items:
+        product_id = entities.get("product_id")
+        quantity = entities.get("quantity")
+
+        if product_id is None or quantity is None:
+            raise ValueError("Se requieren product_id y quantity para actualizar el stock")
+
+        items = [{
+            "product_id": product_id,
+            "quantity": quantity,
+            "resolved_name": entities.get("resolved_name", "producto")
+        }]
+
+    # CRITICAL SAFETY CHECK: Verify NO items have resolution errors
+    for item in items:
+        if "resolution_error" in item:
+            raise ValueError(item["resolution_error"])
+
+    # All stock movements in one database call
+    results = add_stock_bulk(items, reason=reason, movement_type=movement_type)
+    for item, result in zip(items, results):
+        result["resolved_name"] = item.get("resolved_name", "producto")
+        result["quantity"] = item.get("quantity", 0)  # Preserve quantity for display
+    result = results[-1]
+
+    # Build summary
+    operation_summary = f"*📦 Stock actualizado!*\n\n"
+    for res in results:
+        product_name = res["resolved_name"]
+        quantity = res.get("quantity", 0)
+        current = res.get("current_stock", 0)
+        operation_summary += f"• *{product_name}*: +{quantity} unidades (stock actual: {current})\n"
+
+    return result, operation_summary
+
+
+def _handle_cancel_sale(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Cancel the last sale or a specific one."""
+    # Get the sale to cancel
+    target = entities.get("target", "last")
+
+    if target == "last":
+        # Get last sale
+        last_sale = get_last_sale()
+        if not last_sale:
+            raise ValueError("No hay ventas para cancelar")
+        sale_id = last_sale["id"]
+    else:
+        # Specific sale_id
+        sale_id = int(target)
+
+    # Cancel the sale
+    result = cancel_sale(sale_id)
+
+    operation_summary = f"*❌ Venta cancelada!*\n\n"
+    operation_summary += f"• Se canceló la venta por *${result['cancelled_amount']:.2f}*"
+    operation_summary += _format_financial_footer(result)
+
+    return result, operation_summary
+
+
+def _handle_cancel_expense(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Cancel the last expense or a specific one."""
+    # Get the expense to cancel
+    target = entities.get("target", "last")
+
+    if target == "last":
+        # Get last expense
+        last_expense = get_last_expense()
+        if not last_expense:
+            raise ValueError("No hay gastos para cancelar")
+        expense_id = last_expense["id"]
+    else:
+        # Specific expense_id
+        expense_id = int(target)
+
+    # Cancel the expense
+    result = cancel_expense(expense_id)
+
+    operation_summary = f"*❌ Gasto cancelado!*\n\n"
+    operation_summary += f"• Se canceló: {result['description']}\n"
+    operation_summary += f"• Monto: *${result['cancelled_amount']:.2f}*"
+    operation_summary += _format_financial_footer(result)
+
+    return result, operation_summary
+
+
+def _handle_cancel_stock(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Cancel the last stock entry or a specific one."""
+    # Get the stock movement to cancel
+    target = entities.get("target", "last")
+
+    if target == "last":
+        # Get last stock movement
+        last_movement = get_last_stock_movement()
+        if not last_movement:
+            raise ValueError("No hay movimientos de stock para cancelar")
+        movement_id = last_movement["id"]
+    else:
+        # Specific movement_id
+        movement_id = int(target)
+
+    # Cancel the stock movement
+    result = cancel_stock_movement(movement_id)
+
+    operation_summary = f"*❌ Stock cancelado!*\n\n"
+    operation_summary += f"• Se canceló entrada de stock de *{result['product_name']}*\n"
+    operation_summary += f"• Cantidad cancelada: {result['cancelled_quantity']} unidades\n"
+    operation_summary += f"• Stock actual: {result['current_stock']} unidades"
+
+    return result, operation_summary
+
+
+def _handle_cancel_last_operation(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Cancel whichever sale, expense or stock entry happened last."""
+    # Detect which was the last operation and cancel it in one call
+    result = cancel_last_operation()
+
+    if not result:
+        raise ValueError("No hay operaciones recientes para cancelar")
+
+    op_type = result["type"]
+
+    if op_type == "SALE":
+        operation_summary = f"*❌ Venta cancelada!*\n\n"
+        operation_summary += f"• Se canceló la venta por *${result['cancelled_amount']:.2f}*"
+        operation_summary += _format_financial_footer(result)
+
+    elif op_type == "EXPENSE":
+        operation_summary = f"*❌ Gasto cancelado!*\n\n"
+        operation_summary += f"• Se canceló: {result['description']}\n"
+        operation_summary += f"• Monto: *${result['cancelled_amount']:.2f}*"
+        operation_summary += _format_financial_footer(result)
+
+    elif op_type == "STOCK":
+        operation_summary = f"*❌ Stock cancelado!*\n\n"
+        operation_summary += f"• Se canceló entrada de stock de *{result['product_name']}*\n"
+        operation_summary += f"• Cantidad cancelada: {result['cancelled_quantity']} unidades\n"
+        operation_summary += f"• Stock actual: {result['current_stock']} unidades"
+
+    return result, operation_summary
+
+
+def _handle_deactivate_product(entities: Dict[str, Any]) -> Tuple[Any, str]:
+    """Deactivate a product (mark as inactive, don't delete)."""
+    # Deactivate a product (mark as inactive, don't delete)
+    product_id = entities.get("product_id")
+    product_name = entities.get("resolved_name", "producto")
+
+    if product_id is None:
+        raise ValueError("No se pudo identificar el producto a desactivar")
+
+    result = deactivate_product(product_id)
+
+    operation_summary = f"*🗑️ Producto desactivado!*\n\n"
+    operation_summary += f"• *{product_name}* ha sido removido del catálogo\n"
+    operation_summary += f"• El producto ya no aparecerá en el inventario\n"
+    operation_summary += f"• El historial de ventas se mantiene intacto"
+
+    return result, operation_summary
+
+
+# operation_type -> handler. Each handler takes the normalized entities and
+# returns (result, operation_summary); it raises to report a failure.
+_OPERATION_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Tuple[Any, str]]] = {
+    "REGISTER_SALE": _handle_register_sale,
+    "REGISTER_EXPENSE": _handle_register_expense,
+    "REGISTER_PRODUCT": _handle_register_product,
+    "UPDATE_PRODUCT_PRICE": _handle_update_product_price,
+    "REGISTER_PRODUCT_WITH_STOCK": _handle_register_product_with_stock,
+    "ADD_STOCK": _handle_add_stock,
+    "CANCEL_SALE": _handle_cancel_sale,
+    "CANCEL_EXPENSE": _handle_cancel_expense,
+    "CANCEL_STOCK": _handle_cancel_stock,
+    "CANCEL_LAST_OPERATION": _handle_cancel_last_operation,
+    "DEACTIVATE_PRODUCT": _handle_deactivate_product,
+}
+
+
 def create_write_agent():
     """
     Create the write operations agent.
@@ -161,30 +632,15 @@ def create_write_agent():
                     }]
                 }
 
-            # Translate technical field names to user-friendly Spanish
-            field_translations = {
-                "unit_price": "el precio de venta",
-                "unit_price_cents": "el precio de venta",
-                "unit_cost": "el costo de producción",
-                "unit_cost_cents": "el costo de producción",
-                "name": "el nombre del producto",
-                "amount": "el monto",
-                "amount_cents": "el monto",
-                "description": "la descripción",
-                "product_ref": "el producto",
-                "product_id": "el producto",
-                "quantity": "la cantidad",
-                "items": "los productos",
-            }
-
             # Generic fallback so a column name we forgot to translate never
             # leaks to the user. Better to say "ese dato" than "product_id".
-            friendly_missing = [field_translations.get(field, "ese dato") for field in missing_fields]
-
-            if len(friendly_missing) == 1:
-                error_msg = f"Me falta un dato: *{friendly_missing[0]}*\n\n¿Me lo podés decir?"
+            if len(missing_fields) == 1:
+                friendly = _FIELD_TRANSLATIONS.get(missing_fields[0], "ese dato")
+                error_msg = f"Me falta un dato: *{friendly}*\n\n¿Me lo podés decir?"
             else:
-                fields_list = "\n• ".join(friendly_missing)
+                fields_list = "\n• ".join(
+                    _FIELD_TRANSLATIONS.get(field, "ese dato") for field in missing_fields
+                )
                 error_msg = f"Me faltan algunos datos:\n• {fields_list}\n\n¿Me los podés decir?"
 
             return {
@@ -198,440 +654,20 @@ def create_write_agent():
             }
 
         try:
-            result = None
-            operation_summary = ""
-            # Tracks SALE|EXPENSE|STOCK for CANCEL_LAST_OPERATION so we
-            # can emit the right navigation cue. Stays None for every
-            # other operation type.
-            cancelled_op_type: str | None = None
-
-            if operation_type == "REGISTER_SALE":
-                # Prepare sale data
-                items = entities.get("items", [])
-                status = entities.get("status", "PAID")
-
-                if not items:
-                    raise ValueError("No se especificaron artículos para la venta")
-
-                # CRITICAL SAFETY CHECK: Verify NO items have resolution errors
-                for item in items:
-                    if "resolution_error" in item:
-                        raise ValueError(item["resolution_error"])
-
-                # Block sale if any item refers to a product with NULL price.
-                # If the user provided an inline override (item["unit_price_cents"]),
-                # the sale proceeds with that override and the catalog price stays
-                # untouched.
-                for item in items:
-                    if item.get("unit_price_cents") is not None:
-                        continue
-                    product_id = item.get("product_id")
-                    if product_id is None:
-                        continue
-                    row = fetch_one(
-                        "SELECT name, unit_price_cents FROM products WHERE id = %s",
-                        (product_id,),
-                    )
-                    if row is not None and row["unit_price_cents"] is None:
-                        product_name = row["name"]
-                        block_msg = (
-                            f"Necesito el precio de venta de *{product_name}* antes "
-                            f"de cobrar. A cuanto la vendes?"
-                        )
-                        return {
-                            "operation_result": None,
-                            "error": block_msg,
-                            "final_answer": block_msg,
-                            "messages": [{
-                                "role": "assistant",
-                                "content": (
-                                    f"[Write Agent] REGISTER_SALE blocked: "
-                                    f"product {product_id} has NULL price"
-                                )
-                            }]
-                        }
-
-                sale_data = {
-                    "items": items,
-                    "status": status
-                }
-
-                result = register_sale(sale_data)
-
-                # Build friendly message
-                items_text = []
-                for item in items:
-                    product_name = item.get("resolved_name", "Producto")
-                    qty = item.get("quantity", 0)
-                    items_text.append(f"{qty} {product_name}")
-
-                operation_summary = f"*✅ Venta registrada!*\n\n"
-                operation_summary += "• " + "\n• ".join(items_text)
-                operation_summary += f"\n• Total: *${result['total_usd']:.2f}*"
-
-                if result.get('revenue_usd'):
-                    operation_summary += f"\n\n_Ventas totales: ${result['revenue_usd']:.2f}_"
-                if result.get('profit_usd'):
-                    profit = result['profit_usd']
-                    if profit >= 0:
-                        operation_summary += f"\n_Ganancia acumulada: ${profit:.2f}_"
-                    else:
-                        operation_summary += f"\n_Pérdida acumulada: ${abs(profit):.2f}_"
-
-            elif operation_type == "REGISTER_EXPENSE":
-                # Prepare expense data
-                amount_cents = entities.get("amount_cents")
-                description = entities.get("description", "Gasto")
-                category = entities.get("category", "GENERAL")
-                expense_date = entities.get("date")
-
-                if amount_cents is None:
-                    raise ValueError("Se requiere el monto para el gasto")
-
-                expense_data = {
-                    "amount_cents": amount_cents,
-                    "description": description,
-                    "category": category,
-                }
-                if expense_date:
-                    expense_data["expense_date"] = expense_date
-
-                result = register_expense(expense_data)
-
-                operation_summary = f"*💸 Gasto registrado!*\n\n"
-                operation_summary += f"• {description}\n"
-                operation_summary += f"• Monto: *${result['amount_usd']:.2f}*"
-
-                if result.get('profit_usd') is not None:
-                    profit = result['profit_usd']
-                    if profit >= 0:
-                        operation_summary += f"\n\n_Ganancia acumulada: ${profit:.2f}_"
-                    else:
-                        operation_summary += f"\n\n_Pérdida acumulada: ${abs(profit):.2f}_"
-
-            elif operation_type == "REGISTER_PRODUCT":
-                # Two shapes accepted:
-                #   - Single: top-level name/sku/unit_price_cents (legacy).
-                #   - Batch: items: [{name, sku, unit_price_cents?, unit_cost_cents?}].
-                # Per Atlas review of PR-4, the batch path is atomic: all
-                # rows land or none do.
-                items = entities.get("items")
-                if items:
-                    products_data = []
-                    for raw in items:
-                        item_name = raw.get("name")
-                        if not item_name:
-                            raise ValueError(
-                                "Cada producto necesita un nombre"
-                            )
-                        item_sku = raw.get("sku")
-                        if not item_sku:
-                            from agents.resolver import generate_sku_from_name
-                            item_sku = generate_sku_from_name(item_name)
-                        products_data.append({
-                            "sku": item_sku,
-                            "name": item_name,
-                            "description": raw.get("description"),
-                            "unit_price_cents": raw.get("unit_price_cents"),
-                            "unit_cost_cents": raw.get("unit_cost_cents", 0),
-                        })
-
-                    result = register_products_batch(products_data)
-
-                    operation_summary = f"*✨ {len(products_data)} productos creados!*\n\n"
-                    for product, row in zip(products_data, result):
-                        price_cents = product.get("unit_price_cents")
-                        if price_cents is not None:
-                            price_str = f"${price_cents/100:.2f}"
-                        else:
-                            price_str = "_precio pendiente_"
-                        operation_summary += (
-                            f"• *{product['name']}* — {price_str} "
-                            f"(_código {row['sku']}_)\n"
-                        )
-                    operation_summary = operation_summary.rstrip()
-                else:
-                    # Legacy single-product path. Validation already done by Resolver.
-                    # PR-A fix #2: unit_price_cents may be None when the user
-                    # responded to the empty-catalog greeting with names-only.
-                    # The schema is nullable (PR-1) and the resolver no longer
-                    # forces the field; render "precio pendiente" in the
-                    # summary instead of crashing on the f-string division.
-                    sku = entities.get("sku")
-                    name = entities.get("name")
-                    unit_price_cents = entities.get("unit_price_cents")
-                    unit_cost_cents = entities.get("unit_cost_cents", 0)
-                    description = entities.get("description")
-
-                    product_data = {
-                        "sku": sku,
-                        "name": name,
-                        "description": description,
-                        "unit_price_cents": unit_price_cents,
-                        "unit_cost_cents": unit_cost_cents
-                    }
-
-                    result = register_product(product_data)
-
-                    if unit_price_cents is not None:
-                        price_line = f"• Precio: *${unit_price_cents/100:.2f}*"
-                    else:
-                        price_line = "• Precio: _precio pendiente_"
-
-                    operation_summary = f"*✨ Producto creado!*\n\n"
-                    operation_summary += f"• {name}\n"
-                    operation_summary += f"• Código: _{sku}_\n"
-                    operation_summary += price_line
-
-            elif operation_type == "UPDATE_PRODUCT_PRICE":
-                # Set or change the sale price of an existing product.
-                # Resolver has already turned product_ref -> product_id and
-                # unit_price -> unit_price_cents.
-                product_id = entities.get("product_id")
-                unit_price_cents = entities.get("unit_price_cents")
-
-                if product_id is None or unit_price_cents is None:
-                    raise ValueError(
-                        "Faltan datos para actualizar el precio del producto"
-                    )
-
-                row = update_product_price(product_id, int(unit_price_cents))
-                result = row
-
-                product_name = (
-                    row.get("name") if row else entities.get("resolved_name", "el producto")
-                )
-                price_usd = unit_price_cents / 100.0
-                operation_summary = (
-                    f"Listo. *{product_name}* ahora se vende a *${price_usd:.2f}*."
-                )
-
-            elif operation_type == "REGISTER_PRODUCT_WITH_STOCK":
-                # Atomic op: create product (price pending) + register initial stock entry.
-                # Triggered by user confirming a PROPOSE_PRODUCT_CREATION turn.
-                from agents.resolver import generate_sku_from_name
-
-                name = entities.get("name")
-                initial_stock = entities.get("initial_stock")
-
-                if not name or initial_stock is None:
-                    raise ValueError(
-                        "Faltan datos para crear producto y registrar stock"
-                    )
-
-                sku = entities.get("sku") or generate_sku_from_name(name)
-
-                result = register_product_with_stock({
-                    "sku": sku,
-                    "name": name,
-                    "description": entities.get("description"),
-                    "unit_price_cents": None,  # precio pendiente
-                    "unit_cost_cents": entities.get("unit_cost_cents", 0),
-                    "initial_stock": initial_stock,
-                    "stock_reason": entities.get("stock_reason", "Entrada inicial"),
-                })
-
-                current_stock = result.get("current_stock", initial_stock)
-                operation_summary = (
-                    f"Listo. Cree *{name}* y registre {initial_stock} unidades de entrada "
-                    f"(stock actual: {current_stock}).\n\n"
-                    f"Querés cargar el precio de venta ahora o lo dejamos para la primera venta?"
-                )
-
-            elif operation_type == "ADD_STOCK":
-                # ADD_STOCK can handle either single product or multiple items
-                reason = entities.get("reason", "Entrada de stock")
-                movement_type = entities.get("movement_type", "IN")
-
-                items = entities.get("items", [])
-
-                # If no items array, treat as single product
-                if not items:
-                    product_id = entities.get("product_id")
-                    quantity = entities.get("quantity")
-
-                    if product_id is None or quantity is None:
-                        raise ValueError("Se requieren product_id y quantity para actualizar el stock")
-
-                    items = [{
-                        "product_id": product_id,
-                        "quantity": quantity,
-                        "resolved_name": entities.get("resolved_name", "producto")
-                    }]
-
-                # CRITICAL SAFETY CHECK: Verify NO items have resolution errors
-                for item in items:
-                    if "resolution_error" in item:
-                        raise ValueError(item["resolution_error"])
-
-                # Process each stock movement
-                results = []
-                for item in items:
-                    stock_data = {
-                        "product_id": item["product_id"],
-                        "quantity": item["quantity"],
-                        "reason": reason,
-                        "movement_type": movement_type
-                    }
-                    result = add_stock(stock_data)
-                    result["resolved_name"] = item.get("resolved_name", "producto")
-                    result["quantity"] = item.get("quantity", 0)  # Preserve quantity for display
-                    results.append(result)
-
-                # Build summary
-                operation_summary = f"*📦 Stock actualizado!*\n\n"
-                for res in results:
-                    product_name = res["resolved_name"]
-                    quantity = res.get("quantity", 0)
-                    current = res.get("current_stock", 0)
-                    operation_summary += f"• *{product_name}*: +{quantity} unidades (stock actual: {current})\n"
-
-            elif operation_type == "CANCEL_SALE":
-                # Get the sale to cancel
-                target = entities.get("target", "last")
-
-                if target == "last":
-                    # Get last sale
-                    last_sale = get_last_sale()
-                    if not last_sale:
-                        raise ValueError("No hay ventas para cancelar")
-                    sale_id = last_sale["id"]
-                else:
-                    # Specific sale_id
-                    sale_id = int(target)
-
-                # Cancel the sale
-                result = cancel_sale(sale_id)
-
-                operation_summary = f"*❌ Venta cancelada!*\n\n"
-                operation_summary += f"• Se canceló la venta por *${result['cancelled_amount']:.2f}*\n"
-                if result.get('revenue_usd') is not None:
-                    operation_summary += f"\n_Ventas totales: ${result['revenue_usd']:.2f}_"
-                if result.get('profit_usd') is not None:
-                    profit = result['profit_usd']
-                    if profit >= 0:
-                        operation_summary += f"\n_Ganancia acumulada: ${profit:.2f}_"
-                    else:
-                        operation_summary += f"\n_Pérdida acumulada: ${abs(profit):.2f}_"
-
-            elif operation_type == "CANCEL_EXPENSE":
-                # Get the expense to cancel
-                target = entities.get("target", "last")
-
-                if target == "last":
-                    # Get last expense
-                    last_expense = get_last_expense()
-                    if not last_expense:
-                        raise ValueError("No hay gastos para cancelar")
-                    expense_id = last_expense["id"]
-                else:
-                    # Specific expense_id
-                    expense_id = int(target)
-
-                # Cancel the expense
-                result = cancel_expense(expense_id)
-
-                operation_summary = f"*❌ Gasto cancelado!*\n\n"
-                operation_summary += f"• Se canceló: {result['description']}\n"
-                operation_summary += f"• Monto: *${result['cancelled_amount']:.2f}*"
-                if result.get('profit_usd') is not None:
-                    profit = result['profit_usd']
-                    operation_summary += "\n"
-                    if profit >= 0:
-                        operation_summary += f"\n_Ganancia acumulada: ${profit:.2f}_"
-                    else:
-                        operation_summary += f"\n_Pérdida acumulada: ${abs(profit):.2f}_"
-
-            elif operation_type == "CANCEL_STOCK":
-                # Get the stock movement to cancel
-                target = entities.get("target", "last")
-
-                if target == "last":
-                    # Get last stock movement
-                    last_movement = get_last_stock_movement()
-                    if not last_movement:
-                        raise ValueError("No hay movimientos de stock para cancelar")
-                    movement_id = last_movement["id"]
-                else:
-                    # Specific movement_id
-                    movement_id = int(target)
-
-                # Cancel the stock movement
-                result = cancel_stock_movement(movement_id)
-
-                operation_summary = f"*❌ Stock cancelado!*\n\n"
-                operation_summary += f"• Se canceló entrada de stock de *{result['product_name']}*\n"
-                operation_summary += f"• Cantidad cancelada: {result['cancelled_quantity']} unidades\n"
-                operation_summary += f"• Stock actual: {result['current_stock']} unidades"
-
-            elif operation_type == "CANCEL_LAST_OPERATION":
-                # Detect which was the last operation and cancel it
-                last_op = get_last_operation()
-
-                if not last_op:
-                    raise ValueError("No hay operaciones recientes para cancelar")
-
-                op_type = last_op["type"]
-                op_data = last_op["data"]
-                # Remember which surface the cancellation hit so the
-                # navigation cue points at the right tab.
-                cancelled_op_type = op_type
-
-                if op_type == "SALE":
-                    result = cancel_sale(op_data["id"])
-                    operation_summary = f"*❌ Venta cancelada!*\n\n"
-                    operation_summary += f"• Se canceló la venta por *${result['cancelled_amount']:.2f}*\n"
-                    if result.get('revenue_usd') is not None:
-                        operation_summary += f"\n_Ventas totales: ${result['revenue_usd']:.2f}_"
-                    if result.get('profit_usd') is not None:
-                        profit = result['profit_usd']
-                        if profit >= 0:
-                            operation_summary += f"\n_Ganancia acumulada: ${profit:.2f}_"
-                        else:
-                            operation_summary += f"\n_Pérdida acumulada: ${abs(profit):.2f}_"
-
-                elif op_type == "EXPENSE":
-                    result = cancel_expense(op_data["id"])
-                    operation_summary = f"*❌ Gasto cancelado!*\n\n"
-                    operation_summary += f"• Se canceló: {result['description']}\n"
-                    operation_summary += f"• Monto: *${result['cancelled_amount']:.2f}*"
-                    if result.get('profit_usd') is not None:
-                        profit = result['profit_usd']
-                        operation_summary += "\n"
-                        if profit >= 0:
-                            operation_summary += f"\n_Ganancia acumulada: ${profit:.2f}_"
-                        else:
-                            operation_summary += f"\n_Pérdida acumulada: ${abs(profit):.2f}_"
-
-                elif op_type == "STOCK":
-                    result = cancel_stock_movement(op_data["id"])
-                    operation_summary = f"*❌ Stock cancelado!*\n\n"
-                    operation_summary += f"• Se canceló entrada de stock de *{result['product_name']}*\n"
-                    operation_summary += f"• Cantidad cancelada: {result['cancelled_quantity']} unidades\n"
-                    operation_summary += f"• Stock actual: {result['current_stock']} unidades"
-
-            elif operation_type == "DEACTIVATE_PRODUCT":
-                # Deactivate a product (mark as inactive, don't delete)
-                product_id = entities.get("product_id")
-                product_name = entities.get("resolved_name", "producto")
-
-                if product_id is None:
-                    raise ValueError("No se pudo identificar el producto a desactivar")
-
-                result = deactivate_product(product_id)
-
-                operation_summary = f"*🗑️ Producto desactivado!*\n\n"
-                operation_summary += f"• *{product_name}* ha sido removido del catálogo\n"
-                operation_summary += f"• El producto ya no aparecerá en el inventario\n"
-                operation_summary += f"• El historial de ventas se mantiene intacto"
-
-            else:
+            handler = _OPERATION_HANDLERS.get(operation_type)
+            if handler is None:
                 raise ValueError(f"Tipo de operación desconocido: {operation_type}")
 
+            result, operation_summary = handler(entities)
+
             # Emit navigation only on actual tool-call success.
-            # `result` is set by every operation branch; if we got here
-            # without an exception it means the underlying database call
-            # committed (register_sale, add_stock, etc.).
+            # Every handler returns `result` only after the underlying
+            # database call committed (register_sale, add_stock, etc.).
+            # For CANCEL_LAST_OPERATION the result's type (SALE|EXPENSE|STOCK)
+            # says which surface the cancellation hit.
+            cancelled_op_type = (
+                result.get("type") if operation_type == "CANCEL_LAST_OPERATION" else None
+            )
             navigation = _navigation_for(operation_type, last_op_type=cancelled_op_type)
             existing_metadata = dict(state.get("metadata") or {})
             if navigation is not None:
@@ -652,6 +688,17 @@ def create_write_agent():
                 response_delta["metadata"] = existing_metadata
             return response_delta
 
+        except _OperationBlocked as blocked:
+            return {
+                "operation_result": None,
+                "error": blocked.message,
+                "final_answer": blocked.message,
+                "messages": [{
+                    "role": "assistant",
+                    "content": f"[Write Agent] {blocked.log}"
+                }]
+            }
+
         except Exception as e:
             error_msg = f"Operación fallida: {str(e)}"
             return {
@@ -10,9 +10,13 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from starlette.middleware.sessions import SessionMiddleware
+import atexit
+import logging
+import queue
 import sys
 import os
 import time
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
 # Add parent directory to path
@@ -29,6 +33,28 @@ from backend.auth.dependencies import (
 )
 from backend import cache
 
+
+def _route_logging_through_queue() -> None:
+    """
+    Hand log records to a background thread.
+
+    The handlers configured so far (backend.cache calls basicConfig) move
+    behind a QueueListener, so request threads, including error paths that
+    log full tracebacks, never block on the stderr write.
+    """
+    root = logging.getLogger()
+    handlers = [h for h in root.handlers if not isinstance(h, QueueHandler)]
+    if not handlers or len(handlers) != len(root.handlers):
+        return
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    atexit.register(listener.stop)
+
+
+_route_logging_through_queue()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Beans&Co Multi-Tenant API",
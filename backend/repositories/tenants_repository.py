@@ -84,8 +84,11 @@ class TenantsRepository:
         with open(registry_path, "w", encoding="utf-8") as f:
             json.dump(registry, f, indent=2, ensure_ascii=False)
 
-    @staticmethod
-    def delete_tenant_directory(path: Path):
+    def delete_tenant_directory(self, path: Path):
+        # SQLite connections are cached per file; release them before the
+        # tenant's database disappears from under them.
+        if hasattr(self.db, "close_connections"):
+            self.db.close_connections()
         if path.exists():
             shutil.rmtree(path)
 
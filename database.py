@@ -1,6 +1,9 @@
 import sqlite3
 from contextlib import contextmanager
+import itertools
+import threading
 import time
+import weakref
 import json
 import ast
 from contextvars import ContextVar
@@ -8,6 +11,34 @@ from contextvars import ContextVar
 DB_PATH = "beansco.db"
 _db_path_ctx: ContextVar[str | None] = ContextVar("sqlite_db_path_ctx", default=None)
 
+# One long-lived connection per (thread, database file), opened lazily and
+# reused by every get_conn() call on that thread. Reopening per query paid for
+# the file open, WAL/SHM setup and a cold page cache each time; one connection
+# per thread keeps WAL's concurrent readers (SQLite still serializes writers).
+_thread_connections = threading.local()
+# Every live thread's connections, for close_connections(). Held weakly: when
+# a thread exits its thread-local slot is released and its connections close.
+_connection_sets: "weakref.WeakSet[_ThreadConnections]" = weakref.WeakSet()
+_connections_lock = threading.Lock()
+
+# Connection used only to read PRAGMA data_version, which is per connection:
+# one probe per file keeps get_data_version() stable across threads.
+_version_probes: dict[str, tuple[sqlite3.Connection, threading.Lock]] = {}
+
+# Bumped after every get_conn() block that committed changes. Combined with
+# the file stats in get_data_version() it lets callers cache derived results.
+_write_counter = itertools.count(1)
+_data_version = 0
+
+# Applied once per connection when it is opened.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
 
 def _adapt_query_for_sqlite(query: str) -> str:
     """
@@ -33,18 +64,109 @@ def get_current_db_path() -> str:
     return _db_path_ctx.get() or DB_PATH
 
 
+def _connect(db_path: str) -> sqlite3.Connection:
+    """Open a connection to db_path and apply the tuning pragmas."""
+    # check_same_thread=False only so close_connections() can close it from
+    # another thread; in use, each connection stays on the thread that opened it.
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _close_all(connections: dict[str, sqlite3.Connection]):
+    """Close and forget every connection in a path -> connection map."""
+    for conn in list(connections.values()):
+        conn.close()
+    connections.clear()
+
+
+class _ThreadConnections:
+    """One thread's path -> connection map, closed once the thread is gone."""
+
+    def __init__(self):
+        self.by_path: dict[str, sqlite3.Connection] = {}
+        # Refers to the map, not to self, so it cannot keep itself alive
+        weakref.finalize(self, _close_all, self.by_path)
+
+
+def _get_thread_connection(db_path: str) -> sqlite3.Connection:
+    """Return this thread's connection to db_path, opening it once."""
+    holder = getattr(_thread_connections, "holder", None)
+    if holder is None:
+        holder = _ThreadConnections()
+        _thread_connections.holder = holder
+        with _connections_lock:
+            _connection_sets.add(holder)
+    conn = holder.by_path.get(db_path)
+    if conn is None:
+        conn = _connect(db_path)
+        holder.by_path[db_path] = conn
+    return conn
+
+
+def _get_version_probe(db_path: str) -> tuple[sqlite3.Connection, threading.Lock]:
+    """Return the (connection, lock) used to read data_version for db_path."""
+    entry = _version_probes.get(db_path)
+    if entry is None:
+        with _connections_lock:
+            entry = _version_probes.get(db_path)
+            if entry is None:
+                # Same pragmas, so a later switch to WAL by a thread
+                # connection does not register as a data change
+                conn = _connect(db_path)
+                entry = (conn, threading.Lock())
+                _version_probes[db_path] = entry
+    return entry
+
+
+def close_connections():
+    """
+    Close every cached connection, on every thread.
+
+    Call before removing a tenant's database file. Later get_conn() calls
+    simply reopen.
+    """
+    with _connections_lock:
+        holders = list(_connection_sets)
+        probes = list(_version_probes.values())
+        _version_probes.clear()
+    for holder in holders:
+        _close_all(holder.by_path)
+    for conn, lock in probes:
+        with lock:
+            conn.close()
+
+
 @contextmanager
 def get_conn():
-    conn = sqlite3.connect(get_current_db_path())
-    conn.row_factory = sqlite3.Row
+    global _data_version
+    conn = _get_thread_connection(get_current_db_path())
+    changes_before = conn.total_changes
     try:
         yield conn
         conn.commit()
     except Exception:
         conn.rollback()
         raise
-    finally:
-        conn.close()
+    if conn.total_changes != changes_before:
+        _data_version = next(_write_counter)
+
+
+def get_data_version() -> tuple:
+    """
+    Return an opaque stamp that changes whenever the current database does.
+
+    Covers commits made through get_conn() in this process and, via
+    PRAGMA data_version, commits made by other processes. File mtimes are
+    not used: in WAL mode the main file is only touched at checkpoints.
+    """
+    db_path = get_current_db_path()
+    conn, lock = _get_version_probe(db_path)
+    with lock:
+        external = conn.execute("PRAGMA data_version").fetchone()[0]
+    return (db_path, _data_version, external)
 
 
 # =========================
@@ -233,6 +355,57 @@ def add_stock(data: dict):
     }
 
 
+def add_stock_bulk(items: list[dict], reason: str = "Stock update", movement_type: str = "IN") -> list[dict]:
+    """
+    Add stock for several products in one transaction.
+
+    items = [{ product_id, quantity }, ...]
+    movement_type: IN | ADJUSTMENT (default IN), shared by every item
+
+    Returns one add_stock()-shaped result per item, in input order.
+    """
+    if not items:
+        return []
+
+    product_ids = [item["product_id"] for item in items]
+    with get_conn() as conn:
+        conn.executemany(
+            """
+            INSERT INTO stock_movements (
+                product_id,
+                movement_type,
+                quantity,
+                reason,
+                created_at
+            )
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            [
+                (item["product_id"], movement_type, item["quantity"], reason)
+                for item in items
+            ],
+        )
+
+        placeholders = ", ".join("?" * len(set(product_ids)))
+        stock_by_product = {
+            row["product_id"]: row["stock_qty"]
+            for row in conn.execute(
+                f"SELECT product_id, stock_qty FROM stock_current WHERE product_id IN ({placeholders})",
+                tuple(set(product_ids)),
+            )
+        }
+
+    return [
+        {
+            "status": "ok",
+            "message": "Stock updated",
+            "product_id": product_id,
+            "current_stock": stock_by_product.get(product_id),
+        }
+        for product_id in product_ids
+    ]
+
+
 def update_product_price(product_id: int, unit_price_cents: int):
     """
     Update unit_price_cents for an existing product (typically after the
@@ -532,26 +705,28 @@ def register_sale(data):
             (sale_number, total_cents, status),
         ).lastrowid
 
-        # 5. Insert items + stock movements
-        for item in enriched_items:
-            conn.execute(
+        # 5. Insert items + stock movements, one batched statement each
+        conn.executemany(
+            """
+            INSERT INTO sale_items (sale_id, product_id, quantity, unit_price_cents, line_total_cents)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (sale_id, item["product_id"], item["quantity"], item["unit_price_cents"], item["line_total_cents"])
+                for item in enriched_items
+            ],
+        )
+
+        if status == "PAID":
+            conn.executemany(
                 """
-                INSERT INTO sale_items (sale_id, product_id, quantity, unit_price_cents, line_total_cents)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO stock_movements
+                (product_id, movement_type, quantity, reason, created_at)
+                VALUES (?, 'OUT', ?, 'Sale', CURRENT_TIMESTAMP)
                 """,
-                (sale_id, item["product_id"], item["quantity"], item["unit_price_cents"], item["line_total_cents"]),
+                [(item["product_id"], item["quantity"]) for item in enriched_items],
             )
 
-            if status == "PAID":
-                conn.execute(
-                    """
-                    INSERT INTO stock_movements
-                    (product_id, movement_type, quantity, reason, created_at)
-                    VALUES (?, 'OUT', ?, 'Sale', CURRENT_TIMESTAMP)
-                    """,
-                    (item["product_id"], item["quantity"]),
-                )
-
         revenue = conn.execute(
             "SELECT total_revenue_cents FROM revenue_paid"
         ).fetchone()
@@ -656,6 +831,148 @@ def get_last_operation():
     return operations[0]
 
 
+def cancel_last_operation():
+    """
+    Cancel the most recent operation (sale, expense, or stock movement).
+
+    Returns:
+        Dict with 'type' (SALE/EXPENSE/STOCK) merged with the result of the
+        matching cancel_* function, or None if there is nothing to cancel
+    """
+    last_op = get_last_operation()
+    if not last_op:
+        return None
+
+    cancel = {
+        "SALE": cancel_sale,
+        "EXPENSE": cancel_expense,
+        "STOCK": cancel_stock_movement,
+    }[last_op["type"]]
+    return {"type": last_op["type"], **cancel(last_op["data"]["id"])}
+
+
+def _cancel_sale_in(conn, sale_id: int) -> dict:
+    """Cancel a sale and restore its stock inside an open transaction."""
+    # Get sale details
+    sale = conn.execute(
+        "SELECT id, sale_number, total_amount_cents, status FROM sales WHERE id = ?",
+        (sale_id,)
+    ).fetchone()
+
+    if not sale:
+        raise ValueError(f"Venta con ID {sale_id} no encontrada")
+
+    # Get sale items
+    items = conn.execute(
+        """
+        SELECT product_id, quantity, unit_price_cents
+        FROM sale_items
+        WHERE sale_id = ?
+        """,
+        (sale_id,)
+    ).fetchall()
+
+    # If sale was PAID, restore stock
+    if sale["status"] == "PAID":
+        for item in items:
+            # Add stock back (reverse the OUT movement)
+            conn.execute(
+                """
+                INSERT INTO stock_movements
+                (product_id, movement_type, quantity, reason, created_at)
+                VALUES (?, 'IN', ?, 'Venta cancelada', CURRENT_TIMESTAMP)
+                """,
+                (item["product_id"], item["quantity"]),
+            )
+
+    # Delete sale items
+    conn.execute("DELETE FROM sale_items WHERE sale_id = ?", (sale_id,))
+
+    # Delete sale
+    conn.execute("DELETE FROM sales WHERE id = ?", (sale_id,))
+
+    return {
+        "sale_number": sale["sale_number"],
+        "cancelled_amount": sale["total_amount_cents"] / 100.0,
+    }
+
+
+def _cancel_expense_in(conn, expense_id: int) -> dict:
+    """Delete an expense inside an open transaction."""
+    # Get expense details
+    expense = conn.execute(
+        "SELECT id, description, amount_cents FROM expenses WHERE id = ?",
+        (expense_id,)
+    ).fetchone()
+
+    if not expense:
+        raise ValueError(f"Gasto con ID {expense_id} no encontrado")
+
+    # Delete expense
+    conn.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+
+    return {
+        "description": expense["description"],
+        "cancelled_amount": expense["amount_cents"] / 100.0,
+    }
+
+
+def _cancel_stock_movement_in(conn, movement_id: int) -> dict:
+    """Reverse a stock movement inside an open transaction."""
+    # Get movement details
+    movement = conn.execute(
+        """
+        SELECT sm.id, sm.product_id, sm.quantity, sm.reason, sm.movement_type,
+               p.name as product_name, p.sku
+        FROM stock_movements sm
+        JOIN products p ON sm.product_id = p.id
+        WHERE sm.id = ?
+        """,
+        (movement_id,)
+    ).fetchone()
+
+    if not movement:
+        raise ValueError(f"Movimiento de stock con ID {movement_id} no encontrado")
+
+    # Can only cancel IN or ADJUSTMENT movements (not sales)
+    if movement["movement_type"] not in ["IN", "ADJUSTMENT"]:
+        raise ValueError(f"Solo se pueden cancelar movimientos de tipo IN o ADJUSTMENT")
+
+    # Create inverse movement (OUT with negative quantity to cancel)
+    conn.execute(
+        """
+        INSERT INTO stock_movements
+        (product_id, movement_type, quantity, reason, created_at)
+        VALUES (?, 'ADJUSTMENT', ?, ?, CURRENT_TIMESTAMP)
+        """,
+        (
+            movement["product_id"],
+            -movement["quantity"],  # Negative to reverse
+            f"Cancelación de: {movement['reason']}"
+        )
+    )
+
+    # Get updated stock
+    stock = conn.execute(
+        "SELECT stock_qty FROM stock_current WHERE product_id = ?",
+        (movement["product_id"],)
+    ).fetchone()
+
+    return {
+        "product_name": movement["product_name"],
+        "sku": movement["sku"],
+        "cancelled_quantity": movement["quantity"],
+        "current_stock": stock["stock_qty"] if stock else 0,
+    }
+
+
+_CANCEL_HANDLERS = {
+    "SALE": _cancel_sale_in,
+    "EXPENSE": _cancel_expense_in,
+    "STOCK": _cancel_stock_movement_in,
+}
+
+
 def cancel_sale(sale_id: int):
     """
     Cancel a sale and restore stock.
@@ -667,43 +984,7 @@ def cancel_sale(sale_id: int):
         Dict with cancellation result
     """
     with get_conn() as conn:
-        # Get sale details
-        sale = conn.execute(
-            "SELECT id, sale_number, total_amount_cents, status FROM sales WHERE id = ?",
-            (sale_id,)
-        ).fetchone()
-
-        if not sale:
-            raise ValueError(f"Venta con ID {sale_id} no encontrada")
-
-        # Get sale items
-        items = conn.execute(
-            """
-            SELECT product_id, quantity, unit_price_cents
-            FROM sale_items
-            WHERE sale_id = ?
-            """,
-            (sale_id,)
-        ).fetchall()
-
-        # If sale was PAID, restore stock
-        if sale["status"] == "PAID":
-            for item in items:
-                # Add stock back (reverse the OUT movement)
-                conn.execute(
-                    """
-                    INSERT INTO stock_movements
-                    (product_id, movement_type, quantity, reason, created_at)
-                    VALUES (?, 'IN', ?, 'Venta cancelada', CURRENT_TIMESTAMP)
-                    """,
-                    (item["product_id"], item["quantity"]),
-                )
-
-        # Delete sale items
-        conn.execute("DELETE FROM sale_items WHERE sale_id = ?", (sale_id,))
-
-        # Delete sale
-        conn.execute("DELETE FROM sales WHERE id = ?", (sale_id,))
+        cancelled = _cancel_sale_in(conn, sale_id)
 
         # Get updated stats
         revenue = conn.execute("SELECT total_revenue_cents FROM revenue_paid").fetchone()
@@ -711,8 +992,7 @@ def cancel_sale(sale_id: int):
 
     return {
         "status": "ok",
-        "sale_number": sale["sale_number"],
-        "cancelled_amount": sale["total_amount_cents"] / 100.0,
+        **cancelled,
         "revenue_usd": revenue["total_revenue_cents"] / 100.0 if revenue and revenue["total_revenue_cents"] is not None else 0.0,
         "profit_usd": profit["profit_usd"] if profit and profit["profit_usd"] is not None else 0.0,
     }
@@ -729,25 +1009,14 @@ def cancel_expense(expense_id: int):
         Dict with cancellation result
     """
     with get_conn() as conn:
-        # Get expense details
-        expense = conn.execute(
-            "SELECT id, description, amount_cents FROM expenses WHERE id = ?",
-            (expense_id,)
-        ).fetchone()
-
-        if not expense:
-            raise ValueError(f"Gasto con ID {expense_id} no encontrado")
-
-        # Delete expense
-        conn.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+        cancelled = _cancel_expense_in(conn, expense_id)
 
         # Get updated profit
         profit = conn.execute("SELECT profit_usd FROM profit_summary").fetchone()
 
     return {
         "status": "ok",
-        "description": expense["description"],
-        "cancelled_amount": expense["amount_cents"] / 100.0,
+        **cancelled,
         "profit_usd": profit["profit_usd"] if profit else 0,
     }
 
@@ -763,51 +1032,43 @@ def cancel_stock_movement(movement_id: int):
         Dict with cancellation result
     """
     with get_conn() as conn:
-        # Get movement details
-        movement = conn.execute(
-            """
-            SELECT sm.id, sm.product_id, sm.quantity, sm.reason, sm.movement_type,
-                   p.name as product_name, p.sku
-            FROM stock_movements sm
-            JOIN products p ON sm.product_id = p.id
-            WHERE sm.id = ?
-            """,
-            (movement_id,)
-        ).fetchone()
+        cancelled = _cancel_stock_movement_in(conn, movement_id)
 
-        if not movement:
-            raise ValueError(f"Movimiento de stock con ID {movement_id} no encontrado")
+    return {"status": "ok", **cancelled}
 
-        # Can only cancel IN or ADJUSTMENT movements (not sales)
-        if movement["movement_type"] not in ["IN", "ADJUSTMENT"]:
-            raise ValueError(f"Solo se pueden cancelar movimientos de tipo IN o ADJUSTMENT")
 
-        # Create inverse movement (OUT with negative quantity to cancel)
-        conn.execute(
-            """
-            INSERT INTO stock_movements
-            (product_id, movement_type, quantity, reason, created_at)
-            VALUES (?, 'ADJUSTMENT', ?, ?, CURRENT_TIMESTAMP)
-            """,
-            (
-                movement["product_id"],
-                -movement["quantity"],  # Negative to reverse
-                f"Cancelación de: {movement['reason']}"
-            )
-        )
+def cancel_operations(operations: list[dict]) -> dict:
+    """
+    Cancel several operations in one transaction.
 
-        # Get updated stock
-        stock = conn.execute(
-            "SELECT stock_qty FROM stock_current WHERE product_id = ?",
-            (movement["product_id"],)
-        ).fetchone()
+    operations = [{ type: SALE | EXPENSE | STOCK, id }, ...]
+
+    All-or-nothing: if any operation cannot be cancelled (unknown type or
+    id, non-cancellable movement) the whole batch rolls back.
+
+    Returns:
+        Dict with 'cancelled' (one result per operation, in order, tagged
+        with its 'type') plus the updated revenue_usd and profit_usd
+    """
+    if not operations:
+        raise ValueError("No se especificaron operaciones para cancelar")
+
+    with get_conn() as conn:
+        cancelled = []
+        for op in operations:
+            cancel = _CANCEL_HANDLERS.get(op["type"])
+            if cancel is None:
+                raise ValueError(f"No se puede cancelar una operación de tipo {op['type']}")
+            cancelled.append({"type": op["type"], **cancel(conn, op["id"])})
+
+        revenue = conn.execute("SELECT total_revenue_cents FROM revenue_paid").fetchone()
+        profit = conn.execute("SELECT profit_usd FROM profit_summary").fetchone()
 
     return {
         "status": "ok",
-        "product_name": movement["product_name"],
-        "sku": movement["sku"],
-        "cancelled_quantity": movement["quantity"],
-        "current_stock": stock["stock_qty"] if stock else 0,
+        "cancelled": cancelled,
+        "revenue_usd": revenue["total_revenue_cents"] / 100.0 if revenue and revenue["total_revenue_cents"] is not None else 0.0,
+        "profit_usd": profit["profit_usd"] if profit and profit["profit_usd"] is not None else 0.0,
     }
 
 
@@ -109,11 +109,13 @@ def tenant_context(phone_number: str, must_exist: bool = True):
 fetch_one = db.fetch_one
 fetch_all = db.fetch_all
 execute = db.execute
+get_data_version = db.get_data_version
 register_product = db.register_product
 register_product_with_stock = db.register_product_with_stock
 register_products_batch = db.register_products_batch
 update_product_price = db.update_product_price
 add_stock = db.add_stock
+add_stock_bulk = db.add_stock_bulk
 remove_stock = db.remove_stock
 register_expense = db.register_expense
 register_sale = db.register_sale
@@ -121,7 +123,9 @@ get_last_sale = db.get_last_sale
 get_last_expense = db.get_last_expense
 get_last_stock_movement = db.get_last_stock_movement
 get_last_operation = db.get_last_operation
+cancel_last_operation = db.cancel_last_operation
 cancel_sale = db.cancel_sale
 cancel_expense = db.cancel_expense
 cancel_stock_movement = db.cancel_stock_movement
+cancel_operations = db.cancel_operations
 deactivate_product = db.deactivate_product
@@ -3,11 +3,14 @@ PostgreSQL Database Layer
 Same interface as database.py but uses PostgreSQL instead of SQLite.
 """
 import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2 import extensions, pool
+from psycopg2.extras import Json, RealDictCursor, execute_values
 from psycopg2 import sql
+from psycopg2 import errors
 from contextlib import contextmanager
+import itertools
 import os
+import threading
 import time
 import json
 import ast
@@ -25,6 +28,38 @@ _schema_ctx: ContextVar[str | None] = ContextVar("pg_schema_ctx", default=None)
 
 # Connection pool - initialized once, reused across all requests
 _connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+# Bumped after every get_conn() block that committed changes, as in
+# database.py. Writes made by other processes have no cheap signal, so
+# get_data_version() also rolls over every DATA_VERSION_TTL_SECONDS.
+_write_counter = itertools.count(1)
+_data_version = 0
+DATA_VERSION_TTL_SECONDS = 5
+
+# Command tags of statements that never change data
+_READ_ONLY_STATUSES = ("SELECT", "SET", "SHOW")
+
+
+class _TrackingConnection(extensions.connection):
+    """Connection that records whether the current get_conn() block wrote."""
+
+    wrote = False
+
+
+class _TrackingCursor(RealDictCursor):
+    """RealDictCursor that flags its connection on any data-changing statement."""
+
+    def execute(self, query, vars=None):
+        result = super().execute(query, vars)
+        if not (self.statusmessage or "").startswith(_READ_ONLY_STATUSES):
+            self.connection.wrote = True
+        return result
+
+    def executemany(self, query, vars_list):
+        result = super().executemany(query, vars_list)
+        self.connection.wrote = True
+        return result
 
 
 def set_tenant_schema(schema_name: str):
@@ -46,20 +81,29 @@ def get_connection_pool():
     """Get or create the connection pool."""
     global _connection_pool
     if _connection_pool is None:
-        _connection_pool = pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,  # Adjust based on your needs
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            cursor_factory=RealDictCursor,
-            # Explicit encoding configuration to avoid UTF-8 issues
-            client_encoding='UTF8',
-            options='-c client_encoding=UTF8'
-        )
-        print(f"[DB] Connection pool created (1-10 connections)")
+        with _connection_pool_lock:
+            if _connection_pool is None:
+                # Threaded pool: requests run graph/DB work from worker
+                # threads, and SimpleConnectionPool is not thread-safe
+                _connection_pool = pool.ThreadedConnectionPool(
+                    minconn=1,
+                    maxconn=10,  # Adjust based on your needs
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    connection_factory=_TrackingConnection,
+                    cursor_factory=_TrackingCursor,
+                    # Explicit encoding configuration to avoid UTF-8 issues
+                    client_encoding='UTF8',
+                    options='-c client_encoding=UTF8',
+                    # TCP keepalives so idle pooled connections aren't
+                    # silently dropped and reconnected
+                    keepalives=1,
+                    keepalives_idle=30
+                )
+                print(f"[DB] Connection pool created (1-10 connections)")
     return _connection_pool
 
 
@@ -71,6 +115,7 @@ def get_connection_string():
 @contextmanager
 def get_conn():
     """Context manager for PostgreSQL connections using pool."""
+    global _data_version
     conn_pool = get_connection_pool()
     conn = conn_pool.getconn()
     try:
@@ -82,8 +127,11 @@ def get_conn():
                     sql.Identifier(schema_name)
                 )
             )
+        conn.wrote = False
         yield conn
         conn.commit()
+        if conn.wrote:
+            _data_version = next(_write_counter)
     except Exception:
         conn.rollback()
         raise
@@ -118,6 +166,19 @@ def fetch_all(query, params=None):
             return cur.fetchall()
 
 
+def get_data_version() -> tuple:
+    """
+    Return an opaque stamp that changes whenever the current schema does.
+
+    Covers commits made through get_conn() in this process. PostgreSQL has
+    no cheap per-schema change counter for other processes' writes, so the
+    stamp also changes every DATA_VERSION_TTL_SECONDS: results cached against
+    it are at most that stale with respect to other workers.
+    """
+    ttl_bucket = int(time.monotonic() // DATA_VERSION_TTL_SECONDS)
+    return (get_current_schema(), _data_version, ttl_bucket)
+
+
 def execute(query, params=None):
     """Execute INSERT/UPDATE/DELETE statement and return affected rowcount."""
     with get_conn() as conn:
@@ -455,6 +516,59 @@ def add_stock(data: dict):
     }
 
 
+def add_stock_bulk(items: list[dict], reason: str = "Stock update", movement_type: str = "IN") -> list[dict]:
+    """
+    Add stock for several products in one transaction and two round trips.
+
+    items = [{ product_id, quantity }, ...]
+    movement_type: IN | ADJUSTMENT (default IN), shared by every item
+
+    Returns one add_stock()-shaped result per item, in input order.
+    """
+    if not items:
+        return []
+
+    product_ids = [item["product_id"] for item in items]
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                INSERT INTO stock_movements (
+                    product_id,
+                    movement_type,
+                    quantity,
+                    reason,
+                    created_at
+                )
+                VALUES %s
+                """,
+                [
+                    (item["product_id"], movement_type, item["quantity"], reason)
+                    for item in items
+                ],
+                template="(%s, %s, %s, %s, CURRENT_TIMESTAMP)",
+            )
+
+            cur.execute(
+                "SELECT product_id, stock_qty FROM stock_current WHERE product_id = ANY(%s)",
+                (list(set(product_ids)),),
+            )
+            stock_by_product = {
+                row["product_id"]: row["stock_qty"] for row in cur.fetchall()
+            }
+
+    return [
+        {
+            "status": "ok",
+            "message": "Stock updated",
+            "product_id": product_id,
+            "current_stock": stock_by_product.get(product_id),
+        }
+        for product_id in product_ids
+    ]
+
+
 def update_product_price(product_id: int, unit_price_cents: int):
     """
     Update unit_price_cents for an existing product. Mirror of the sqlite
@@ -751,26 +865,31 @@ def register_sale(data):
             )
             sale_id = cur.fetchone()["id"]
 
-            # 5. Insert items + stock movements
-            for item in enriched_items:
-                cur.execute(
+            # 5. Insert items + stock movements, one multi-row INSERT each
+            execute_values(
+                cur,
+                """
+                INSERT INTO sale_items (sale_id, product_id, quantity, unit_price_cents, line_total_cents)
+                VALUES %s
+                """,
+                [
+                    (sale_id, item["product_id"], item["quantity"], item["unit_price_cents"], item["line_total_cents"])
+                    for item in enriched_items
+                ],
+            )
+
+            if status == "PAID":
+                execute_values(
+                    cur,
                     """
-                    INSERT INTO sale_items (sale_id, product_id, quantity, unit_price_cents, line_total_cents)
-                    VALUES (%s, %s, %s, %s, %s)
+                    INSERT INTO stock_movements
+                    (product_id, movement_type, quantity, reason, created_at)
+                    VALUES %s
                     """,
-                    (sale_id, item["product_id"], item["quantity"], item["unit_price_cents"], item["line_total_cents"]),
+                    [(item["product_id"], item["quantity"]) for item in enriched_items],
+                    template="(%s, 'OUT', %s, 'Sale', CURRENT_TIMESTAMP)",
                 )
 
-                if status == "PAID":
-                    cur.execute(
-                        """
-                        INSERT INTO stock_movements
-                        (product_id, movement_type, quantity, reason, created_at)
-                        VALUES (%s, 'OUT', %s, 'Sale', CURRENT_TIMESTAMP)
-                        """,
-                        (item["product_id"], item["quantity"]),
-                    )
-
             cur.execute("SELECT total_revenue_cents FROM revenue_paid")
             revenue = cur.fetchone()
 
@@ -866,48 +985,168 @@ def get_last_operation():
     return operations[0]
 
 
-def cancel_sale(sale_id: int):
-    """Cancel a sale and restore stock."""
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            # Get sale details
-            cur.execute(
-                "SELECT id, sale_number, total_amount_cents, status FROM sales WHERE id = %s",
-                (sale_id,)
-            )
-            sale = cur.fetchone()
+def cancel_last_operation():
+    """Cancel the most recent operation in a single round trip.
+
+    Detection and cancellation run server-side in the cancel_last_operation()
+    function (postgres/migrations/add_cancel_last_operation.sql), in one
+    transaction.
+
+    Returns:
+        Dict with 'type' (SALE/EXPENSE/STOCK) plus the same fields as the
+        matching cancel_* function, or None if there is nothing to cancel
+    """
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT cancel_last_operation() AS result")
+                # Writes inside a function still report a SELECT tag
+                conn.wrote = True
+                return cur.fetchone()["result"]
+    except errors.UndefinedFunction:
+        # Migration not applied to this database yet
+        last_op = get_last_operation()
+        if not last_op:
+            return None
+        cancel = {
+            "SALE": cancel_sale,
+            "EXPENSE": cancel_expense,
+            "STOCK": cancel_stock_movement,
+        }[last_op["type"]]
+        return {"type": last_op["type"], **cancel(last_op["data"]["id"])}
+
+
+def _cancel_sale_in(cur, sale_id: int) -> dict:
+    """Cancel a sale and restore its stock inside an open transaction."""
+    # Get sale details
+    cur.execute(
+        "SELECT id, sale_number, total_amount_cents, status FROM sales WHERE id = %s",
+        (sale_id,)
+    )
+    sale = cur.fetchone()
 
-            if not sale:
-                raise ValueError(f"Venta con ID {sale_id} no encontrada")
+    if not sale:
+        raise ValueError(f"Venta con ID {sale_id} no encontrada")
 
-            # Get sale items
+    # Get sale items
+    cur.execute(
+        """
+        SELECT product_id, quantity, unit_price_cents
+        FROM sale_items
+        WHERE sale_id = %s
+        """,
+        (sale_id,)
+    )
+    items = cur.fetchall()
+
+    # If sale was PAID, restore stock
+    if sale["status"] == "PAID":
+        for item in items:
             cur.execute(
                 """
-                SELECT product_id, quantity, unit_price_cents
-                FROM sale_items
-                WHERE sale_id = %s
+                INSERT INTO stock_movements
+                (product_id, movement_type, quantity, reason, created_at)
+                VALUES (%s, 'IN', %s, 'Venta cancelada', CURRENT_TIMESTAMP)
                 """,
-                (sale_id,)
+                (item["product_id"], item["quantity"]),
             )
-            items = cur.fetchall()
 
-            # If sale was PAID, restore stock
-            if sale["status"] == "PAID":
-                for item in items:
-                    cur.execute(
-                        """
-                        INSERT INTO stock_movements
-                        (product_id, movement_type, quantity, reason, created_at)
-                        VALUES (%s, 'IN', %s, 'Venta cancelada', CURRENT_TIMESTAMP)
-                        """,
-                        (item["product_id"], item["quantity"]),
-                    )
+    # Delete sale items
+    cur.execute("DELETE FROM sale_items WHERE sale_id = %s", (sale_id,))
+
+    # Delete sale
+    cur.execute("DELETE FROM sales WHERE id = %s", (sale_id,))
+
+    return {
+        "sale_number": sale["sale_number"],
+        "cancelled_amount": sale["total_amount_cents"] / 100.0,
+    }
+
 
-            # Delete sale items
-            cur.execute("DELETE FROM sale_items WHERE sale_id = %s", (sale_id,))
+def _cancel_expense_in(cur, expense_id: int) -> dict:
+    """Delete an expense inside an open transaction."""
+    # Get expense details
+    cur.execute(
+        "SELECT id, description, amount_cents FROM expenses WHERE id = %s",
+        (expense_id,)
+    )
+    expense = cur.fetchone()
+
+    if not expense:
+        raise ValueError(f"Gasto con ID {expense_id} no encontrado")
+
+    # Delete expense
+    cur.execute("DELETE FROM expenses WHERE id = %s", (expense_id,))
+
+    return {
+        "description": expense["description"],
+        "cancelled_amount": expense["amount_cents"] / 100.0,
+    }
+
+
+def _cancel_stock_movement_in(cur, movement_id: int) -> dict:
+    """Reverse a stock movement inside an open transaction."""
+    # Get movement details
+    cur.execute(
+        """
+        SELECT sm.id, sm.product_id, sm.quantity, sm.reason, sm.movement_type,
+               p.name as product_name, p.sku
+        FROM stock_movements sm
+        JOIN products p ON sm.product_id = p.id
+        WHERE sm.id = %s
+        """,
+        (movement_id,)
+    )
+    movement = cur.fetchone()
+
+    if not movement:
+        raise ValueError(f"Movimiento de stock con ID {movement_id} no encontrado")
+
+    # Can only cancel IN or ADJUSTMENT movements (not sales)
+    if movement["movement_type"] not in ["IN", "ADJUSTMENT"]:
+        raise ValueError(f"Solo se pueden cancelar movimientos de tipo IN o ADJUSTMENT")
+
+    # Create inverse movement
+    cur.execute(
+        """
+        INSERT INTO stock_movements
+        (product_id, movement_type, quantity, reason, created_at)
+        VALUES (%s, 'ADJUSTMENT', %s, %s, CURRENT_TIMESTAMP)
+        """,
+        (
+            movement["product_id"],
+            -movement["quantity"],  # Negative to reverse
+            f"Cancelación de: {movement['reason']}"
+        )
+    )
+
+    # Get updated stock
+    cur.execute(
+        "SELECT stock_qty FROM stock_current WHERE product_id = %s",
+        (movement["product_id"],)
+    )
+    stock = cur.fetchone()
+
+    return {
+        "product_name": movement["product_name"],
+        "sku": movement["sku"],
+        "cancelled_quantity": movement["quantity"],
+        "current_stock": stock["stock_qty"] if stock else 0,
+    }
+
+
+_CANCEL_HANDLERS = {
+    "SALE": _cancel_sale_in,
+    "EXPENSE": _cancel_expense_in,
+    "STOCK": _cancel_stock_movement_in,
+}
 
-            # Delete sale
-            cur.execute("DELETE FROM sales WHERE id = %s", (sale_id,))
+
+def cancel_sale(sale_id: int):
+    """Cancel a sale and restore stock."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cancelled = _cancel_sale_in(cur, sale_id)
 
             # Get updated stats
             cur.execute("SELECT total_revenue_cents FROM revenue_paid")
@@ -918,8 +1157,7 @@ def cancel_sale(sale_id: int):
 
     return {
         "status": "ok",
-        "sale_number": sale["sale_number"],
-        "cancelled_amount": sale["total_amount_cents"] / 100.0,
+        **cancelled,
         "revenue_usd": revenue["total_revenue_cents"] / 100.0 if revenue and revenue["total_revenue_cents"] is not None else 0.0,
         "profit_usd": profit["profit_usd"] if profit and profit["profit_usd"] is not None else 0.0,
     }
@@ -929,18 +1167,7 @@ def cancel_expense(expense_id: int):
     """Cancel an expense."""
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # Get expense details
-            cur.execute(
-                "SELECT id, description, amount_cents FROM expenses WHERE id = %s",
-                (expense_id,)
-            )
-            expense = cur.fetchone()
-
-            if not expense:
-                raise ValueError(f"Gasto con ID {expense_id} no encontrado")
-
-            # Delete expense
-            cur.execute("DELETE FROM expenses WHERE id = %s", (expense_id,))
+            cancelled = _cancel_expense_in(cur, expense_id)
 
             # Get updated profit
             cur.execute("SELECT profit_usd FROM profit_summary")
@@ -948,8 +1175,7 @@ def cancel_expense(expense_id: int):
 
     return {
         "status": "ok",
-        "description": expense["description"],
-        "cancelled_amount": expense["amount_cents"] / 100.0,
+        **cancelled,
         "profit_usd": profit["profit_usd"] if profit else 0,
     }
 
@@ -958,53 +1184,67 @@ def cancel_stock_movement(movement_id: int):
     """Cancel a stock movement by creating an inverse movement."""
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # Get movement details
-            cur.execute(
-                """
-                SELECT sm.id, sm.product_id, sm.quantity, sm.reason, sm.movement_type,
-                       p.name as product_name, p.sku
-                FROM stock_movements sm
-                JOIN products p ON sm.product_id = p.id
-                WHERE sm.id = %s
-                """,
-                (movement_id,)
-            )
-            movement = cur.fetchone()
+            cancelled = _cancel_stock_movement_in(cur, movement_id)
 
-            if not movement:
-                raise ValueError(f"Movimiento de stock con ID {movement_id} no encontrado")
+    return {"status": "ok", **cancelled}
 
-            # Can only cancel IN or ADJUSTMENT movements (not sales)
-            if movement["movement_type"] not in ["IN", "ADJUSTMENT"]:
-                raise ValueError(f"Solo se pueden cancelar movimientos de tipo IN o ADJUSTMENT")
 
-            # Create inverse movement
-            cur.execute(
-                """
-                INSERT INTO stock_movements
-                (product_id, movement_type, quantity, reason, created_at)
-                VALUES (%s, 'ADJUSTMENT', %s, %s, CURRENT_TIMESTAMP)
-                """,
-                (
-                    movement["product_id"],
-                    -movement["quantity"],  # Negative to reverse
-                    f"Cancelación de: {movement['reason']}"
-                )
-            )
+def cancel_operations(operations: list[dict]) -> dict:
+    """
+    Cancel several operations in one transaction.
 
-            # Get updated stock
-            cur.execute(
-                "SELECT stock_qty FROM stock_current WHERE product_id = %s",
-                (movement["product_id"],)
-            )
-            stock = cur.fetchone()
+    operations = [{ type: SALE | EXPENSE | STOCK, id }, ...]
+
+    All-or-nothing: if any operation cannot be cancelled (unknown type or
+    id, non-cancellable movement) the whole batch rolls back. The batch runs
+    server-side in the cancel_operations() function
+    (postgres/migrations/add_cancel_operations.sql), in a single round trip.
+
+    Returns:
+        Dict with 'cancelled' (one result per operation, in order, tagged
+        with its 'type') plus the updated revenue_usd and profit_usd
+    """
+    if not operations:
+        raise ValueError("No se especificaron operaciones para cancelar")
+
+    ops = [{"type": op["type"], "id": op["id"]} for op in operations]
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT cancel_operations(%s) AS result", (Json(ops),))
+                # Writes inside a function still report a SELECT tag
+                conn.wrote = True
+                return cur.fetchone()["result"]
+    except errors.UndefinedFunction:
+        # Migration not applied to this database yet
+        return _cancel_operations_in_python(operations)
+    except errors.RaiseException as e:
+        # The function raises with the same messages as the Python path
+        raise ValueError(e.diag.message_primary) from e
+
+
+def _cancel_operations_in_python(operations: list[dict]) -> dict:
+    """cancel_operations() for databases without the server-side function."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cancelled = []
+            for op in operations:
+                cancel = _CANCEL_HANDLERS.get(op["type"])
+                if cancel is None:
+                    raise ValueError(f"No se puede cancelar una operación de tipo {op['type']}")
+                cancelled.append({"type": op["type"], **cancel(cur, op["id"])})
+
+            cur.execute("SELECT total_revenue_cents FROM revenue_paid")
+            revenue = cur.fetchone()
+
+            cur.execute("SELECT profit_usd FROM profit_summary")
+            profit = cur.fetchone()
 
     return {
         "status": "ok",
-        "product_name": movement["product_name"],
-        "sku": movement["sku"],
-        "cancelled_quantity": movement["quantity"],
-        "current_stock": stock["stock_qty"] if stock else 0,
+        "cancelled": cancelled,
+        "revenue_usd": revenue["total_revenue_cents"] / 100.0 if revenue and revenue["total_revenue_cents"] is not None else 0.0,
+        "profit_usd": profit["profit_usd"] if profit and profit["profit_usd"] is not None else 0.0,
     }
 
 
@@ -0,0 +1,117 @@
+-- Migration: cancel the most recent operation in a single call
+-- Replaces the get_last_operation() + cancel_sale/cancel_expense/cancel_stock_movement
+-- round trips made by the write agent for CANCEL_LAST_OPERATION. Detection and
+-- cancellation run in one transaction.
+--
+-- Tables are resolved through search_path, so one definition in public serves
+-- every tenant schema (database_pg.get_conn sets search_path per request).
+--
+-- Returns NULL when there is nothing to cancel, otherwise a JSONB object with
+-- "type" (SALE | EXPENSE | STOCK) plus the fields the matching cancel_*
+-- function returns in database_pg.py.
+
+CREATE OR REPLACE FUNCTION cancel_last_operation()
+RETURNS JSONB AS $$
+DECLARE
+    last_type TEXT;
+    last_id BIGINT;
+    sale_row RECORD;
+    expense_row RECORD;
+    movement_row RECORD;
+    revenue_cents BIGINT;
+    profit NUMERIC;
+    current_qty BIGINT;
+BEGIN
+    -- Latest of each kind; ties go to SALE, then EXPENSE, then STOCK
+    SELECT op.op_type, op.id INTO last_type, last_id
+    FROM (
+        (SELECT 'SALE' AS op_type, 1 AS priority, id, created_at
+         FROM sales ORDER BY created_at DESC LIMIT 1)
+        UNION ALL
+        (SELECT 'EXPENSE', 2, id, created_at
+         FROM expenses ORDER BY created_at DESC LIMIT 1)
+        UNION ALL
+        (SELECT 'STOCK', 3, id, created_at
+         FROM stock_movements WHERE movement_type IN ('IN', 'ADJUSTMENT')
+         ORDER BY created_at DESC LIMIT 1)
+    ) op
+    ORDER BY op.created_at DESC, op.priority
+    LIMIT 1;
+
+    IF last_type IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    IF last_type = 'SALE' THEN
+        SELECT id, sale_number, total_amount_cents, status INTO sale_row
+        FROM sales WHERE id = last_id;
+
+        -- Restore stock for paid sales (reverse the OUT movements)
+        IF sale_row.status = 'PAID' THEN
+            INSERT INTO stock_movements (product_id, movement_type, quantity, reason, created_at)
+            SELECT product_id, 'IN', quantity, 'Venta cancelada', CURRENT_TIMESTAMP
+            FROM sale_items WHERE sale_id = last_id;
+        END IF;
+
+        DELETE FROM sale_items WHERE sale_id = last_id;
+        DELETE FROM sales WHERE id = last_id;
+
+        SELECT total_revenue_cents INTO revenue_cents FROM revenue_paid;
+        SELECT profit_usd INTO profit FROM profit_summary;
+
+        RETURN jsonb_build_object(
+            'type', 'SALE',
+            'status', 'ok',
+            'sale_number', sale_row.sale_number,
+            'cancelled_amount', sale_row.total_amount_cents / 100.0,
+            'revenue_usd', COALESCE(revenue_cents, 0) / 100.0,
+            'profit_usd', COALESCE(profit, 0)
+        );
+    END IF;
+
+    IF last_type = 'EXPENSE' THEN
+        SELECT id, description, amount_cents INTO expense_row
+        FROM expenses WHERE id = last_id;
+
+        DELETE FROM expenses WHERE id = last_id;
+
+        SELECT profit_usd INTO profit FROM profit_summary;
+
+        RETURN jsonb_build_object(
+            'type', 'EXPENSE',
+            'status', 'ok',
+            'description', expense_row.description,
+            'cancelled_amount', expense_row.amount_cents / 100.0,
+            'profit_usd', COALESCE(profit, 0)
+        );
+    END IF;
+
+    -- STOCK: create the inverse movement
+    SELECT sm.product_id, sm.quantity, sm.reason, p.name AS product_name, p.sku
+    INTO movement_row
+    FROM stock_movements sm
+    JOIN products p ON sm.product_id = p.id
+    WHERE sm.id = last_id;
+
+    INSERT INTO stock_movements (product_id, movement_type, quantity, reason, created_at)
+    VALUES (
+        movement_row.product_id,
+        'ADJUSTMENT',
+        -movement_row.quantity,
+        'Cancelación de: ' || COALESCE(movement_row.reason, 'None'),
+        CURRENT_TIMESTAMP
+    );
+
+    SELECT stock_qty INTO current_qty
+    FROM stock_current WHERE product_id = movement_row.product_id;
+
+    RETURN jsonb_build_object(
+        'type', 'STOCK',
+        'status', 'ok',
+        'product_name', movement_row.product_name,
+        'sku', movement_row.sku,
+        'cancelled_quantity', movement_row.quantity,
+        'current_stock', COALESCE(current_qty, 0)
+    );
+END;
+$$ LANGUAGE plpgsql;
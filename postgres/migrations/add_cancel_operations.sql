@@ -0,0 +1,132 @@
+-- Migration: cancel several operations in a single call
+-- Replaces the per-operation round trips of the Python cancel_operations()
+-- loop in database_pg.py (SELECT, SELECT, one INSERT per item, DELETEs, per
+-- operation). Everything runs in one transaction: any failure rolls back the
+-- whole batch.
+--
+-- Tables are resolved through search_path, so one definition in public serves
+-- every tenant schema (database_pg.get_conn sets search_path per request).
+--
+-- Takes a JSONB array of {"type": "SALE" | "EXPENSE" | "STOCK", "id": N} and
+-- returns a JSONB object with "status", "cancelled" (one object per operation,
+-- in order, tagged with its "type" and carrying the fields the matching
+-- cancel_* function returns in database_pg.py), "revenue_usd" and
+-- "profit_usd". Errors are raised with the same messages as the Python code.
+
+CREATE OR REPLACE FUNCTION cancel_operations(ops JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    op JSONB;
+    op_type TEXT;
+    op_id BIGINT;
+    sale_row RECORD;
+    expense_row RECORD;
+    movement_row RECORD;
+    current_qty BIGINT;
+    cancelled JSONB := '[]'::JSONB;
+    revenue_cents BIGINT;
+    profit NUMERIC;
+BEGIN
+    IF ops IS NULL OR jsonb_array_length(ops) = 0 THEN
+        RAISE EXCEPTION 'No se especificaron operaciones para cancelar';
+    END IF;
+
+    FOR op IN SELECT * FROM jsonb_array_elements(ops) LOOP
+        op_type := op->>'type';
+        op_id := (op->>'id')::BIGINT;
+
+        IF op_type = 'SALE' THEN
+            SELECT id, sale_number, total_amount_cents, status INTO sale_row
+            FROM sales WHERE id = op_id;
+
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Venta con ID % no encontrada', op_id;
+            END IF;
+
+            -- Restore stock for paid sales (reverse the OUT movements)
+            IF sale_row.status = 'PAID' THEN
+                INSERT INTO stock_movements (product_id, movement_type, quantity, reason, created_at)
+                SELECT product_id, 'IN', quantity, 'Venta cancelada', CURRENT_TIMESTAMP
+                FROM sale_items WHERE sale_id = op_id;
+            END IF;
+
+            DELETE FROM sale_items WHERE sale_id = op_id;
+            DELETE FROM sales WHERE id = op_id;
+
+            cancelled := cancelled || jsonb_build_array(jsonb_build_object(
+                'type', 'SALE',
+                'sale_number', sale_row.sale_number,
+                'cancelled_amount', sale_row.total_amount_cents / 100.0
+            ));
+
+        ELSIF op_type = 'EXPENSE' THEN
+            SELECT id, description, amount_cents INTO expense_row
+            FROM expenses WHERE id = op_id;
+
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Gasto con ID % no encontrado', op_id;
+            END IF;
+
+            DELETE FROM expenses WHERE id = op_id;
+
+            cancelled := cancelled || jsonb_build_array(jsonb_build_object(
+                'type', 'EXPENSE',
+                'description', expense_row.description,
+                'cancelled_amount', expense_row.amount_cents / 100.0
+            ));
+
+        ELSIF op_type = 'STOCK' THEN
+            SELECT sm.product_id, sm.quantity, sm.reason, sm.movement_type,
+                   p.name AS product_name, p.sku
+            INTO movement_row
+            FROM stock_movements sm
+            JOIN products p ON sm.product_id = p.id
+            WHERE sm.id = op_id;
+
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Movimiento de stock con ID % no encontrado', op_id;
+            END IF;
+
+            -- Can only cancel IN or ADJUSTMENT movements (not sales)
+            IF movement_row.movement_type NOT IN ('IN', 'ADJUSTMENT') THEN
+                RAISE EXCEPTION 'Solo se pueden cancelar movimientos de tipo IN o ADJUSTMENT';
+            END IF;
+
+            -- Create the inverse movement
+            INSERT INTO stock_movements (product_id, movement_type, quantity, reason, created_at)
+            VALUES (
+                movement_row.product_id,
+                'ADJUSTMENT',
+                -movement_row.quantity,
+                'Cancelación de: ' || COALESCE(movement_row.reason, 'None'),
+                CURRENT_TIMESTAMP
+            );
+
+            SELECT stock_qty INTO current_qty
+            FROM stock_current WHERE product_id = movement_row.product_id;
+
+            cancelled := cancelled || jsonb_build_array(jsonb_build_object(
+                'type', 'STOCK',
+                'product_name', movement_row.product_name,
+                'sku', movement_row.sku,
+                'cancelled_quantity', movement_row.quantity,
+                'current_stock', COALESCE(current_qty, 0)
+            ));
+
+        ELSE
+            RAISE EXCEPTION 'No se puede cancelar una operación de tipo %', op_type;
+        END IF;
+    END LOOP;
+
+    -- Totals are read once, after the last cancellation
+    SELECT total_revenue_cents INTO revenue_cents FROM revenue_paid;
+    SELECT profit_usd INTO profit FROM profit_summary;
+
+    RETURN jsonb_build_object(
+        'status', 'ok',
+        'cancelled', cancelled,
+        'revenue_usd', COALESCE(revenue_cents, 0) / 100.0,
+        'profit_usd', COALESCE(profit, 0)
+    );
+END;
+$$ LANGUAGE plpgsql;
@@ -1,9 +1,11 @@
 import argparse
+import logging
 
 from langchain_community.agent_toolkits import create_sql_agent
 from langchain_community.utilities import SQLDatabase
 from langchain_core.tools import Tool
 
+from agents.read_agent import keyword_classification, normalize_text
 from llm import get_llm
 from database import (
     register_product,
@@ -11,11 +13,18 @@ from database import (
     register_sale,
 )
 
+logger = logging.getLogger(__name__)
+
 # =========================
 # PROMPT
 # =========================
+#
+# The prompt is assembled from a shared core plus per-intent fragments so a
+# question only pays for the rules and schemas it can use. Fragments are
+# always appended in PROMPT_FRAGMENTS order, so every variant shares the
+# core as a byte-identical prefix.
 
-PROMPT_TEMPLATE = """
+PROMPT_CORE = """
 You are a senior SQL analyst working with a SQLite database for a small business (Beans&Co).
 
 Use only the listed database objects.
@@ -35,56 +44,11 @@ After a successful SQL query:
 
 If you include markdown or code fences, the execution will fail.
 
-INTENT CLASSIFICATION (MANDATORY):
-
-Before taking any action, you MUST classify the user request as ONE of:
-
-A) Analytical question (read-only, metrics, counts, stock, revenue, profit)
-B) Business operation (registering a sale, adding stock, creating a product)
-
-If the request is a Business operation:
-- You MUST NOT use sql_db_query or sql_db_schema.
-- You MUST NOT generate or attempt SQL.
-- You MUST use the appropriate business action tool directly.
-- You MUST rely on the tool to resolve SKUs, IDs, pricing, and validation.
-
-Attempting SQL for a business operation is a critical error.
-
-Business operation keywords include (not exhaustive):
-- registrar
-- registrame
-- crear
-- agregar
-- vender
-- venta
-- descontar stock
-- cargar producto
-
-For sales registration:
-- The agent MUST pass items using SKU and quantity.
-- The agent MUST NOT attempt to look up product IDs.
-- Product resolution is handled inside the business action.
-
 Database objects:
 expenses, products, sale_items, sales, stock_movements
 (Additional objects of type VIEW may exist and must be preferred when applicable.)
 
-STRICT BUSINESS RULES (MANDATORY):
-
-1. Stock calculation
-- Stock MUST be computed ONLY from stock_movements.
-- NEVER join stock_movements with sales or sale_items.
-- Stock depends exclusively on movement_type and quantity.
-- Mixing stock with sales data is a critical error.
-
-2. Profit calculation
-- Profit is a GLOBAL business metric.
-- Profit = Revenue (PAID sales) − Expenses.
-- Profit MUST NOT be calculated from unit_price, unit_cost, or sale_items.
-- If a view related to profit exists (e.g. profit_summary), it MUST be used.
-- Recomputing profit from base tables when a view exists is an error.
-
-3. Views usage
+Views usage:
 - Objects of type VIEW represent canonical business metrics.
 - If a requested metric exists as a view, you MUST query the view.
 - Do NOT recreate business logic already expressed in a view.
@@ -95,21 +59,6 @@ SQL rules:
 - Do not guess table or column names.
 - Use correct GROUP BY semantics.
 
-Analytical guidance:
-- Stock and profit are independent metrics.
-- Do NOT attempt to compute them in a single query.
-- Prefer multiple simple queries over one complex query.
-- Do NOT assume that natural language terms used by the user
-  (e.g. "pulseras", "bracelets", "productos")
-  match text values stored in the database.
-- When filtering by product type or category, prefer:
-  - SKU patterns
-  - explicit columns
-  - structural relationships
-  over free-text matching on names or descriptions.
-- If the user asks in a different language than the stored data,
-  reason over the data model instead of translating values literally.
-
 Formatting rules:
 - You MUST follow the ReAct format.
 - Never output raw SQL unless executing it via an Action.
@@ -117,14 +66,19 @@ Formatting rules:
   Action: sql_db_query
   Action Input: <SQL query>
 - Only output Final Answer after all actions are completed.
-
-CRITICAL SQL FORMATTING RULES:
-- When executing SQL, output ONLY raw SQL.
-- NEVER include markdown, backticks, or ```sql fences.
 - Action Input must contain plain SQL text only.
-- Including ``` or markdown is a critical error.
 
-AUTHORITATIVE VIEW SCHEMAS (DO NOT INFER):
+Do NOT inspect sqlite_master to infer view schemas.
+The view schemas below are authoritative.
+"""
+
+PROMPT_FRAGMENTS = {
+    "stock": """
+Stock calculation (MANDATORY):
+- Stock MUST be computed ONLY from stock_movements.
+- NEVER join stock_movements with sales or sale_items.
+- Stock depends exclusively on movement_type and quantity.
+- Mixing stock with sales data is a critical error.
 
 stock_current:
 - product_id (INTEGER)
@@ -132,66 +86,137 @@ stock_current:
 - name (TEXT)
 - stock_qty (INTEGER)
 Note: Includes ALL active products, even those with 0 stock.
+""",
+    "profit": """
+Profit calculation (MANDATORY):
+- Profit is a GLOBAL business metric.
+- Profit = Revenue (PAID sales) − Expenses.
+- Profit MUST NOT be calculated from unit_price, unit_cost, or sale_items.
+- If a view related to profit exists (e.g. profit_summary), it MUST be used.
+- Recomputing profit from base tables when a view exists is an error.
+- Stock and profit are independent metrics; never compute them in one query.
 
 profit_summary:
 - profit_usd (REAL)
-
+""",
+    "revenue": """
 revenue_paid:
 - total_revenue_cents (INTEGER)
-
+""",
+    "expense": """
 expenses_total:
 - total_expenses_cents (INTEGER)
-
-Do NOT inspect sqlite_master to infer view schemas.
-These schemas are authoritative.
-
+""",
+    "product": """
+Product matching:
+- Do NOT assume that natural language terms used by the user
+  (e.g. "pulseras", "bracelets", "productos")
+  match text values stored in the database.
+- When filtering by product type or category, prefer:
+  - SKU patterns
+  - explicit columns
+  - structural relationships
+  over free-text matching on names or descriptions.
+- If the user asks in a different language than the stored data,
+  reason over the data model instead of translating values literally.
+- Prefer multiple simple queries over one complex query.
+""",
+    "write": """
 ────────────────────────────────────────
 CONTROLLED WRITE OPERATIONS (ADDITIVE)
 
-- You are allowed to register business operations that modify data.
-- Write operations are ONLY allowed through explicitly provided business actions (tools).
+If the request is a business operation (registering a sale, adding stock,
+creating a product):
+- You MUST NOT use sql_db_query or sql_db_schema.
+- You MUST NOT generate or attempt SQL.
+- You MUST use the appropriate business action tool directly.
+- You MUST rely on the tool to resolve SKUs, IDs, pricing, and validation.
 - You must NEVER generate raw SQL INSERT, UPDATE, or DELETE statements.
 
+For sales registration:
+- The agent MUST pass items using SKU and quantity.
+- The agent MUST NOT attempt to look up product IDs.
+- Product resolution is handled inside the business action.
+
 Before executing a write action:
 - Briefly explain what business event will be recorded.
 - Ensure all required information is present.
 
 After executing a write action:
 - Summarize the business impact.
-
-All analytical rules above remain unchanged.
 ────────────────────────────────────────
+""",
+}
 
+PROMPT_SUFFIX = """
 Respond with a concise, human-readable explanation of the result.
 """
 
+# Fragments each detected intent needs; None means "send everything".
+INTENT_FRAGMENTS = {
+    "STOCK_QUERY": ("stock", "product"),
+    "PROFIT_QUERY": ("profit",),
+    "REVENUE_QUERY": ("revenue",),
+    "SALES_QUERY": ("revenue", "product"),
+    "EXPENSE_QUERY": ("expense",),
+    "PRODUCT_INFO": ("stock", "product"),
+    "WRITE": ("write", "product"),
+    None: tuple(PROMPT_FRAGMENTS),
+}
+
+WRITE_KEYWORDS = (
+    "registrar",
+    "registrame",
+    "crear",
+    "agregar",
+    "vender",
+    "descontar stock",
+    "cargar producto",
+)
+
+
+def build_prompt(intent=None) -> str:
+    """Assemble the system prompt for an intent (None → full prompt)."""
+    wanted = INTENT_FRAGMENTS.get(intent, INTENT_FRAGMENTS[None])
+    fragments = [PROMPT_FRAGMENTS[key] for key in PROMPT_FRAGMENTS if key in wanted]
+    return "".join([PROMPT_CORE, *fragments, PROMPT_SUFFIX])
+
+
+def detect_intent(question: str):
+    """Cheap intent guess used to pick the prompt; None when unsure."""
+    text = normalize_text(question)
+    if any(keyword in text for keyword in WRITE_KEYWORDS):
+        return "WRITE"
+    match = keyword_classification(question)
+    return match[0] if match else None
+
+
+PROMPT_TEMPLATE = build_prompt()
+
 
 # =========================
 # HELPERS
 # =========================
 
-def run_agent_query(agent, system_prompt: str, question: str):
+def run_agent_query(agent, question: str):
     """
     Run agent query with error handling.
 
+    The system prompt is carried by the agent itself (system_message=), so
+    only the question is sent here.
+
     Args:
         agent: SQL agent instance
-        system_prompt: System prompt template
         question: User question
 
     Returns:
         Agent response string
     """
-    prompt = f"{system_prompt}\n\nQuestion: {question}"
-
     try:
-        result = agent.invoke(prompt)
+        result = agent.invoke({"input": question})
         return result["output"] if isinstance(result, dict) and "output" in result else result
     except Exception as e:
-        # Log the error for debugging
-        print(f"\n[ERROR] Agent execution failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Agent execution failed")
 
         # Return a user-friendly error message
         error_msg = str(e)
@@ -205,7 +230,7 @@ def run_agent_query(agent, system_prompt: str, question: str):
             return f"⚠️ Lo siento, ocurrió un error al procesar tu solicitud:\n{error_msg}\n\nPor favor intenta de nuevo o reformula tu pregunta."
 
 
-def interactive_console(agent, system_prompt: str):
+def interactive_console(agent_for):
     print("SQL agent ready. Type your question or 'exit' to quit.")
     while True:
         try:
@@ -220,7 +245,7 @@ def interactive_console(agent, system_prompt: str):
             print("Bye.")
             break
 
-        res = run_agent_query(agent, system_prompt, question)
+        res = run_agent_query(agent_for(question), question)
         print("\n=== RESULT ===")
         print(res)
 
@@ -262,21 +287,29 @@ def main():
         ),
     ]
 
-    agent = create_sql_agent(
-        llm=llm,
-        db=db,
-        extra_tools=tools,
-        system_message=PROMPT_TEMPLATE,
-        verbose=True,
-        handle_parsing_errors=True,
-    )
+    # The system message is fixed when the agent is built, so keep one agent
+    # per prompt variant and reuse it across questions.
+    agents = {}
+
+    def agent_for(question: str):
+        intent = detect_intent(question)
+        if intent not in agents:
+            agents[intent] = create_sql_agent(
+                llm=llm,
+                db=db,
+                extra_tools=tools,
+                system_message=build_prompt(intent),
+                verbose=True,
+                handle_parsing_errors=True,
+            )
+        return agents[intent]
 
     if args.question:
-        res = run_agent_query(agent, PROMPT_TEMPLATE, args.question)
+        res = run_agent_query(agent_for(args.question), args.question)
         print("\n=== RESULT ===")
         print(res)
     else:
-        interactive_console(agent, PROMPT_TEMPLATE)
+        interactive_console(agent_for)
 
 
 if __name__ == "__main__":
@@ -26,12 +26,15 @@ def get_db_connection():
         password=os.getenv("POSTGRES_PASSWORD", "changeme123"),
         # Explicit encoding configuration
         client_encoding='UTF8',
-        options='-c client_encoding=UTF8'
+        options='-c client_encoding=UTF8',
+        # Keep the session alive across the apply + verify steps
+        keepalives=1,
+        keepalives_idle=30
     )
 
 
-def apply_migration():
-    """Apply the tenant stats optimization migration."""
+def apply_migration(conn):
+    """Apply the tenant stats optimization migration on an open connection."""
     print("[MIGRATION] Applying tenant stats optimization...")
 
     # Read migration file
@@ -44,13 +47,7 @@ def apply_migration():
     with open(migration_file, 'r', encoding='utf-8') as f:
         migration_sql = f.read()
 
-    conn = None
     try:
-        # Connect to database with explicit encoding
-        print("[MIGRATION] Connecting to PostgreSQL...")
-        conn = get_db_connection()
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-
         cur = conn.cursor()
 
         # Execute the migration SQL
@@ -68,24 +65,25 @@ def apply_migration():
         print(f"[ERROR] Error code: {e.pgcode}")
         if hasattr(e, 'pgerror'):
             print(f"[ERROR] Details: {e.pgerror}")
+        # statement_position is a 1-based character offset into the SQL we sent
+        if e.diag.statement_position:
+            line = migration_sql.count("\n", 0, int(e.diag.statement_position) - 1) + 1
+            print(f"[ERROR] At line {line} of {migration_file.name}")
+        if e.diag.context:
+            print(f"[ERROR] Context: {e.diag.context}")
         sys.exit(1)
     except Exception as e:
         print(f"[ERROR] Failed to apply migration: {e}")
         import traceback
         traceback.print_exc()
         sys.exit(1)
-    finally:
-        if conn:
-            conn.close()
 
 
-def verify_function():
+def verify_function(conn):
     """Verify that the function was created successfully."""
     print("\n[VERIFY] Testing the new function...")
 
-    conn = None
     try:
-        conn = get_db_connection()
         cur = conn.cursor()
 
         cur.execute("SELECT * FROM get_all_tenant_stats()")
@@ -107,9 +105,6 @@ def verify_function():
     except Exception as e:
         print(f"[VERIFY] ⚠ Could not test function: {e}")
         print("[VERIFY] This is OK if you have no tenant data yet.")
-    finally:
-        if conn:
-            conn.close()
 
 
 if __name__ == "__main__":
@@ -131,11 +126,23 @@ if __name__ == "__main__":
     print("  - Dramatically improves tenant list loading speed")
     print()
 
-    # Apply migration
-    apply_migration()
+    # One connection (and one TCP/TLS/auth handshake) for both steps
+    print("[MIGRATION] Connecting to PostgreSQL...")
+    try:
+        conn = get_db_connection()
+    except psycopg2.Error as e:
+        print(f"[ERROR] Could not connect to PostgreSQL: {e}")
+        sys.exit(1)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+
+    try:
+        # Apply migration
+        apply_migration(conn)
 
-    # Verify it works
-    verify_function()
+        # Verify it works
+        verify_function(conn)
+    finally:
+        conn.close()
 
     print()
     print("=" * 60)
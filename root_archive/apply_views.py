@@ -4,7 +4,20 @@ import os
 DB_PATH = os.getenv("SQLITE_PATH", "beansco.db")
 
 conn = sqlite3.connect(DB_PATH)
-with open("views.sql") as f:
-    conn.executescript(f.read())
+# Run views.sql one statement at a time while reading it, so a failure names
+# the statement's starting line instead of failing the whole script opaquely
+statement = ""
+start_line = 1
+with open("views.sql", encoding="utf-8") as f:
+    for line_no, line in enumerate(f, start=1):
+        if not statement.strip():
+            statement, start_line = "", line_no
+        statement += line
+        if sqlite3.complete_statement(statement):
+            try:
+                conn.execute(statement)
+            except sqlite3.Error as e:
+                raise SystemExit(f"views.sql line {start_line}: {e}")
+            statement = ""
 conn.commit()
 conn.close()
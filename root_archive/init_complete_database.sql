@@ -70,6 +70,10 @@ CREATE TABLE expenses (
   created_at TEXT NOT NULL DEFAULT (datetime('now'))
 );
 
+-- Create Indexes
+CREATE INDEX IF NOT EXISTS idx_sales_created_at ON sales(created_at);
+CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items(sale_id);
+
 -- Create Views
 CREATE VIEW stock_current AS
     SELECT
@@ -566,6 +566,10 @@ CREATE TABLE IF NOT EXISTS expenses (
     created_at TEXT DEFAULT (datetime('now')) NOT NULL
 );
 
+-- Indexes
+CREATE INDEX IF NOT EXISTS idx_sales_created_at ON sales(created_at);
+CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items(sale_id);
+
 -- Views
 CREATE VIEW IF NOT EXISTS revenue_paid AS
 SELECT COALESCE(SUM(total_amount_cents), 0) AS total_revenue_cents
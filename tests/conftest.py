@@ -58,8 +58,14 @@ def test_db(tmp_path, monkeypatch):
 
     monkeypatch.setattr("database.get_conn", test_get_conn)
 
+    # Point the shared connection at the test database as well, so
+    # database.get_data_version() tracks this file and not the default one
+    token = database.set_tenant_db_path(str(db_file))
+
     yield db_file
 
+    database.reset_tenant_db_path(token)
+    database.close_connections()
     # Cleanup happens automatically (tmp_path is deleted after test)
 
 
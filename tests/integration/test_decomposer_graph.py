@@ -108,9 +108,9 @@ def test_multi_intent_emits_aggregated_bubble(monkeypatch):
 
     # --- Patch the database layer so the resolver finds each product. ---
     products = {
-        "medias": {"id": 1, "sku": "BC-MED", "name": "Medias"},
-        "pantaletas": {"id": 2, "sku": "BC-PAN", "name": "Pantaletas"},
-        "soquetes": {"id": 3, "sku": "BC-SOQ", "name": "Soquetes"},
+        "medias": {"id": 1, "sku": "BC-MED", "name": "Medias", "is_active": True},
+        "pantaletas": {"id": 2, "sku": "BC-PAN", "name": "Pantaletas", "is_active": True},
+        "soquetes": {"id": 3, "sku": "BC-SOQ", "name": "Soquetes", "is_active": True},
     }
 
     def fake_fetch_one(query: str, params: tuple = ()):  # type: ignore[no-untyped-def]
@@ -131,6 +131,8 @@ def test_multi_intent_emits_aggregated_bubble(monkeypatch):
 
     monkeypatch.setattr("agents.resolver.fetch_one", fake_fetch_one)
     monkeypatch.setattr("agents.resolver.fetch_all", fake_fetch_all)
+    # No data version: keep the fake products out of the catalog cache
+    monkeypatch.setattr("agents.resolver.get_data_version", lambda: None)
 
     # --- Patch the write_agent register_sale + price-block fetch_one. ---
     sale_counter = {"n": 0}
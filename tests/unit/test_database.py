@@ -3,23 +3,33 @@ Unit tests for database.py business operations.
 
 Tests cover:
 - Product registration (5 tests)
-- Stock management (8 tests)
+- Stock management (9 tests)
 - Sales operations (10 tests)
 - Expense management (4 tests)
-- Cancellation operations (3 tests)
+- Cancellation operations (7 tests)
 
-Total: 30 tests
+Total: 35 tests
 """
+import contextvars
+import gc
+import sqlite3
+import threading
+
 import pytest
+
+import database
 from database import (
     register_product,
     register_product_with_stock,
     register_products_batch,
     add_stock,
+    add_stock_bulk,
     register_sale,
     register_expense,
     cancel_sale,
     cancel_expense,
+    cancel_last_operation,
+    cancel_operations,
     fetch_one,
     fetch_all,
     get_last_sale,
@@ -252,7 +262,7 @@ class TestRegisterProductWithStock:
 
 
 # ==============================================================================
-# STOCK MANAGEMENT TESTS (8 tests)
+# STOCK MANAGEMENT TESTS (9 tests)
 # ==============================================================================
 
 @pytest.mark.unit
@@ -338,6 +348,20 @@ class TestStockManagement:
 
         assert result["current_stock"] == 45
 
+    def test_add_stock_bulk_returns_results_in_item_order(self, populated_db):
+        """Test that add_stock_bulk records every item and reports current stock per item."""
+        add_stock({"product_id": 2, "quantity": 5})
+
+        results = add_stock_bulk(
+            [{"product_id": 2, "quantity": 10}, {"product_id": 1, "quantity": 3}],
+            reason="Reposición",
+        )
+
+        assert [r["product_id"] for r in results] == [2, 1]
+        assert [r["current_stock"] for r in results] == [15, 3]
+        movements = fetch_all("SELECT reason FROM stock_movements WHERE reason = ?", ("Reposición",))
+        assert len(movements) == 2
+
     def test_stock_current_view_accuracy(self, populated_db):
         """Test that stock_current view calculates correctly."""
         # Add IN movements
@@ -602,13 +626,13 @@ class TestExpenseManagement:
 
 
 # ==============================================================================
-# CANCELLATION OPERATIONS TESTS (3 tests)
+# CANCELLATION OPERATIONS TESTS (7 tests)
 # ==============================================================================
 
 @pytest.mark.unit
 @pytest.mark.database
 class TestCancellationOperations:
-    """Tests for cancel_sale() and cancel_expense() functions."""
+    """Tests for cancel_sale(), cancel_expense(), cancel_last_operation() and cancel_operations()."""
 
     def test_cancel_sale_restores_stock(self, populated_db):
         """Test that canceling a PAID sale restores stock."""
@@ -681,65 +705,214 @@ class TestCancellationOperations:
 
         # Profit should be restored to $350
         assert cancel_result["profit_usd"] == 350.0
-
-
-# ==============================================================================
-# REGISTER_PRODUCTS_BATCH (atomic multi-product creation, PR-4)
-# ==============================================================================
-
-@pytest.mark.unit
-@pytest.mark.database
-class TestRegisterProductsBatch:
-    """All-or-nothing batch creation. Per Atlas review of PR-4, the contract
-    is atomic: any failure rolls back the entire batch."""
-
-    def test_creates_three_products_in_one_call(self, test_db):
-        result = register_products_batch([
-            {"sku": "BATCH-1", "name": "Peras verdes", "unit_price_cents": 500, "unit_cost_cents": 0},
-            {"sku": "BATCH-2", "name": "Manzanas rojas", "unit_price_cents": 300, "unit_cost_cents": 0},
-            {"sku": "BATCH-3", "name": "Bananas", "unit_price_cents": 200, "unit_cost_cents": 0},
-        ])
-
-        assert len(result) == 3
-        assert result[0]["sku"] == "BATCH-1"
-        assert result[1]["sku"] == "BATCH-2"
-        assert result[2]["sku"] == "BATCH-3"
-        rows = fetch_all("SELECT sku FROM products WHERE sku LIKE 'BATCH-%' ORDER BY sku")
-        assert [r["sku"] for r in rows] == ["BATCH-1", "BATCH-2", "BATCH-3"]
-
-    def test_duplicate_sku_rolls_back_entire_batch(self, test_db):
-        # Pre-existing product whose SKU collides with item 2 of the batch.
-        register_product({
-            "sku": "EXISTS-1",
-            "name": "Pre-existing",
-            "unit_price_cents": 100,
-            "unit_cost_cents": 0,
-        })
-
-        with pytest.raises(ValueError) as exc:
-            register_products_batch([
-                {"sku": "BATCH-A", "name": "First", "unit_price_cents": 500, "unit_cost_cents": 0},
-                {"sku": "EXISTS-1", "name": "Second (collides)", "unit_price_cents": 500, "unit_cost_cents": 0},
-                {"sku": "BATCH-C", "name": "Third", "unit_price_cents": 500, "unit_cost_cents": 0},
-            ])
-
-        # Error must name the offending row so the user can fix it.
-        assert "EXISTS-1" in str(exc.value) or "Second" in str(exc.value)
-
-        # Atomicity: neither BATCH-A nor BATCH-C must have landed.
-        rows = fetch_all("SELECT sku FROM products WHERE sku IN ('BATCH-A', 'BATCH-C')")
-        assert len(rows) == 0
-
-    def test_accepts_null_unit_price_cents(self, test_db):
-        """Multi-product create should support price-pending items so the
-        user can populate stock first and price later."""
-        register_products_batch([
-            {"sku": "NPRC-1", "name": "Sin precio", "unit_price_cents": None, "unit_cost_cents": 0},
-        ])
-        row = fetch_one("SELECT name, unit_price_cents FROM products WHERE sku = ?", ("NPRC-1",))
-        assert row["name"] == "Sin precio"
-        assert row["unit_price_cents"] is None
-
-    def test_empty_list_raises(self, test_db):
-        with pytest.raises(ValueError):
-            register_products_batch([])
+
+    def test_cancel_last_operation_returns_type_and_result(self, populated_db):
+        """Test that cancel_last_operation tags the cancel_* result with its type."""
+        register_expense({"amount_cents": 5000, "description": "Test expense"})
+
+        cancel_result = cancel_last_operation()
+
+        assert cancel_result["type"] == "EXPENSE"
+        assert cancel_result["status"] == "ok"
+        assert cancel_result["cancelled_amount"] == 50.0
+        assert get_last_expense() is None
+
+    def test_cancel_last_operation_with_nothing_to_cancel(self, populated_db):
+        """Test that cancel_last_operation returns None on an empty history."""
+        assert cancel_last_operation() is None
+
+    def test_cancel_operations_cancels_every_entry(self, populated_db):
+        """Test that cancel_operations cancels a sale and an expense together."""
+        add_stock({"product_id": 1, "quantity": 100})
+        sale = register_sale({
+            "status": "PAID",
+            "items": [{"product_id": 1, "quantity": 10}]
+        })
+        expense = register_expense({"amount_cents": 5000, "description": "Test expense"})
+
+        cancel_result = cancel_operations([
+            {"type": "SALE", "id": sale["sale_id"]},
+            {"type": "EXPENSE", "id": expense["expense_id"]},
+        ])
+
+        assert cancel_result["status"] == "ok"
+        assert [c["type"] for c in cancel_result["cancelled"]] == ["SALE", "EXPENSE"]
+        assert cancel_result["revenue_usd"] == 0.0
+        assert cancel_result["profit_usd"] == 0.0
+
+        stock = fetch_one("SELECT * FROM stock_current WHERE product_id = ?", (1,))
+        assert stock["stock_qty"] == 100
+
+    def test_cancel_operations_rolls_back_on_invalid_entry(self, populated_db):
+        """Test that one unknown id leaves every operation in the batch intact."""
+        expense = register_expense({"amount_cents": 5000, "description": "Test expense"})
+
+        with pytest.raises(ValueError):
+            cancel_operations([
+                {"type": "EXPENSE", "id": expense["expense_id"]},
+                {"type": "SALE", "id": 99999},
+            ])
+
+        assert get_last_expense() is not None
+
+
+# ==============================================================================
+# REGISTER_PRODUCTS_BATCH (atomic multi-product creation, PR-4)
+# ==============================================================================
+
+@pytest.mark.unit
+@pytest.mark.database
+class TestRegisterProductsBatch:
+    """All-or-nothing batch creation. Per Atlas review of PR-4, the contract
+    is atomic: any failure rolls back the entire batch."""
+
+    def test_creates_three_products_in_one_call(self, test_db):
+        result = register_products_batch([
+            {"sku": "BATCH-1", "name": "Peras verdes", "unit_price_cents": 500, "unit_cost_cents": 0},
+            {"sku": "BATCH-2", "name": "Manzanas rojas", "unit_price_cents": 300, "unit_cost_cents": 0},
+            {"sku": "BATCH-3", "name": "Bananas", "unit_price_cents": 200, "unit_cost_cents": 0},
+        ])
+
+        assert len(result) == 3
+        assert result[0]["sku"] == "BATCH-1"
+        assert result[1]["sku"] == "BATCH-2"
+        assert result[2]["sku"] == "BATCH-3"
+        rows = fetch_all("SELECT sku FROM products WHERE sku LIKE 'BATCH-%' ORDER BY sku")
+        assert [r["sku"] for r in rows] == ["BATCH-1", "BATCH-2", "BATCH-3"]
+
+    def test_duplicate_sku_rolls_back_entire_batch(self, test_db):
+        # Pre-existing product whose SKU collides with item 2 of the batch.
+        register_product({
+            "sku": "EXISTS-1",
+            "name": "Pre-existing",
+            "unit_price_cents": 100,
+            "unit_cost_cents": 0,
+        })
+
+        with pytest.raises(ValueError) as exc:
+            register_products_batch([
+                {"sku": "BATCH-A", "name": "First", "unit_price_cents": 500, "unit_cost_cents": 0},
+                {"sku": "EXISTS-1", "name": "Second (collides)", "unit_price_cents": 500, "unit_cost_cents": 0},
+                {"sku": "BATCH-C", "name": "Third", "unit_price_cents": 500, "unit_cost_cents": 0},
+            ])
+
+        # Error must name the offending row so the user can fix it.
+        assert "EXISTS-1" in str(exc.value) or "Second" in str(exc.value)
+
+        # Atomicity: neither BATCH-A nor BATCH-C must have landed.
+        rows = fetch_all("SELECT sku FROM products WHERE sku IN ('BATCH-A', 'BATCH-C')")
+        assert len(rows) == 0
+
+    def test_accepts_null_unit_price_cents(self, test_db):
+        """Multi-product create should support price-pending items so the
+        user can populate stock first and price later."""
+        register_products_batch([
+            {"sku": "NPRC-1", "name": "Sin precio", "unit_price_cents": None, "unit_cost_cents": 0},
+        ])
+        row = fetch_one("SELECT name, unit_price_cents FROM products WHERE sku = ?", ("NPRC-1",))
+        assert row["name"] == "Sin precio"
+        assert row["unit_price_cents"] is None
+
+    def test_empty_list_raises(self, test_db):
+        with pytest.raises(ValueError):
+            register_products_batch([])
+
+
+# ==============================================================================
+# CONNECTION REUSE TESTS
+# ==============================================================================
+
+@pytest.mark.unit
+@pytest.mark.database
+class TestConnectionReuse:
+    """Tests for the per-thread, per-file connection behind get_conn()."""
+
+    @pytest.fixture
+    def tenant_db_path(self, tmp_path):
+        token = database.set_tenant_db_path(str(tmp_path / "tenant.db"))
+        yield tmp_path / "tenant.db"
+        database.reset_tenant_db_path(token)
+        database.close_connections()
+
+    def test_get_conn_reuses_connection_per_file(self, tenant_db_path):
+        """Consecutive get_conn() calls share one connection."""
+        with database.get_conn() as first:
+            pass
+        with database.get_conn() as second:
+            pass
+
+        assert first is second
+
+    def test_get_conn_uses_one_connection_per_thread(self, tenant_db_path):
+        """Another thread gets its own connection, so readers do not queue."""
+        with database.get_conn() as main_conn:
+            seen = []
+            worker = threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(lambda: seen.append(database.fetch_one("SELECT 1")[0]),),
+            )
+            worker.start()
+            # Times out if the worker has to wait for this block to exit
+            worker.join(timeout=5)
+
+        assert seen == [1]
+
+        def grab():
+            with database.get_conn() as conn:
+                seen.append(conn)
+
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(grab,))
+        worker.start()
+        worker.join()
+        assert seen[-1] is not main_conn
+
+    def test_finished_thread_connection_is_closed(self, tenant_db_path):
+        """A worker's connection is closed once the worker thread exits."""
+        opened = []
+
+        def grab():
+            with database.get_conn() as conn:
+                opened.append(conn)
+
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(grab,))
+        worker.start()
+        worker.join()
+        gc.collect()
+
+        with pytest.raises(sqlite3.ProgrammingError):
+            opened[0].execute("SELECT 1")
+
+    def test_data_version_changes_on_other_thread_write(self, tenant_db_path):
+        """Writes committed on another thread's connection bump the version."""
+        database.execute("CREATE TABLE t (x INTEGER)")
+        before = database.get_data_version()
+        # Carry the tenant DB path over, as the server's threadpool does
+        context = contextvars.copy_context()
+        worker = threading.Thread(
+            target=context.run, args=(database.execute, "INSERT INTO t VALUES (1)")
+        )
+        worker.start()
+        worker.join()
+
+        assert database.get_data_version() != before
+
+    def test_rows_support_index_and_name_access(self, tenant_db_path):
+        """fetch_all hands back sqlite3.Row objects from the shared connection."""
+        row = fetch_all("SELECT 1 AS one, 'x' AS label")[0]
+
+        assert isinstance(row, sqlite3.Row)
+        assert (row[0], row["label"]) == (1, "x")
+
+    def test_connection_uses_wal_journal(self, tenant_db_path):
+        """The tuning pragmas are applied when the connection opens."""
+        assert fetch_one("PRAGMA journal_mode")[0] == "wal"
+
+    def test_failed_block_rolls_back(self, tenant_db_path):
+        """An exception inside get_conn() discards the pending writes."""
+        database.execute("CREATE TABLE t (x INTEGER)")
+        with pytest.raises(RuntimeError):
+            with database.get_conn() as conn:
+                conn.execute("INSERT INTO t VALUES (1)")
+                raise RuntimeError("boom")
+
+        assert fetch_one("SELECT COUNT(*) FROM t")[0] == 0
@@ -0,0 +1,101 @@
+"""Unit tests for database_pg.py that need no PostgreSQL server (mocked pool)."""
+from unittest.mock import MagicMock
+
+import pytest
+
+import database_pg
+
+
+class _FakePool:
+    """Pool handing out one mock connection, like ThreadedConnectionPool."""
+
+    def __init__(self):
+        self.conn = MagicMock()
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn):
+        pass
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    fake = _FakePool()
+    monkeypatch.setattr(database_pg, "get_connection_pool", lambda: fake)
+    # Freeze the clock so the TTL bucket cannot roll over mid-test
+    monkeypatch.setattr(database_pg.time, "monotonic", lambda: 1000.0)
+    return fake
+
+
+@pytest.mark.unit
+class TestDataVersion:
+    """get_data_version() moves on local writes and on TTL rollover."""
+
+    def test_read_block_keeps_version(self, fake_pool):
+        before = database_pg.get_data_version()
+
+        with database_pg.get_conn():
+            pass
+
+        assert database_pg.get_data_version() == before
+
+    def test_write_block_bumps_version(self, fake_pool):
+        before = database_pg.get_data_version()
+
+        with database_pg.get_conn() as conn:
+            conn.wrote = True
+
+        assert database_pg.get_data_version() != before
+
+    def test_failed_write_block_keeps_version(self, fake_pool):
+        before = database_pg.get_data_version()
+
+        with pytest.raises(RuntimeError):
+            with database_pg.get_conn() as conn:
+                conn.wrote = True
+                raise RuntimeError("boom")
+
+        assert database_pg.get_data_version() == before
+        fake_pool.conn.rollback.assert_called_once()
+
+    def test_version_rolls_over_after_ttl(self, fake_pool, monkeypatch):
+        before = database_pg.get_data_version()
+
+        monkeypatch.setattr(
+            database_pg.time, "monotonic",
+            lambda: 1000.0 + database_pg.DATA_VERSION_TTL_SECONDS,
+        )
+
+        assert database_pg.get_data_version() != before
+
+
+@pytest.mark.unit
+class TestCancelOperations:
+    """cancel_operations() runs as one server-side call when available."""
+
+    def test_batch_is_a_single_function_call(self, fake_pool):
+        cur = fake_pool.conn.cursor.return_value.__enter__.return_value
+        cur.fetchone.return_value = {"result": {"status": "ok", "cancelled": []}}
+
+        result = database_pg.cancel_operations([
+            {"type": "SALE", "id": 1},
+            {"type": "EXPENSE", "id": 2},
+        ])
+
+        assert result == {"status": "ok", "cancelled": []}
+        # SET search_path, then the function call
+        assert cur.execute.call_count == 2
+        assert cur.execute.call_args[0][0] == "SELECT cancel_operations(%s) AS result"
+        assert fake_pool.conn.wrote is True
+
+    def test_falls_back_without_the_migration(self, fake_pool, monkeypatch):
+        cur = fake_pool.conn.cursor.return_value.__enter__.return_value
+        cur.execute.side_effect = [None, database_pg.errors.UndefinedFunction()]
+        monkeypatch.setattr(
+            database_pg, "_cancel_operations_in_python", lambda operations: {"fallback": operations}
+        )
+
+        ops = [{"type": "SALE", "id": 1}]
+
+        assert database_pg.cancel_operations(ops) == {"fallback": ops}
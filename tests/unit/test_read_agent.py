@@ -1,8 +1,21 @@
-"""Unit tests for agents/read_agent.py formatting helpers."""
+"""Unit tests for agents/read_agent.py formatting helpers and classifier cache."""
+import json
+import sqlite3
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
 import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
 
 import agents.read_agent as read_agent
-from agents.read_agent import format_stock_result, generate_sales_query
+import database
+from agents.read_agent import (
+    format_stock_result,
+    generate_expense_query,
+    generate_sales_query,
+    generate_stock_query,
+)
 
 
 @pytest.mark.unit
@@ -28,6 +41,22 @@ class TestFormatStockResult:
         assert format_stock_result([]) == "No hay productos en el inventario."
 
 
+@pytest.mark.unit
+class TestFormatShortDate:
+    """Date rendering shared by the sales and expense formatters."""
+
+    @pytest.mark.parametrize("value, with_time, expected", [
+        ("2026-03-07 14:05:59", True, "07/03 14:05"),
+        ("2026-03-07T14:05:59Z", False, "07/03"),
+        ("2026-03-07", True, "07/03"),
+        (datetime(2026, 3, 7, 14, 5), True, "07/03 14:05"),
+        (date(2026, 3, 7), False, "07/03"),
+        ("ayer", True, "ayer"),
+    ])
+    def test_renders_day_month(self, value, with_time, expected):
+        assert read_agent.format_short_date(value, with_time=with_time) == expected
+
+
 @pytest.mark.unit
 class TestGenerateSalesQuery:
     """Tests for sales history SQL generation."""
@@ -36,16 +65,401 @@ class TestGenerateSalesQuery:
         """PostgreSQL mode should not emit MySQL-only GROUP_CONCAT."""
         monkeypatch.setattr(read_agent, "USE_POSTGRES", True)
 
-        sql = generate_sales_query({})
+        sql, params = generate_sales_query({})
 
         assert "STRING_AGG" in sql
         assert "GROUP_CONCAT" not in sql
+        assert params == ()
 
     def test_generate_sales_query_uses_sqlite_aggregation_when_disabled(self, monkeypatch):
         """SQLite mode should keep using GROUP_CONCAT."""
         monkeypatch.setattr(read_agent, "USE_POSTGRES", False)
 
-        sql = generate_sales_query({})
+        sql, params = generate_sales_query({})
 
         assert "GROUP_CONCAT" in sql
         assert "STRING_AGG" not in sql
+        assert params == ()
+
+    def test_returns_latest_ten_sales_with_their_items(self, populated_db):
+        for n in range(12):
+            database.execute(
+                "INSERT INTO sales (sale_number, status, total_amount_cents, created_at) "
+                "VALUES (%s, 'PAID', 3500, %s)",
+                (f"S-{n:02d}", f"2026-01-{n + 1:02d} 10:00:00"),
+            )
+            database.execute(
+                "INSERT INTO sale_items (sale_id, product_id, quantity, unit_price_cents, line_total_cents) "
+                "SELECT id, 1, %s, 3500, 3500 FROM sales WHERE sale_number = %s",
+                (n + 1, f"S-{n:02d}"),
+            )
+
+        sql, params = generate_sales_query({})
+        rows = database.fetch_all(sql, params)
+
+        assert [row["sale_number"] for row in rows] == [f"S-{n:02d}" for n in range(11, 1, -1)]
+        assert rows[0]["items"].endswith("(12)")
+
+
+@pytest.mark.unit
+class TestGenerateStockQuery:
+    """Tests for parameterized stock SQL generation."""
+
+    def test_product_words_are_bound_not_interpolated(self):
+        sql, params = generate_stock_query({"product_names": ["pulseras negras"]})
+
+        assert "negra" not in sql
+        assert params == ("%pulsera%", "%negra%")
+
+    def test_same_word_count_yields_same_statement(self):
+        sql_a, _ = generate_stock_query({"product_names": ["pulseras negras"]})
+        sql_b, _ = generate_stock_query({"product_names": ["llaveros dorados"]})
+
+        assert sql_a == sql_b
+
+    def test_filters_stock_by_product_name(self, populated_db):
+        database.execute(
+            "INSERT INTO stock_movements (product_id, movement_type, quantity, reason) "
+            "VALUES (2, 'IN', 7, 'test')"
+        )
+        sql, params = generate_stock_query({"product_names": ["pulsera negra"]})
+
+        rows = database.fetch_all(sql, params)
+
+        assert [row["stock_qty"] for row in rows] == [7]
+
+
+@pytest.mark.unit
+class TestGenerateExpenseQuery:
+    """Tests for parameterized expense SQL generation."""
+
+    def test_period_start_is_bound(self):
+        week_sql, week_params = generate_expense_query({"time_period": "última semana"})
+        month_sql, month_params = generate_expense_query({"time_period": "mes pasado"})
+
+        assert week_sql == month_sql
+        assert week_params == ((date.today() - timedelta(days=7)).isoformat(),)
+        assert month_params == ((date.today() - timedelta(days=30)).isoformat(),)
+
+    def test_today_excludes_future_dated_expenses(self, populated_db):
+        today = date.today()
+        with database.get_conn() as conn:
+            for expense_date, description in [
+                (today, "Hoy"),
+                (today + timedelta(days=3), "Futuro"),
+                (today - timedelta(days=1), "Ayer"),
+            ]:
+                conn.execute(
+                    "INSERT INTO expenses (expense_date, category, description, amount_cents) "
+                    "VALUES (?, 'GENERAL', ?, 1000)",
+                    (expense_date.isoformat(), description),
+                )
+
+        sql, params = generate_expense_query({"time_period": "hoy"})
+        rows = database.fetch_all(sql, params)
+
+        assert [row["description"] for row in rows] == ["Hoy"]
+
+    @pytest.mark.parametrize("time_period", ["", "todos", "gastos totales"])
+    def test_no_filter_without_a_period(self, time_period):
+        sql, params = generate_expense_query({"time_period": time_period})
+
+        assert "WHERE" not in sql
+        assert params == ()
+
+
+def _fake_classifier_llm(payload):
+    """Runnable that answers every classification with the given payload."""
+    invocations = []
+
+    def _invoke(prompt_value):
+        invocations.append(prompt_value)
+        return AIMessage(content=json.dumps(payload))
+
+    runnable = RunnableLambda(_invoke)
+    runnable._invocations = invocations  # type: ignore[attr-defined]
+    return runnable
+
+
+@pytest.mark.unit
+class TestNormalizeText:
+    """Accent folding used by the classifier key and the stock query."""
+
+    @pytest.mark.parametrize("raw, expected", [
+        ("Cuántas PULSERAS", "cuantas pulseras"),
+        ("Ñandú Pingüino", "nandu pinguino"),
+        ("café é ç", "cafe e c"),
+    ])
+    def test_lowercases_and_strips_accents(self, raw, expected):
+        assert read_agent.normalize_text(raw) == expected
+
+
+@pytest.mark.unit
+class TestParseClassification:
+    """Classifier replies are validated without LangChain's JSON parser."""
+
+    def test_fenced_reply_is_validated_with_defaults(self):
+        message = AIMessage(content='```json\n{"query_type": "PROFIT_QUERY", "reasoning": "r"}\n```')
+
+        parsed = read_agent.parse_classification(message)
+
+        assert parsed["query_type"] == "PROFIT_QUERY"
+        assert parsed["entities"] == {"product_names": [], "time_period": "", "specific_values": []}
+
+    def test_stream_stops_at_the_closing_brace(self):
+        consumed = []
+
+        def chunks():
+            for part in ['```json\n{"reasoning": "a } in text",', ' "query_type": "X"}', "\n```", "tail"]:
+                consumed.append(part)
+                yield AIMessage(content=part)
+
+        text = read_agent.first_json_object(chunks())
+
+        assert text == '```json\n{"reasoning": "a } in text", "query_type": "X"}'
+        assert len(consumed) == 2
+        assert read_agent.parse_classification(text) == {"reasoning": "a } in text", "query_type": "X"}
+
+    def test_off_schema_reply_is_returned_as_plain_json(self):
+        parsed = read_agent.parse_classification('{"type": "STOCK_QUERY"}')
+
+        assert parsed == {"type": "STOCK_QUERY"}
+        assert read_agent.freeze_classification(parsed)[0] == "STOCK_QUERY"
+
+
+@pytest.mark.unit
+class TestClassificationCache:
+    """Repeated questions must not pay for a second LLM classification."""
+
+    def test_cache_key_collapses_accents_and_whitespace(self):
+        assert (
+            read_agent.classification_cache_key("Últimas 7  ventas")
+            == read_agent.classification_cache_key("ultimas 7 ventas")
+        )
+
+    def test_cache_key_keeps_digits(self):
+        assert (
+            read_agent.classification_cache_key("ventas de los últimos 7 días")
+            != read_agent.classification_cache_key("ventas de los últimos 30 días")
+        )
+
+    def test_llm_receives_the_original_question(self, populated_db):
+        llm = _fake_classifier_llm({"query_type": "GENERAL_QUERY", "reasoning": "?"})
+        execute_read = read_agent.create_read_agent(llm)
+
+        execute_read({"user_input": "Cuántas pulseras Talle 2 vendí en 7 días?"})
+
+        sent = llm._invocations[0].to_messages()[-1].content
+        assert sent == "Cuántas pulseras Talle 2 vendí en 7 días?"
+
+    def test_repeated_question_hits_llm_once(self, populated_db):
+        llm = _fake_classifier_llm({
+            "query_type": "STOCK_QUERY",
+            "entities": {"product_names": ["pulseras negras"], "time_period": ""},
+            "reasoning": "stock",
+        })
+        execute_read = read_agent.create_read_agent(llm)
+
+        first = execute_read({"user_input": "cuántas pulseras negras tengo?"})
+        second = execute_read({"user_input": "cuantas  pulseras NEGRAS tengo?"})
+
+        assert len(llm._invocations) == 1
+        assert first["sql_result"] == second["sql_result"]
+
+    def test_system_prompt_is_a_stable_prefix(self):
+        first = read_agent.CLASSIFIER_PROMPT.format_messages(input="cuánto vendí?")
+        second = read_agent.CLASSIFIER_PROMPT.format_messages(input="{stock}")
+
+        assert first[0].content == second[0].content == read_agent.CLASSIFIER_SYSTEM_PROMPT
+        assert second[1].content == "{stock}"
+
+
+@pytest.mark.unit
+class TestKeywordClassification:
+    """Obvious questions are classified without the LLM."""
+
+    @pytest.mark.parametrize("question, expected", [
+        ("cuál es mi ganancia?", "PROFIT_QUERY"),
+        ("gastos de la última semana", "EXPENSE_QUERY"),
+        ("historial de ventas", "SALES_QUERY"),
+        ("cuánto stock tengo de cada producto?", "STOCK_QUERY"),
+        ("¿cuánto he vendido?", "REVENUE_QUERY"),
+    ])
+    def test_obvious_questions_are_keyword_routed(self, question, expected):
+        assert read_agent.keyword_classification(question)[0] == expected
+
+    @pytest.mark.parametrize("question", [
+        "cuántas pulseras negras tengo?",  # needs product_names
+        "ventas y gastos del mes",         # multi-match
+        "cómo viene el negocio?",          # no match
+    ])
+    def test_ambiguous_questions_fall_through_to_llm(self, question):
+        assert read_agent.keyword_classification(question) is None
+
+    def test_only_current_message_is_inspected(self):
+        user_input = (
+            "Contexto de conversación reciente:\n"
+            "Usuario: historial de ventas\n\n"
+            "Mensaje actual: y mis gastos totales?"
+        )
+        assert read_agent.keyword_classification(user_input) == ("EXPENSE_QUERY", "todos", ())
+
+    def test_keyword_route_skips_llm(self, populated_db):
+        llm = _fake_classifier_llm({"query_type": "GENERAL_QUERY", "reasoning": "?"})
+        execute_read = read_agent.create_read_agent(llm)
+
+        result = execute_read({"user_input": "cuál es mi ganancia?"})
+
+        assert llm._invocations == []
+        assert "Ganancia" in result["sql_result"] or "Pérdida" in result["sql_result"]
+
+
+@pytest.mark.unit
+class TestMisroutedInput:
+    """Input the read agent cannot answer is rejected before the LLM."""
+
+    @pytest.mark.parametrize("user_input", [
+        "registrar venta de 2 pulseras",
+        "quiero vender 3 llaveros",
+        "  ?  ",
+    ])
+    def test_rejected_without_llm(self, user_input):
+        llm = _fake_classifier_llm({"query_type": "GENERAL_QUERY", "reasoning": "?"})
+        execute_read = read_agent.create_read_agent(llm)
+
+        result = execute_read({"user_input": user_input})
+
+        assert llm._invocations == []
+        assert result["sql_result"] == read_agent.misrouted_read_reply(user_input)
+
+    @pytest.mark.parametrize("user_input", [
+        "historial de venta",
+        "cuántas pulseras negras tengo?",
+    ])
+    def test_read_questions_pass(self, user_input):
+        assert read_agent.misrouted_read_reply(user_input) is None
+
+
+@pytest.mark.unit
+class TestReadErrors:
+    """Failures are logged and answered with the friendly fallback."""
+
+    def test_failure_is_logged_with_traceback(self, monkeypatch, caplog):
+        def _boom(*_args, **_kwargs):
+            raise RuntimeError("db down")
+
+        monkeypatch.setattr(read_agent, "fetch_all", _boom)
+        monkeypatch.setattr(read_agent, "get_data_version", lambda: None)
+        execute_read = read_agent.create_read_agent(_fake_classifier_llm({}))
+
+        with caplog.at_level("ERROR", logger="agents.read_agent"):
+            result = execute_read({"user_input": "cuál es mi ganancia?"})
+
+        assert result["error"] == "Read agent error: db down"
+        assert caplog.records[-1].exc_info is not None
+
+
+@pytest.mark.unit
+class TestPostWriteSummary:
+    """After a write with no specific question, one snapshot query answers."""
+
+    def test_summary_skips_llm_and_covers_stock_revenue_profit(self, populated_db):
+        llm = _fake_classifier_llm({"query_type": "GENERAL_QUERY", "reasoning": "?"})
+        execute_read = read_agent.create_read_agent(llm)
+
+        result = execute_read({
+            "user_input": "vendí 2 pulseras negras y decime cómo quedó todo",
+            "operation_result": {"success": True},
+        })
+
+        assert llm._invocations == []
+        assert "Ingresos totales" in result["sql_result"]
+        assert "Ganancia" in result["sql_result"] or "Pérdida" in result["sql_result"]
+        assert "pulsera" in result["sql_result"].lower()
+
+    def test_post_write_question_reuses_classification(self, populated_db):
+        llm = _fake_classifier_llm({
+            "query_type": "STOCK_QUERY",
+            "entities": {"product_names": ["pulseras negras"], "time_period": ""},
+            "reasoning": "stock",
+        })
+        execute_read = read_agent.create_read_agent(llm)
+
+        before = execute_read({"user_input": "cuántas pulseras negras tengo?"})
+        after = execute_read({
+            "user_input": "cuántas pulseras negras tengo?",
+            "operation_result": {"success": True},
+        })
+
+        assert len(llm._invocations) == 1
+        assert after["sql_result"] == before["sql_result"] + read_agent.POST_WRITE_NOTE
+
+    def test_named_topic_still_gets_its_own_answer(self):
+        assert read_agent.names_read_intent("vendí 2 pulseras, qué gastos tengo?")
+        assert read_agent.names_read_intent("vendí 2, cuántas pulseras negras tengo?")
+        assert not read_agent.names_read_intent("vendí 2 pulseras")
+
+
+@pytest.fixture
+def shared_conn_db(tmp_path):
+    """Schema-loaded database reached through the real (shared) get_conn."""
+    schema_path = Path(__file__).parent.parent.parent / "root_archive" / "init_complete_database.sql"
+    db_file = tmp_path / "tenant.db"
+    conn = sqlite3.connect(str(db_file))
+    conn.executescript(schema_path.read_text(encoding="utf-8"))
+    conn.close()
+
+    token = database.set_tenant_db_path(str(db_file))
+    yield db_file
+    database.reset_tenant_db_path(token)
+    database.close_connections()
+
+
+@pytest.mark.unit
+class TestResultCache:
+    """Formatted answers are reused until the database changes."""
+
+    def test_repeat_question_skips_sql(self, shared_conn_db, monkeypatch):
+        execute_read = read_agent.create_read_agent(_fake_classifier_llm({}))
+        first = execute_read({"user_input": "cuál es mi ganancia?"})
+
+        def _fail(*args, **kwargs):
+            raise AssertionError("fetch_all should not run on a cache hit")
+
+        monkeypatch.setattr(read_agent, "fetch_all", _fail)
+        second = execute_read({"user_input": "cuál es mi ganancia?"})
+
+        assert second["sql_result"] == first["sql_result"]
+
+    def test_write_invalidates_cached_answer(self, shared_conn_db):
+        execute_read = read_agent.create_read_agent(_fake_classifier_llm({}))
+        before = execute_read({"user_input": "cuál es mi ganancia?"})["sql_result"]
+
+        database.register_expense({"amount_cents": 123456, "description": "Alquiler"})
+        after = execute_read({"user_input": "cuál es mi ganancia?"})["sql_result"]
+
+        assert after != before
+
+    def test_lru_survives_concurrent_access(self):
+        import threading
+
+        cache = read_agent._LockedLRU(maxsize=4)
+        errors = []
+
+        def hammer(offset):
+            try:
+                for i in range(2000):
+                    key = (offset + i) % 16
+                    if cache.get(key) is None:
+                        cache.put(key, str(key))
+            except Exception as exc:  # pragma: no cover - only on a race
+                errors.append(exc)
+
+        threads = [threading.Thread(target=hammer, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert len(cache._entries) <= 4
@@ -24,6 +24,9 @@ from agents.resolver import (
     generate_sku_from_name,
     create_resolver_agent,
     route_after_resolver,
+    extract_from_context,
+    to_cents,
+    add_cents_fields,
 )
 
 
@@ -70,6 +73,21 @@ class TestProductResolutionExact:
         assert "NonexistentProduct123" in result["resolution_error"]
         assert "no encontrado" in result["resolution_error"].lower()  # Spanish error message
 
+    def test_resolve_error_lists_products_from_catalog(self, populated_db, monkeypatch):
+        """Test that the error message lists active products without querying again."""
+        import agents.resolver as resolver
+
+        catalog = resolver.load_product_catalog()
+
+        def _fail(*args, **kwargs):
+            raise AssertionError("error path should not query the database")
+
+        monkeypatch.setattr(resolver, "fetch_all", _fail)
+
+        result = resolve_product_reference({"product_ref": "arcoiris", "quantity": 1}, catalog)
+
+        assert "Pulsera de Granos de Café - Negra" in result["resolution_error"]
+
     def test_resolve_empty_reference_returns_original(self, populated_db):
         """Test that empty product_ref returns item as-is."""
         item = {"quantity": 5}
@@ -170,6 +188,130 @@ class TestProductResolutionFuzzy:
         assert result["product_id"] == 2  # BC-BRACELET-BLACK
         assert "Negra" in result["resolved_name"]
 
+    def test_resolve_reuses_catalog_until_database_changes(self, populated_db, monkeypatch):
+        """Test that the product catalog is loaded once and reloaded after a write."""
+        import database
+        import agents.resolver as resolver
+
+        first = resolve_product_reference({"product_ref": "pulseras doradas", "quantity": 1})
+        assert first["product_id"] == 3
+
+        def _fail(*args, **kwargs):
+            raise AssertionError("catalog should come from the cache")
+
+        with monkeypatch.context() as patched:
+            patched.setattr(resolver, "fetch_all", _fail)
+            second = resolve_product_reference({"product_ref": "BC-KEYCHAIN", "quantity": 1})
+        assert second["resolved_sku"] == "BC-KEYCHAIN"
+
+        with database.get_conn() as conn:
+            conn.execute(
+                "INSERT INTO products (sku, name, unit_price_cents, unit_cost_cents) "
+                "VALUES ('BC-BRACELET-PINK', 'Pulsera Rosa', 3500, 1200)"
+            )
+
+        third = resolve_product_reference({"product_ref": "pulsera rosa", "quantity": 1})
+        assert third["resolved_sku"] == "BC-BRACELET-PINK"
+
+    def test_catalog_cache_never_mixes_tenants(self, tmp_path, monkeypatch):
+        """Test that a tenant loading mid-way through another's load keeps its own catalog."""
+        import sqlite3
+        import threading
+
+        import database
+        import agents.resolver as resolver
+
+        db_paths = {}
+        for tenant, name in [("a", "Pulsera Tenant A"), ("b", "Llavero Tenant B")]:
+            db_paths[tenant] = str(tmp_path / f"{tenant}.db")
+            conn = sqlite3.connect(db_paths[tenant])
+            conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, sku TEXT, name TEXT, is_active INTEGER)")
+            conn.execute("INSERT INTO products VALUES (1, ?, ?, 1)", (f"SKU-{tenant.upper()}", name))
+            conn.commit()
+            conn.close()
+
+        monkeypatch.setattr(resolver, "_CATALOG_CACHE", None)
+        a_reading = threading.Event()
+        b_done = threading.Event()
+        real_fetch_all = resolver.fetch_all
+
+        def interleaving_fetch_all(*args, **kwargs):
+            # Tenant A pauses between its version read and its store while
+            # tenant B loads and caches its own catalog
+            if database.get_current_db_path() == db_paths["a"]:
+                a_reading.set()
+                b_done.wait(timeout=5)
+            return real_fetch_all(*args, **kwargs)
+
+        monkeypatch.setattr(resolver, "fetch_all", interleaving_fetch_all)
+
+        catalogs = {}
+
+        def load(tenant, before=None):
+            if before:
+                before.wait(timeout=5)
+            token = database.set_tenant_db_path(db_paths[tenant])
+            try:
+                catalogs[tenant] = resolver.load_product_catalog()
+            finally:
+                database.reset_tenant_db_path(token)
+            if tenant == "b":
+                b_done.set()
+
+        threads = [
+            threading.Thread(target=load, args=("a",)),
+            threading.Thread(target=load, args=("b", a_reading)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        try:
+            assert catalogs["a"]["available_names"] == "Pulsera Tenant A"
+            assert catalogs["b"]["available_names"] == "Llavero Tenant B"
+
+            # Whatever the cache holds, its version and catalog belong together
+            version, catalog = resolver._CATALOG_CACHE
+            tenant = "a" if version[0] == db_paths["a"] else "b"
+            assert catalog is catalogs[tenant]
+            for tenant in ("a", "b"):
+                token = database.set_tenant_db_path(db_paths[tenant])
+                try:
+                    assert resolver.load_product_catalog()["by_sku"].keys() == {f"SKU-{tenant.upper()}"}
+                finally:
+                    database.reset_tenant_db_path(token)
+        finally:
+            database.close_connections()
+
+    def test_resolve_multi_word_prefers_forms_as_written(self, populated_db):
+        """Test that a name matching the words as written beats a lower id matching variants."""
+        import database
+
+        with database.get_conn() as conn:
+            conn.execute(
+                "INSERT INTO products (sku, name, unit_price_cents, unit_cost_cents) "
+                "VALUES ('BC-RED-THIN', 'Pulsera Roja Fina', 3500, 1200)"
+            )
+            conn.execute(
+                "INSERT INTO products (sku, name, unit_price_cents, unit_cost_cents) "
+                "VALUES ('BC-RED-SET', 'Pulseras Rojas', 3500, 1200)"
+            )
+
+        assert resolve_product_reference({"product_ref": "pulseras rojas"})["resolved_sku"] == "BC-RED-SET"
+        assert resolve_product_reference({"product_ref": "pulsera roja"})["resolved_sku"] == "BC-RED-THIN"
+
+    def test_products_containing_matches_substrings(self, populated_db):
+        """Test that posting lists match name fragments and are memoized."""
+        from agents.resolver import load_product_catalog, products_containing
+
+        catalog = load_product_catalog()
+        negra_ids = products_containing(catalog, "negr")
+
+        assert negra_ids == {2}
+        assert products_containing(catalog, "negr") is negra_ids
+        assert products_containing(catalog, "arcoiris") == frozenset()
+
 
 # ==============================================================================
 # VARIANT HINTS TESTS (6 tests)
@@ -194,6 +336,11 @@ class TestVariantHints:
         hints = detect_variant_hints("agrego stock de clasicas")
         assert "clasica" in hints
 
+    def test_detect_variant_hints_multiple(self):
+        """Test that every variant mentioned is detected, English tokens included."""
+        hints = detect_variant_hints("400 clasicas, 200 gold y 50 black")
+        assert hints == {"clasica", "dorada", "negra"}
+
     def test_apply_variant_hint_when_missing(self):
         """Test that variant hint is applied when missing from product_ref."""
         item = {"product_ref": "pulsera", "quantity": 10}
@@ -234,6 +381,26 @@ class TestVariantHints:
         assert result["product_id"] == 3
         assert "Dorada" in result["resolved_name"]
 
+    def test_enforce_variant_alignment_skips_variants_missing_from_catalog(self, populated_db, monkeypatch):
+        """Test that no retry runs for a hinted variant no product is named after."""
+        import agents.resolver as resolver
+        import database
+
+        with database.get_conn() as conn:
+            conn.execute("UPDATE products SET name = 'Pulsera Oro' WHERE id = 3")
+
+        def _fail(*args, **kwargs):
+            raise AssertionError("retry cannot match any product")
+
+        monkeypatch.setattr(resolver, "resolve_product_reference", _fail)
+
+        original_item = {"product_ref": "pulsera", "quantity": 5}
+        resolved_item = {**original_item, "product_id": 1, "resolved_name": "Pulsera Clásica"}
+
+        result = enforce_variant_alignment(original_item, resolved_item, {"dorada"})
+
+        assert result is resolved_item
+
 
 # ==============================================================================
 # VARIANT RESOLUTION PARAMETRIZED (Comprehensive test)
@@ -277,6 +444,14 @@ class TestDateResolution:
         expected = (datetime.now().date() - timedelta(days=1)).isoformat()
         assert result == expected
 
+    def test_resolve_date_uses_given_reference_date(self):
+        """Test that relative dates resolve against the passed-in today."""
+        from datetime import date
+
+        assert resolve_date("ayer", date(2024, 3, 1)) == "2024-02-29"
+        assert resolve_date("anteayer", date(2024, 3, 1)) == "2024-02-28"
+        assert resolve_date("Hoy", date(2024, 3, 1)) == "2024-03-01"
+
     def test_resolve_date_iso_format(self):
         """Test that ISO date format is returned as-is."""
         iso_date = "2024-01-15"
@@ -348,6 +523,25 @@ class TestFieldValidation:
         assert "ambiguous_comma_name_split" not in missing
         assert entities.get("_comma_name_detected") is not True
 
+    def test_resolver_fills_product_defaults_after_validation(self, test_db):
+        """The resolver node, not the validator, generates the SKU and
+        defaults the unit cost; list-like names get no SKU."""
+        resolver_fn = create_resolver_agent(llm=None)
+
+        result = resolver_fn({
+            "normalized_entities": {"name": "Remera Azul"},
+            "operation_type": "REGISTER_PRODUCT",
+            "user_input": "",
+        })
+        entities = result["normalized_entities"]
+        assert result["missing_fields"] == []
+        assert entities["sku"].startswith("BC-")
+        assert entities["unit_cost_cents"] == 0
+
+        entities = {"name": "medias, pantaletas y soquetes"}
+        validate_required_fields("REGISTER_PRODUCT", entities)
+        assert "sku" not in entities
+
     def test_comma_name_marker_renders_clarifier_in_final_answer(self):
         """PR-A fix #1: the marker is translated by the final_answer node
         into a user-facing clarifier listing the parsed candidates."""
@@ -485,6 +679,54 @@ class TestProposeProductCreation:
 
         assert result.get("intent") != "PROPOSE_PRODUCT_CREATION"
 
+    def test_already_resolved_items_skip_lookup(self, populated_db, monkeypatch):
+        """Test that items carrying a product_id are not resolved again."""
+        import agents.resolver as resolver
+
+        def _fail(*args, **kwargs):
+            raise AssertionError("resolved items should not be looked up")
+
+        monkeypatch.setattr(resolver, "load_product_catalog", _fail)
+        resolver_fn = self._resolver()
+        result = resolver_fn(self._state(
+            {"items": [{"product_id": 2, "product_ref": "pulsera", "quantity": 3, "unit_price": 35}]},
+            operation_type="REGISTER_SALE",
+            user_input="vendí 3 pulseras doradas",
+        ))
+
+        item = result["normalized_entities"]["items"][0]
+        assert item["product_id"] == 2
+        # The "doradas" hint must not be appended to an already resolved item
+        assert item["product_ref"] == "pulsera"
+        assert item["unit_price_cents"] == 3500
+        assert "error" not in result
+
+    def test_multi_item_sale_loads_catalog_once(self, populated_db, monkeypatch):
+        """Test that all items of a request resolve against one catalog load."""
+        import agents.resolver as resolver
+
+        loads = []
+        real_load = resolver.load_product_catalog
+
+        def counting_load():
+            loads.append(1)
+            return real_load()
+
+        monkeypatch.setattr(resolver, "load_product_catalog", counting_load)
+        resolver_fn = self._resolver()
+        result = resolver_fn(self._state(
+            {"items": [
+                {"product_ref": "pulsera negra", "quantity": 1},
+                {"product_ref": "pulsera dorada", "quantity": 2},
+                {"product_ref": "llavero", "quantity": 3},
+            ]},
+            operation_type="REGISTER_SALE",
+            user_input="vendí tres productos",
+        ))
+
+        assert [item["product_id"] for item in result["normalized_entities"]["items"]] == [2, 3, 4]
+        assert len(loads) == 1
+
     def test_route_after_resolver_propose_goes_to_final_answer(self):
         state = {"intent": "PROPOSE_PRODUCT_CREATION"}
         assert route_after_resolver(state) == "final_answer"
@@ -504,6 +746,11 @@ class TestUtilityFunctions:
         assert normalize_text("Pulsera") == "pulsera"
         assert normalize_text("Clásica") == "clasica"
 
+    def test_normalize_text_folds_uppercase_and_rare_accents(self):
+        """Test that uppercase accents and marks outside the table are removed."""
+        assert normalize_text("ARCOÍRIS Ñandú") == "arcoiris nandu"
+        assert normalize_text("Crème Brûlée Ōsaka") == "creme brulee osaka"
+
     def test_generate_word_variations_plural_to_singular(self):
         """Test word variations: plural to singular."""
         variations = generate_word_variations("pulseras")
@@ -526,6 +773,33 @@ class TestUtilityFunctions:
         variations_en = translate_product_terms("black")
         assert "negra" in " ".join(variations_en)
 
+    def test_to_cents_rounds_fractional_prices(self):
+        """Test that float prices convert to the cents they were written as."""
+        assert to_cents(19.99) == 1999
+        assert to_cents(0.29) == 29
+        assert to_cents(35) == 3500
+        assert to_cents(12.345) == 1235
+
+    def test_add_cents_fields_converts_missing_amounts_only(self):
+        """Test that USD amounts get cents once, and non-numbers are left for validation."""
+        entities = {"unit_price": 0.29, "amount": "mucho"}
+        add_cents_fields(entities)
+        assert entities["unit_price_cents"] == 29
+        assert "amount_cents" not in entities
+
+        entities = {"amount": 10, "amount_cents": 1500}
+        add_cents_fields(entities)
+        assert entities["amount_cents"] == 1500
+
+    def test_translate_product_terms_keeps_insertion_order(self):
+        """Test that the original text comes first and variations are unique."""
+        variations = translate_product_terms("pulsera negra")
+
+        assert variations[0] == "pulsera negra"
+        assert variations[1:3] == ("bracelet negra", "pulsera black")
+        assert len(variations) == len(set(variations))
+        assert translate_product_terms("pulsera negra") == variations
+
     def test_generate_sku_from_name_pulsera(self, test_db):
         """Test SKU generation from product name (pulsera)."""
         sku = generate_sku_from_name("Pulseras Azules")
@@ -536,8 +810,123 @@ class TestUtilityFunctions:
         sku = generate_sku_from_name("Llavero Rojo")
         assert sku == "BC-LLAV-ROJO"  # Dynamic extraction keeps original form
 
+    def test_generate_sku_from_name_drops_punctuation(self, test_db):
+        """Test that punctuation separates words and never reaches the SKU."""
+        assert generate_sku_from_name("Pulseras (XL) Negras") == "BC-PULS-XL-NEGRAS"
+        assert generate_sku_from_name("Pulseras-Azules") == "BC-PULS-AZULES"
+
     def test_generate_sku_from_name_fallback(self, test_db):
         """Test SKU generation with fallback for unknown type/color."""
         sku = generate_sku_from_name("Unknown Product Name")
         assert sku.startswith("BC-")
         assert "PROD" in sku or "STD" in sku
+
+    def test_generate_sku_from_name_deduplicates_against_catalog(self, test_db, product_builder, monkeypatch):
+        """Test that an existing SKU gets a numeric suffix without per-candidate queries."""
+        import agents.resolver as resolver
+        import database
+
+        database.register_product(product_builder.build(sku="BC-LLAV-STD", name="Llavero"))
+        resolver.load_product_catalog()
+
+        def _fail(*args, **kwargs):
+            raise AssertionError("SKU probes should use the catalog")
+
+        monkeypatch.setattr(resolver, "fetch_one", _fail)
+
+        sku = generate_sku_from_name("Llavero")
+        assert sku == "BC-LLAV-STD-2"
+
+    def test_product_batch_gets_distinct_skus(self, test_db):
+        """Test that items created together never share a generated SKU."""
+        from agents.resolver import apply_product_defaults
+
+        entities = {"items": [
+            {"name": "Pulseras Azules"},
+            {"name": "Pulseras Azules"},
+            {"name": "Llavero", "sku": "BC-LLAV-STD"},
+            {"name": "Llavero"},
+        ]}
+        apply_product_defaults("REGISTER_PRODUCT", entities)
+
+        assert [item["sku"] for item in entities["items"]] == [
+            "BC-PULS-AZULES", "BC-PULS-AZULES-2", "BC-LLAV-STD", "BC-LLAV-STD-2",
+        ]
+
+    def test_product_batch_loads_sku_index_once(self, test_db, monkeypatch):
+        """Test that an N-item batch probes one SKU index, not N catalog loads."""
+        import agents.resolver as resolver
+
+        calls = []
+        real_index = resolver.existing_sku_index
+
+        def counting_index():
+            calls.append(1)
+            return real_index()
+
+        monkeypatch.setattr(resolver, "existing_sku_index", counting_index)
+
+        entities = {"items": [{"name": "Pulseras Azules"}, {"name": "Llavero"}, {"name": "Collar"}]}
+        resolver.apply_product_defaults("REGISTER_PRODUCT", entities)
+
+        assert len(calls) == 1
+
+    def test_generate_sku_uses_indexed_probe_without_data_version(self, test_db, product_builder, monkeypatch):
+        """Test that SKU probes skip the full catalog when there is no version to cache on."""
+        import agents.resolver as resolver
+        import database
+
+        database.register_product(product_builder.build(sku="BC-LLAV-STD", name="Llavero"))
+        monkeypatch.setattr(resolver, "get_data_version", lambda: None)
+
+        def _fail(*args, **kwargs):
+            raise AssertionError("catalog should not be loaded per SKU")
+
+        monkeypatch.setattr(resolver, "load_product_catalog", _fail)
+
+        assert generate_sku_from_name("Llavero") == "BC-LLAV-STD-2"
+
+
+# ==============================================================================
+# CONTEXT EXTRACTION
+# ==============================================================================
+
+@pytest.mark.unit
+class TestExtractFromContext:
+    """Tests for pulling missing fields out of the conversation text."""
+
+    def test_extract_name_from_message(self):
+        """Test that the product name follows the creation verb."""
+        assert extract_from_context("quiero crear pulsera roja", "name") == "pulsera roja"
+
+    def test_extract_name_prefers_current_message(self):
+        """Test that a name in the current message beats one in the context."""
+        user_input = "Usuario: quiero crear llaveros\nMensaje actual: no, crear pulsera roja"
+        assert extract_from_context(user_input, "name") == "pulsera roja"
+
+    def test_extract_name_drops_whole_filler_words_only(self):
+        """Test that articles are removed without cutting into product words."""
+        assert extract_from_context("crear unas pulseras clasicas", "name") == "pulseras clasicas"
+
+    def test_extract_price_prefers_current_message(self):
+        """Test that a price in the current message beats one in the context."""
+        user_input = "El precio es $5\nMensaje actual: cuesta $12.50"
+        assert extract_from_context(user_input, "unit_price") == 12.5
+
+    def test_extract_price_falls_back_to_context(self):
+        """Test that the context is searched when the message has no price."""
+        user_input = "lo vendo a $8\nMensaje actual: dale, registralo"
+        assert extract_from_context(user_input, "unit_price") == 8.0
+
+    def test_extract_price_keeps_pattern_priority(self):
+        """Test that an explicit $ amount wins over an earlier bare number."""
+        assert extract_from_context("vendí 3 a $10", "unit_price") == 10.0
+
+    def test_extract_without_trigger_words_returns_none(self):
+        """Test that text with no name or price cue yields nothing."""
+        assert extract_from_context("dale, gracias", "name") is None
+        assert extract_from_context("tengo 3 negras", "unit_price") is None
+
+    def test_extract_unknown_field_returns_none(self):
+        """Test that fields without patterns are not guessed."""
+        assert extract_from_context("crear pulsera roja", "quantity") is None
@@ -95,6 +95,60 @@ def test_fuzzy_match_scores_sorted(populated_db):
             assert candidates[i]["score"] >= candidates[i + 1]["score"]
 
 
+@pytest.mark.unit
+def test_fuzzy_match_keeps_top_candidates(populated_db, product_builder):
+    """Test that only the best FUZZY_MAX_CANDIDATES candidates are returned."""
+    import database
+    from agents.resolver import FUZZY_MAX_CANDIDATES
+
+    for n in range(FUZZY_MAX_CANDIDATES + 2):
+        database.register_product(product_builder.build(sku=f"AZUL-{n}", name=f"Pulsera Azul {n}"))
+
+    candidates = fuzzy_match_with_scores("azul 3")
+
+    assert len(candidates) == FUZZY_MAX_CANDIDATES
+    assert candidates[0]["sku"] == "AZUL-3"
+
+
+@pytest.mark.unit
+def test_fuzzy_match_uses_given_catalog(populated_db, monkeypatch):
+    """Test that scoring runs in memory against the catalog it is given."""
+    import agents.resolver as resolver
+
+    catalog = resolver.load_product_catalog()
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("fuzzy matching should not query the database")
+
+    monkeypatch.setattr(resolver, "fetch_one", _fail)
+    monkeypatch.setattr(resolver, "fetch_all", _fail)
+    monkeypatch.setattr(resolver, "get_data_version", _fail)
+
+    candidates = fuzzy_match_with_scores("pulsera dorada", catalog)
+
+    assert candidates[0]["sku"] == "BC-BRACELET-GOLD"
+
+
+@pytest.mark.unit
+def test_fuzzy_match_memoizes_scores_per_catalog(populated_db, monkeypatch):
+    """Test that a repeated reference reuses its scores from the catalog."""
+    import agents.resolver as resolver
+
+    catalog = resolver.load_product_catalog()
+    first = fuzzy_match_with_scores("negra", catalog)
+    first[0]["score"] = 0.0
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("scores should come from the catalog memo")
+
+    monkeypatch.setattr(resolver, "_score_products", _fail)
+
+    second = fuzzy_match_with_scores("negra", catalog)
+
+    assert [c["sku"] for c in second] == [c["sku"] for c in first]
+    assert second[0]["score"] != 0.0
+
+
 # ==============================================================================
 # Tests for llm_disambiguate_product
 # ==============================================================================
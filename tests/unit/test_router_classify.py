@@ -0,0 +1,146 @@
+"""Tests for the router's LLM call: streamed parsing and the classification cache.
+
+The LLM is replaced by a RunnableLambda that counts invocations, so the
+tests check when the router goes back to the model and when it does not.
+"""
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from agents.router import create_router_agent, router_cache_key
+
+
+def _fake_router_llm(payload, template="{}"):
+    """Runnable that answers every classification with the given payload."""
+    invocations = []
+
+    def _invoke(prompt_value):
+        invocations.append(prompt_value)
+        return AIMessage(content=template.format(json.dumps(payload)))
+
+    runnable = RunnableLambda(_invoke)
+    runnable._invocations = invocations  # type: ignore[attr-defined]
+    return runnable
+
+
+_SALE = {
+    "intent": "WRITE_OPERATION",
+    "operation_type": "REGISTER_SALE",
+    "confidence": 0.95,
+    "missing_fields": [],
+    "normalized_entities": {"items": [{"product_ref": "pulseras negras", "quantity": 2}]},
+    "reasoning": "r",
+}
+
+
+@pytest.mark.unit
+class TestRouterCache:
+    def test_cache_key_only_collapses_whitespace(self):
+        assert router_cache_key("  vendí 2   Pulseras\n") == "vendí 2 Pulseras"
+
+    def test_repeated_input_skips_the_llm(self):
+        llm = _fake_router_llm(_SALE)
+        route_intent = create_router_agent(llm)
+
+        first = route_intent({"user_input": "vendí 2 pulseras negras"})
+        first["normalized_entities"]["items"][0]["quantity"] = 99
+        second = route_intent({"user_input": "vendí 2  pulseras negras "})
+
+        assert len(llm._invocations) == 1
+        assert second["normalized_entities"]["items"][0]["quantity"] == 2
+
+    def test_low_confidence_is_not_cached(self):
+        llm = _fake_router_llm({**_SALE, "confidence": 0.3})
+        route_intent = create_router_agent(llm)
+
+        route_intent({"user_input": "algo"})
+        route_intent({"user_input": "algo"})
+
+        assert len(llm._invocations) == 2
+
+    def test_cache_clear_forces_a_new_classification(self):
+        llm = _fake_router_llm(_SALE)
+        route_intent = create_router_agent(llm)
+
+        route_intent({"user_input": "vendí 2 pulseras negras"})
+        route_intent.cache_clear()
+        route_intent({"user_input": "vendí 2 pulseras negras"})
+
+        assert len(llm._invocations) == 2
+
+
+@pytest.mark.unit
+class TestRouterParsing:
+    def test_fenced_reply_with_trailing_text_is_parsed(self):
+        llm = _fake_router_llm(_SALE, template="```json\n{}\n```\nEspero que sirva {{")
+        route_intent = create_router_agent(llm)
+
+        state = route_intent({"user_input": "vendí 2 pulseras negras"})
+
+        assert state["intent"] == "WRITE_OPERATION"
+        assert state["normalized_entities"]["items"][0]["quantity"] == 2
+
+
+@pytest.mark.unit
+class TestGreetingFastPath:
+    @pytest.mark.parametrize("user_input", [
+        "hola!",
+        "Buenos días",
+        "hey, cómo andas?",
+        "muchas gracias",
+        "Contexto de conversación reciente:\nUsuario: vendí 2 pulseras\n\nMensaje actual: chau",
+    ])
+    def test_small_talk_skips_the_llm(self, user_input):
+        llm = _fake_router_llm(_SALE)
+        route_intent = create_router_agent(llm)
+
+        state = route_intent({"user_input": user_input})
+
+        assert state["intent"] == "GREETING"
+        assert llm._invocations == []
+
+    @pytest.mark.parametrize("user_input", ["hola, vendí 2 pulseras negras", "si"])
+    def test_anything_else_goes_to_the_llm(self, user_input):
+        llm = _fake_router_llm(_SALE)
+        route_intent = create_router_agent(llm)
+
+        state = route_intent({"user_input": user_input})
+
+        assert state["intent"] == "WRITE_OPERATION"
+        assert len(llm._invocations) == 1
+
+
+@pytest.mark.unit
+class TestRouterInflight:
+    def test_concurrent_identical_inputs_share_one_llm_call(self):
+        import threading
+
+        started = threading.Event()
+        release = threading.Event()
+        invocations = []
+
+        def _invoke(prompt_value):
+            invocations.append(prompt_value)
+            started.set()
+            release.wait(timeout=5)
+            return AIMessage(content=json.dumps(_SALE))
+
+        route_intent = create_router_agent(RunnableLambda(_invoke))
+        results = []
+
+        def _route():
+            results.append(route_intent({"user_input": "vendí 2 pulseras negras"}))
+
+        first = threading.Thread(target=_route)
+        first.start()
+        started.wait(timeout=5)
+        second = threading.Thread(target=_route)
+        second.start()
+        release.set()
+        first.join(timeout=5)
+        second.join(timeout=5)
+
+        assert len(invocations) == 1
+        assert [r["intent"] for r in results] == ["WRITE_OPERATION", "WRITE_OPERATION"]
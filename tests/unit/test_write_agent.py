@@ -8,11 +8,12 @@ Tests cover:
 - ADD_STOCK handler (4 tests)
 - CANCEL_SALE handler (3 tests)
 - CANCEL_EXPENSE handler (2 tests)
+- Financial summary footer (5 tests)
 
-Total: 20 tests
+Total: 22 tests
 """
 import pytest
-from agents.write_agent import create_write_agent
+from agents.write_agent import create_write_agent, _format_financial_footer
 from agents.state import AgentState
 from database import add_stock, register_sale, register_expense
 
@@ -781,3 +782,38 @@ class TestCancelExpenseHandler:
 
         assert "error" in result
         assert "Operación fallida" in result["final_answer"]
+
+
+# ==============================================================================
+# FINANCIAL FOOTER TESTS (5 tests)
+# ==============================================================================
+
+@pytest.mark.unit
+class TestFinancialFooter:
+    """Tests for the revenue/profit block appended to write summaries."""
+
+    def test_revenue_and_profit(self):
+        footer = _format_financial_footer({"revenue_usd": 175.0, "profit_usd": 125.5})
+
+        assert footer == "\n\n_Ventas totales: $175.00_\n_Ganancia acumulada: $125.50_"
+
+    def test_negative_profit_is_a_loss(self):
+        footer = _format_financial_footer({"profit_usd": -20.0})
+
+        assert footer == "\n\n_Pérdida acumulada: $20.00_"
+
+    def test_no_figures_gives_empty_footer(self):
+        assert _format_financial_footer({"status": "ok"}) == ""
+
+    def test_zero_figures_are_shown_by_default(self):
+        footer = _format_financial_footer({"revenue_usd": 0.0, "profit_usd": 0.0})
+
+        assert footer == "\n\n_Ventas totales: $0.00_\n_Ganancia acumulada: $0.00_"
+
+    def test_hide_zero_suppresses_zero_figures(self):
+        """The sale confirmation keeps hiding zero totals, as it always did."""
+        assert _format_financial_footer({"revenue_usd": 0.0, "profit_usd": 0.0}, hide_zero=True) == ""
+        assert (
+            _format_financial_footer({"revenue_usd": 70.0, "profit_usd": 0.0}, hide_zero=True)
+            == "\n\n_Ventas totales: $70.00_"
+        )